@@ -1,9 +1,10 @@
 import json
 import uuid
 from threading import Thread
+from flask import request
 from flask.ext.restful import reqparse, Resource
 
-from stretch.agent.app import app
+from stretch.agent.app import app, TaskException
 from stretch.agent import objects, resources
 
 
@@ -36,6 +37,36 @@ class NodeListResource(resources.ObjectListResource):
     obj_class = objects.Node
 
 
+class ImageListResource(Resource):
+    def get(self):
+        return {'results': objects.get_images()}
+
+
+class StatsResource(Resource):
+    def get(self):
+        return objects.get_stats()
+
+
+class BatchResource(Resource):
+    def post(self):
+        """
+        Adds the nodes of a batch that do not exist yet, then runs a task
+        that pulls the batch's nodes and adds its instances.
+        """
+        batch = request.json
+        for node_id in batch.get('nodes', []):
+            if not objects.Node.exists(node_id):
+                objects.Node.create({'id': node_id})
+
+        task = objects.Task.create({
+            'id': str(uuid.uuid4()),
+            'object_id': None,
+            'object_name': 'batch'
+        })
+        Thread(target=task.run, args=(run_batch, batch, None)).start()
+        return task.data, 201
+
+
 class TaskListResource(Resource):
     def get(self, _id):
         return objects.Task(str(_id)).data
@@ -102,9 +133,29 @@ def verify_args(args):
         raise Exception('neither `sha` nor `app_path` was specified')
 
 
+def run_batch(obj, batch):
+    try:
+        for args in batch.get('pulls', []):
+            objects.Node(args.pop('node_id')).pull(args)
+        for args in batch.get('instances', []):
+            objects.Instance.create(args)
+    except TaskException:
+        raise
+    except Exception as e:
+        raise TaskException(str(e))
+
+
+def configure_prefetch_parser(parser):
+    parser.add_argument('sha', type=str, required=True)
+    parser.add_argument('image', type=str, required=True)
+
+
+def prefetch(node, args):
+    node.prefetch(args)
+
+
 def pull(node, args):
-    raise Exception(args)
-    args['ports'] = json.loads(args['ports'])
+    # `verify_args` has already decoded the ports
     node.pull(args)
 
 
@@ -119,8 +170,15 @@ resources.add_task_resource('nodes', get_task_list(objects.Node, {
         'parser_config': configure_parser,
         'verify_args': verify_args,
         'task': pull
+    },
+    'prefetch': {
+        'parser_config': configure_prefetch_parser,
+        'task': prefetch
     }
 }))
 resources.add_tasks_resource(TaskListResource)
+resources.add_list_resource('images', ImageListResource)
+resources.add_list_resource('stats', StatsResource)
+resources.add_list_resource('batch', BatchResource)
 
 # TODO: Lock group tasks across processes; use celery or db
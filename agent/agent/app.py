@@ -8,6 +8,8 @@ app = Flask(__name__)
 api = Api(app, catch_all_404s=True)
 container_dir = '/usr/share/stretch'
 agent_dir = '/var/lib/stretch/agent'
+# Number of release images kept on the host for every node
+image_history = 3
 
 
 class TaskException(Exception):
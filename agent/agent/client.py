@@ -4,15 +4,95 @@ from urlparse import urljoin
 from django.conf import settings
 import gevent
 
+from stretch import utils, resilience
+
 # TODO: patch networking IO
 
 
 class AgentClient(object):
+    # Arguments of `<object>:add` procedures after the object's id
+    add_args = {
+        'instance': ('node_id', 'host_name', 'config_key')
+    }
+    task_poll_interval = 0.5
+
     def __init__(self, host):
         self.host = host
         self.cert = settings.STRETCH_AGENT_CERT
         self.base_url = 'https://%s:%s' % (host.address,
                                            settings.STRETCH_AGENT_PORT)
+        self.target = 'agent:%s' % host.address
+
+    def call(self, procedure, object_id, *args):
+        """
+        Calls a procedure on the agent. `<object>:add` and `<object>:remove`
+        create and delete objects. Any other procedure runs the object's task
+        of the same name and waits for it to finish.
+
+        Every request is limited by `STRETCH_AGENT_TIMEOUT` and the current
+        deadline, and is failed fast by `stretch.resilience`. Only requests
+        that are safe to repeat are retried: creating an object or starting a
+        task is tried once.
+
+        :Parameters:
+          - `procedure`: the procedure's name, e.g. `node:pull`.
+          - `object_id`: the id of the object to call the procedure on.
+          - `args`: the procedure's arguments.
+        """
+        name, action = procedure.split(':')
+        if action == 'add':
+            data = dict(zip(self.add_args.get(name, ()), args))
+            data['id'] = object_id
+            return self.request('post', '%ss' % name, data=data, attempts=1)
+        elif action == 'remove':
+            return self.request('delete', '%ss/%s' % (name, object_id))
+        else:
+            return self.run_task('%ss/%s' % (name, object_id), action,
+                                 *args[:1])
+
+    def run_task(self, path, task, args=None):
+        """
+        Runs a task on an agent object and blocks until it finishes. Raises
+        `DeadlineExceeded` if the deadline runs out first.
+        """
+        data = dict(args or {})
+        data['task'] = task
+        result = self.request('post', '%s/tasks' % path, data=data,
+                              attempts=1)
+        self.wait_for_task(result['id'])
+
+    def wait_for_task(self, task_id):
+        task_url = self.get_url('tasks/%s' % task_id)
+        while self.task_running(task_url):
+            utils.get_deadline().check()
+            gevent.sleep(self.task_poll_interval)
+
+    def task_running(self, task_url):
+        task = resilience.call(self.target, self.send, ('get', task_url))
+        if task['status'] == 'FAILED':
+            raise Exception('agent task failed: %s' % task['error'])
+        return task['status'] != 'FINISHED'
+
+    def request(self, method, path, attempts=None, **kwargs):
+        """
+        Sends a request to the agent through `stretch.resilience`. Requests
+        that are not safe to repeat should pass `attempts=1`.
+        """
+        return resilience.call(self.target, self.send,
+                               (method, self.get_url(path)), kwargs,
+                               attempts=attempts)
+
+    def send(self, method, url, **kwargs):
+        response = getattr(requests, method)(url, cert=self.cert,
+            timeout=utils.get_timeout(settings.STRETCH_AGENT_TIMEOUT),
+            **kwargs)
+        response.raise_for_status()
+        if response.status_code == 204:
+            return None
+        return response.json()
+
+    def get_url(self, path):
+        return urljoin(self.base_url, '/v1/%s' % path)
 
     def add_node(self, node):
         return self.call('node:add', str(node.pk))
@@ -21,6 +101,11 @@ class AgentClient(object):
         return self.call('node:remove', str(node.pk))
 
     def pull_node(self, node, env, release=None):
+        args = self.get_pull_args(node, env, release)
+        args['ports'] = json.dumps(args['ports'])
+        return self.call('node:pull', str(node.pk), args)
+
+    def get_pull_args(self, node, env, release=None):
         ports = dict([(port.name, port.number) for port in node.ports.all()])
 
         if release:
@@ -32,15 +117,63 @@ class AgentClient(object):
             app_path = env.app_paths[node.name]
             image = node.get_image(local=True)
 
-        return self.call('node:pull', str(node.pk), {
+        return {
             'sha': sha,
             'app_path': app_path,
-            'ports': json.dumps(ports),
+            'ports': ports,
             'env_id': str(env.pk),
             'env_name': env.name,
             'image': image
+        }
+
+    def apply_batch(self, nodes=(), pulls=(), instances=()):
+        """
+        Adds nodes, pulls nodes and then adds instances with one request,
+        and blocks until the agent has finished.
+
+        :Parameters:
+          - `nodes`: the nodes to add.
+          - `pulls`: `(node, env, release)` tuples of the nodes to pull,
+          where `release` is `None` to pull from source.
+          - `instances`: the instances to add.
+        """
+        data = {
+            'nodes': [str(node.pk) for node in nodes],
+            'pulls': [dict(self.get_pull_args(node, env, release),
+                           node_id=str(node.pk))
+                      for node, env, release in pulls],
+            'instances': [{
+                'id': str(instance.pk),
+                'node_id': str(instance.node.pk),
+                'host_name': instance.host.name,
+                'config_key': instance.config_key
+            } for instance in instances]
+        }
+        result = self.request('post', 'batch', data=json.dumps(data),
+                              headers={'Content-Type': 'application/json'},
+                              attempts=1)
+        self.wait_for_task(result['id'])
+
+    def prefetch_node(self, node, release):
+        return self.call('node:prefetch', str(node.pk), {
+            'sha': release.sha,
+            'image': node.get_image(local=False, private=True)
         })
 
+    def get_images(self):
+        """
+        Returns the images on the host and their sizes in bytes.
+        """
+        return self.request('get', 'images')['results']
+
+    def get_stats(self):
+        """
+        Returns the host's load, e.g. `{'cpu': 0.5, 'memory': 0.25}` for a
+        load average of half the host's CPUs and a quarter of its memory in
+        use.
+        """
+        return self.request('get', 'stats')
+
     def add_instance(self, instance, host):
         return self.call('instance:add', str(instance.pk),
             str(instance.node.pk), host.name, instance.config_key)
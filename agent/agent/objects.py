@@ -1,10 +1,15 @@
 import os
+import re
 import json
 import uuid
+import threading
+import multiprocessing
 from datetime import datetime
 
 from stretch import utils, config_managers
-from stretch.agent.app import TaskException, agent_dir, container_dir
+from stretch.salt_api import caller_client
+from stretch.agent.app import (TaskException, agent_dir, container_dir,
+                               image_history)
 from stretch.agent import resources
 
 
@@ -60,7 +65,7 @@ class Instance(resources.PersistentObject):
         self.compile_templates(node)
 
         # Run container
-        cmd = ['docker', 'run', '-d'] + self.get_run_args(node)
+        cmd = ['docker', 'run', '-d'] + self.get_run_args(node) + [node.image]
         cid = utils.run_cmd(cmd)[0].strip()
 
         # Get ports
@@ -169,6 +174,65 @@ class Instance(resources.PersistentObject):
         return self.data['cid'] != None
 
 
+class ImagePuller(object):
+    """
+    Serializes docker pulls on the host.
+
+    Concurrent pulls of the same image are deduplicated: the first caller runs
+    `docker pull` and every other caller waits for it to finish. Prefetches
+    run one at a time and only start while no deploy pull is in progress, so
+    a deploy never has to share the host's bandwidth with a prefetch it did
+    not ask for.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pulling = {}
+        self.deploy_pulls = 0
+        self.prefetching = False
+
+    def pull(self, image, prefetch=False):
+        """
+        Pulls `image`, or waits for an in-progress pull of the same image.
+
+        :Parameters:
+          - `image`: the image to pull.
+          - `prefetch`: `True` if the pull is a low-priority prefetch.
+        """
+        with self.condition:
+            if prefetch:
+                while self.deploy_pulls or self.prefetching:
+                    self.condition.wait()
+                self.prefetching = True
+            else:
+                self.deploy_pulls += 1
+
+            event = self.pulling.get(image)
+            owner = event is None
+            if owner:
+                event = self.pulling[image] = threading.Event()
+
+        try:
+            if owner:
+                try:
+                    utils.run_cmd(['docker', 'pull', image])
+                finally:
+                    with self.condition:
+                        self.pulling.pop(image, None)
+                        event.set()
+            else:
+                event.wait()
+        finally:
+            with self.condition:
+                if prefetch:
+                    self.prefetching = False
+                else:
+                    self.deploy_pulls -= 1
+                self.condition.notify_all()
+
+
+image_puller = ImagePuller()
+
+
 class Node(resources.PersistentObject):
     name = 'node'
     attrs = {
@@ -177,13 +241,20 @@ class Node(resources.PersistentObject):
         'app_path': None,
         'sha': None,
         'ports': {},
-        'image': None
+        'image': None,
+        'images': []
     }
 
     def pull(self, args):
         # Pull image
         if not args['app_path']:
-            utils.run_cmd(['docker', 'pull', args['image']])
+            image = get_image_tag(args['image'], args['sha'])
+            # Images of recent releases are kept, so a rollback only has to
+            # pull images that are no longer on the host.
+            if not image_exists(image):
+                image_puller.pull(image)
+            if args['sha']:
+                self.retain_image(image)
 
         # Prepare to pull templates
         templates_path = self.get_templates_path()
@@ -195,7 +266,24 @@ class Node(resources.PersistentObject):
         # Pull templates
         caller_client().function('cp.get_dir', src, templates_path)
 
-        node.update(args)
+        self.update(args)
+
+    def prefetch(self, args):
+        # Only the image is pulled. The node keeps its current release until
+        # it is pulled by a deploy.
+        image = get_image_tag(args['image'], args['sha'])
+        if not image_exists(image):
+            image_puller.pull(image, prefetch=True)
+
+    def retain_image(self, image):
+        """
+        Records `image` as the node's most recent release image and removes
+        release images older than the last `image_history` releases.
+        """
+        images = [image] + [i for i in self.data['images'] if i != image]
+        for old_image in images[image_history:]:
+            utils.run_cmd(['docker', 'rmi', old_image], allow_errors=True)
+        self.update({'images': images[:image_history]})
 
     def get_templates_path(self):
         return os.path.join(agent_dir, 'templates', 'nodes', self.data['_id'])
@@ -208,6 +296,76 @@ class Node(resources.PersistentObject):
     def pulled(self):
         return (self.data['sha'] != None) or (self.data['app_path'] != None)
 
+    @property
+    def image(self):
+        return get_image_tag(self.data['image'], self.data['sha'])
+
+
+def get_image_tag(image, sha=None):
+    """
+    Returns the tag of a node image. Release images are tagged with the
+    release's SHA.
+    """
+    if sha:
+        return '%s:%s' % (image, sha)
+    return image
+
+
+def image_exists(image):
+    return utils.run_cmd(['docker', 'inspect', image], allow_errors=True)[1] == 0
+
+
+size_units = {'B': 1, 'kB': 1000, 'KB': 1000, 'MB': 1000 ** 2,
+              'GB': 1000 ** 3}
+
+
+def get_images():
+    """
+    Returns the tagged images on the host and their virtual sizes in bytes.
+    """
+    output = utils.run_cmd(['docker', 'images'])[0]
+    images = []
+    for line in output.splitlines()[1:]:
+        columns = re.split(r'\s{2,}', line.strip())
+        if len(columns) < 5 or columns[1] == '<none>':
+            continue
+        repository, tag, image_id = columns[:3]
+        images.append({
+            'image': '%s:%s' % (repository, tag),
+            'id': image_id,
+            'size': parse_size(columns[-1])
+        })
+    return images
+
+
+def get_stats():
+    """
+    Returns the host's load: the one minute load average per CPU, and the
+    fraction of memory in use.
+    """
+    return {
+        'cpu': os.getloadavg()[0] / multiprocessing.cpu_count(),
+        'memory': get_memory_usage()
+    }
+
+
+def get_memory_usage():
+    meminfo = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            meminfo[name] = int(value.split()[0])
+    available = meminfo.get('MemAvailable')
+    if available is None:
+        available = (meminfo['MemFree'] + meminfo.get('Buffers', 0) +
+                     meminfo.get('Cached', 0))
+    return 1.0 - float(available) / meminfo['MemTotal']
+
+
+def parse_size(size):
+    number, unit = size.split()
+    return int(float(number) * size_units.get(unit, 1))
+
 
 class LoadBalancer(resources.PersistentObject):
     name = 'loadbalancer'
@@ -29,6 +29,10 @@ class PersistentObject(object):
             cls.abort_exists()
         return cls(args['_id'])
 
+    @classmethod
+    def exists(cls, _id):
+        return cls.get_collection().find_one({'_id': str(_id)}) is not None
+
     @classmethod
     def abort_nonexistent(cls):
         abort(404, message='%s does not exist' % cls.name.capitalize())
@@ -98,8 +102,12 @@ def add_api_resource(plural_name, resource, list_resource):
     api.add_resource(resource, '%s/<string:_id>' % prefix)
 
 
+def add_list_resource(plural_name, resource):
+    api.add_resource(resource, get_prefix(plural_name))
+
+
 def add_tasks_resource(resource):
-    api.add_resource(resource, get_prefix('tasks'))
+    api.add_resource(resource, '%s/<string:_id>' % get_prefix('tasks'))
 
 
 def add_task_resource(plural_name, resource):
@@ -1,8 +1,12 @@
+import os
 import sys
 import argparse
 import requests
 
 
+api_url = os.environ.get('STRETCH_API_URL', 'http://localhost:8000')
+
+
 resources = [
     'environment',
     'user',
@@ -27,6 +31,46 @@ def use(args):
     print args.target
 
 
+def plan(args):
+    response = requests.get('%s/api/systems/%s/plan/' % (api_url, args.system),
+                            params={'env': args.env, 'release': args.release,
+                                    'nodes': args.nodes})
+    response.raise_for_status()
+    result = response.json()
+
+    diff = result['diff']
+    print 'Deploying %s to %s (from %s)' % (result['release'],
+        result['environment'], diff['existing_release'] or 'nothing')
+    if diff['added_nodes']:
+        print 'Added nodes: %s' % ', '.join(diff['added_nodes'])
+    if diff['removed_nodes']:
+        print 'Removed nodes: %s' % ', '.join(diff['removed_nodes'])
+    if diff['migrations']:
+        print 'Migrations: %s' % ', '.join(diff['migrations'])
+
+    print
+    print 'Hosts:'
+    for host in result['hosts']:
+        pulls = [pull['node'] for pull in host['pulls'] if not pull['present']]
+        print '  %s: pull %s (%d bytes), %d restarts%s' % (host['name'],
+            ', '.join(pulls) or 'nothing', host['bytes'], host['restarts'],
+            '' if host['inventory'] else ' (no inventory)')
+
+    print
+    print 'Groups:'
+    for group in result['groups']:
+        print '  %s: %d restarts in %d batches of %d' % (group['name'],
+            group['restarts'], group['batches'], group['batch_size'])
+
+    print
+    print 'Critical path:'
+    for stage in result['critical_path']:
+        target = ' (%s)' % stage['target'] if stage['target'] else ''
+        print '  %s%s: %.1fs' % (stage['stage'], target, stage['seconds'])
+    print 'Estimated duration: %.1fs, %d bytes to pull' % (result['duration'],
+                                                          result['bytes'])
+
+
 def create_parser():
     parser = argparse.ArgumentParser(description='CLI client for stretch')
     subparsers = parser.add_subparsers()
@@ -47,6 +91,14 @@ def create_parser():
     use_parser.add_argument('target')
     use_parser.set_defaults(func=use)
 
+    plan_parser = subparsers.add_parser('plan',
+        help='Show what deploying a release would do')
+    plan_parser.add_argument('system')
+    plan_parser.add_argument('env')
+    plan_parser.add_argument('release')
+    plan_parser.add_argument('--nodes', nargs='+')
+    plan_parser.set_defaults(func=plan)
+
     return parser
 
 
@@ -1,6 +1,12 @@
 import json
 
-from django.http import HttpResponse, HttpResponseNotFound
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import (HttpResponse, HttpResponseNotFound,
+                         HttpResponseBadRequest)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from stretch.models import System, ScalingOperation
 
 
 def get_releases(request, system_name):
@@ -19,6 +25,144 @@ def get_releases(request, system_name):
     }), mimetype='application/json')
 
 
-def deploy(system_name):
-    tasks.deploy().delay()
-    return # celery task id
+@csrf_exempt
+@require_POST
+def deploy(request, system_name):
+    """
+    Deploys a release to an environment. If `nodes` are given, only those
+    nodes are deployed to.
+
+    POST parameters:
+      - `env`: the environment's name.
+      - `release`: the release's SHA.
+      - `nodes`: optional, repeatable node name.
+    """
+    try:
+        system = System.objects.get(name=system_name)
+        env = system.environments.get(name=request.POST.get('env'))
+        release = system.releases.get(sha=request.POST.get('release'))
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+
+    nodes = request.POST.getlist('nodes') or None
+    if nodes and system.nodes.filter(name__in=nodes).count() != len(set(nodes)):
+        return HttpResponseBadRequest('unknown node')
+
+    result = env.deploy.delay(release, nodes)
+    return HttpResponse(json.dumps({
+        'task_id': result.id
+    }), mimetype='application/json')
+
+
+@require_GET
+def plan(request, system_name):
+    """
+    Returns a dry run of deploying a release to an environment: the images
+    every host would pull, the restarts of every group, and the estimated
+    critical path and duration. Nothing is deployed.
+
+    GET parameters:
+      - `env`: the environment's name.
+      - `release`: the release's SHA.
+      - `nodes`: optional, repeatable node name.
+    """
+    try:
+        system = System.objects.get(name=system_name)
+        env = system.environments.get(name=request.GET.get('env'))
+        release = system.releases.get(sha=request.GET.get('release'))
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+
+    nodes = request.GET.getlist('nodes') or None
+    if nodes and system.nodes.filter(name__in=nodes).count() != len(set(nodes)):
+        return HttpResponseBadRequest('unknown node')
+
+    return HttpResponse(json.dumps(env.plan(release, nodes).as_dict()),
+                        mimetype='application/json')
+
+
+@csrf_exempt
+@require_POST
+def rollback(request, system_name):
+    """
+    Rolls an environment back to a previous release.
+
+    POST parameters:
+      - `env`: the environment's name.
+      - `release`: the SHA of the release to roll back to.
+    """
+    try:
+        system = System.objects.get(name=system_name)
+        env = system.environments.get(name=request.POST.get('env'))
+        release = system.releases.get(sha=request.POST.get('release'))
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+
+    result = env.rollback.delay(release)
+    return HttpResponse(json.dumps({
+        'task_id': result.id
+    }), mimetype='application/json')
+
+
+@csrf_exempt
+@require_POST
+def sync_hosts(request, system_name):
+    """
+    Installs the dependencies of an environment's hosts and synchronizes their
+    salt modules in batches.
+
+    POST parameters:
+      - `env`: the environment's name.
+      - `nodes`: optional, repeatable node name to limit the hosts to.
+    """
+    try:
+        system = System.objects.get(name=system_name)
+        env = system.environments.get(name=request.POST.get('env'))
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+
+    result = env.sync_hosts.delay(request.POST.getlist('nodes') or None)
+    return HttpResponse(json.dumps({
+        'task_id': result.id
+    }), mimetype='application/json')
+
+
+@csrf_exempt
+@require_POST
+def scale(request, system_name):
+    """
+    Starts scaling a group to a number of hosts. Returns the id of the scaling
+    operation, which can be polled with `get_scaling_operation`.
+
+    POST parameters:
+      - `env`: the environment's name.
+      - `group`: the group's name.
+      - `amount`: the number of hosts to scale to.
+    """
+    try:
+        system = System.objects.get(name=system_name)
+        env = system.environments.get(name=request.POST.get('env'))
+        group = env.groups.get(name=request.POST.get('group'))
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+
+    try:
+        operation = group.scale_to(int(request.POST.get('amount')))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest('invalid amount')
+
+    return HttpResponse(json.dumps({
+        'id': operation.pk if operation else None
+    }), mimetype='application/json')
+
+
+@require_GET
+def get_scaling_operation(request, system_name, operation_id):
+    try:
+        operation = ScalingOperation.objects.get(pk=operation_id,
+            group__environment__system__name=system_name)
+    except ObjectDoesNotExist:
+        return HttpResponseNotFound()
+
+    return HttpResponse(json.dumps(operation.as_dict()),
+                        mimetype='application/json')
@@ -0,0 +1,183 @@
+import math
+import logging
+
+
+log = logging.getLogger('stretch')
+
+
+class Policy(object):
+    """
+    Decides how many hosts a group should have from its load. The policy
+    tracks one metric, the average per host of the group's load balancer
+    connections (`connections`) or of the CPU (`cpu`) or memory (`memory`)
+    load reported by its agents, and sizes the group so that the metric
+    returns to `target`:
+
+        desired = ceil(current * value / target)
+
+    Load within `tolerance` of the target leaves the group alone, so that it
+    does not flap around the target. After scaling, the group waits
+    `scale_up_cooldown` seconds before growing and `scale_down_cooldown`
+    seconds before shrinking again, and each decision adds at most
+    `max_step_up` and removes at most `max_step_down` hosts.
+
+    :Parameters:
+      - `options`: the group's `autoscaling` options, e.g.
+        {
+            'metric': 'cpu',
+            'target': 0.6,
+            'tolerance': 0.1,
+            'scale_up_cooldown': 120,
+            'scale_down_cooldown': 600,
+            'max_step_up': 4,
+            'max_step_down': 1
+        }
+    """
+    metrics = ('connections', 'cpu', 'memory')
+    defaults = {
+        'metric': 'cpu',
+        'target': 0.6,
+        'tolerance': 0.1,
+        'scale_up_cooldown': 120,
+        'scale_down_cooldown': 600,
+        'max_step_up': 4,
+        'max_step_down': 1
+    }
+
+    def __init__(self, options):
+        self.options = dict(self.defaults, **options)
+        self.metric = self.options['metric']
+        if self.metric not in self.metrics:
+            raise ValueError('unknown autoscaling metric "%s"' % self.metric)
+        self.target = float(self.options['target'])
+        if self.target <= 0:
+            raise ValueError('autoscaling target must be positive')
+        self.tolerance = self.options['tolerance']
+        self.scale_up_cooldown = self.options['scale_up_cooldown']
+        self.scale_down_cooldown = self.options['scale_down_cooldown']
+        self.max_step_up = self.options['max_step_up']
+        self.max_step_down = self.options['max_step_down']
+
+    def decide(self, current, metrics, minimum, maximum=None,
+               since_scaling=None):
+        """
+        Returns a `(desired, reason)` tuple with the number of hosts the
+        group should have and why.
+
+        :Parameters:
+          - `current`: the group's number of hosts.
+          - `metrics`: the group's metrics, as returned by `collect_metrics`.
+          - `minimum`: the group's minimum number of hosts.
+          - `maximum`: the group's maximum number of hosts, or `None`.
+          - `since_scaling`: seconds since the group last scaled, or `None`
+          if it never has.
+        """
+        bounded = self.bound(current, minimum, maximum)
+        if bounded != current:
+            return bounded, 'outside of %s..%s hosts' % (minimum, maximum)
+
+        value = metrics.get(self.metric)
+        if value is None:
+            return current, 'no %s metric' % self.metric
+
+        ratio = value / self.target
+        if abs(ratio - 1) <= self.tolerance:
+            return current, '%s %.2f within tolerance of %.2f' % (
+                self.metric, value, self.target)
+
+        desired = int(math.ceil(max(current, 1) * ratio))
+        desired = min(desired, current + self.max_step_up)
+        desired = max(desired, current - self.max_step_down)
+        desired = self.bound(desired, minimum, maximum)
+        if desired == current:
+            return current, '%s %.2f but at %s limit' % (
+                self.metric, value, 'maximum' if ratio > 1 else 'minimum')
+
+        cooldown = (self.scale_up_cooldown if desired > current
+                    else self.scale_down_cooldown)
+        if since_scaling is not None and since_scaling < cooldown:
+            return current, '%s %.2f but cooling down for %ss' % (
+                self.metric, value, int(cooldown - since_scaling))
+
+        return desired, '%s %.2f, target %.2f' % (self.metric, value,
+                                                  self.target)
+
+    @staticmethod
+    def bound(amount, minimum, maximum):
+        amount = max(amount, minimum)
+        if maximum is not None:
+            amount = min(amount, maximum)
+        return amount
+
+
+def collect_metrics(hosts, connections, stats):
+    """
+    Returns the metrics of a group: its number of hosts and the average per
+    host of its load balancer connections and agent-reported CPU and memory
+    load. Metrics that no host reported are `None`.
+
+    :Parameters:
+      - `hosts`: the group's hosts.
+      - `connections`: a dict of host address to load balancer connections,
+      or `None` if they are unknown.
+      - `stats`: a dict of host primary key to the host's agent stats.
+    """
+    metrics = {'hosts': len(hosts), 'connections': None}
+    if connections is not None and hosts:
+        metrics['connections'] = float(sum(
+            connections.get(host.address, 0) for host in hosts)) / len(hosts)
+    for name in ('cpu', 'memory'):
+        values = [host_stats[name] for host_stats in stats.values()
+                  if host_stats.get(name) is not None]
+        metrics[name] = sum(values) / len(values) if values else None
+    return metrics
+
+
+def replay(policy, samples, minimum, maximum=None):
+    """
+    Replays recorded metrics through a policy, for tuning policies offline.
+    The group is assumed to scale instantly and its total load to spread
+    evenly over its hosts, so per-host metrics are rescaled to the replayed
+    number of hosts. Returns a list of the decisions, each a dict of the
+    sample's `time`, the replayed `metrics`, and the `current` and `desired`
+    number of hosts and `reason`.
+
+    :Parameters:
+      - `policy`: the `Policy` to replay.
+      - `samples`: a list of `(time, metrics)` tuples in seconds, such as the
+      metrics of recorded autoscaling decisions.
+      - `minimum`: the group's minimum number of hosts.
+      - `maximum`: the group's maximum number of hosts, or `None`.
+    """
+    decisions = []
+    current = None
+    scaled_at = None
+    for time, metrics in samples:
+        recorded_hosts = metrics.get('hosts') or 1
+        if current is None:
+            current = recorded_hosts
+
+        replayed = {'hosts': current}
+        for name in Policy.metrics:
+            value = metrics.get(name)
+            if value is not None and name == 'connections':
+                value = value * recorded_hosts / max(current, 1)
+            elif value is not None:
+                # Utilization saturates at 1
+                value = min(value * recorded_hosts / max(current, 1), 1.0)
+            replayed[name] = value
+
+        since_scaling = None if scaled_at is None else time - scaled_at
+        desired, reason = policy.decide(current, replayed, minimum, maximum,
+                                        since_scaling)
+        decisions.append({
+            'time': time,
+            'metrics': replayed,
+            'current': current,
+            'desired': desired,
+            'reason': reason
+        })
+        if desired != current:
+            current = desired
+            scaled_at = time
+    return decisions
@@ -1,14 +1,15 @@
 import os
-import pyrax
+import time
+import hashlib
 import logging
-from fabric.api import run, env, put, cd
-from fabric.contrib.files import upload_template
+import gevent
+from datetime import timedelta
+from gevent.event import AsyncResult
 from django.conf import settings
+from django.utils import timezone
 
 import stretch
-#from stretch.salt_api import caller_client
-#from stretch.agent.objects import LoadBalancer
-from stretch import utils
+from stretch import utils, resilience
 
 
 log = logging.getLogger('stretch')
@@ -22,25 +23,104 @@ class Backend(object):
         # TODO: add in docs that delete_unused_images only happens when
         # store_images is set and a new image is created
         self.delete_unused_images = options.get('delete_unused_images', True)
+        self.endpoint_batcher = EndpointBatcher(self)
+        # Hosts of backends without salt minions skip accepting keys and
+        # synchronizing states
+        self.uses_salt = True
+        self.target = 'backend:%s' % self.__class__.__name__
 
     def create_host(self, host):
         raise NotImplementedError
 
+    def bake_image(self):
+        """
+        Builds the image that new hosts boot from. Backends that boot hosts
+        from stored images override this; it is run in the background.
+        """
+        return None
+
+    def poll_resources(self):
+        """
+        Records the status of the backend's pending resources. Backends that
+        wait on resources with a `StatusPoller` override this; it is run in
+        the background.
+        """
+        pass
+
     def delete_host(self, host):
         raise NotImplementedError
 
     def lb_add_endpoint(self, lb, host, port):
-        raise NotImplementedError
+        """
+        Adds an endpoint to a load balancer. Endpoints added to the same load
+        balancer within `STRETCH_LB_BATCH_WINDOW` seconds are added with one
+        `lb_add_endpoints` call.
+        """
+        self.endpoint_batcher.apply('add', lb, host, port)
 
     def lb_remove_endpoint(self, lb, host, port):
+        """
+        Removes an endpoint from a load balancer. Endpoints removed from the
+        same load balancer within `STRETCH_LB_BATCH_WINDOW` seconds are
+        removed with one `lb_remove_endpoints` call.
+        """
+        self.endpoint_batcher.apply('remove', lb, host, port)
+
+    def lb_add_endpoints(self, lb, endpoints):
+        """
+        :Parameters:
+          - `lb`: the load balancer.
+          - `endpoints`: a list of `(host, port)` tuples to add.
+        """
+        raise NotImplementedError
+
+    def lb_remove_endpoints(self, lb, endpoints):
+        """
+        :Parameters:
+          - `lb`: the load balancer.
+          - `endpoints`: a list of `(host, port)` tuples to remove.
+        """
         raise NotImplementedError
 
+    def lb_drain_host(self, lb, address):
+        """
+        Stops sending new connections to a host's endpoints, letting open
+        connections finish. Returns `False` if the backend cannot drain
+        endpoints.
+
+        :Parameters:
+          - `lb`: the load balancer.
+          - `address`: the host's address.
+        """
+        return False
+
+    def lb_get_connections(self, lb):
+        """
+        Returns a dict of host address to the connections that the load
+        balancer has open to the host, or `None` if the backend cannot count
+        them.
+
+        :Parameters:
+          - `lb`: the load balancer.
+        """
+        return None
+
     def create_lb(self, lb, hosts):
         raise NotImplementedError
 
     def delete_lb(self, lb):
         raise NotImplementedError
 
+    def call(self, func, args=(), kwargs=None, attempts=None):
+        """
+        Calls the backend's API through `stretch.resilience`, retrying
+        transient failures and failing fast while the API is unhealthy.
+        Calls that are not safe to repeat, like creating a server, should
+        pass `attempts=1`.
+        """
+        return resilience.call(self.target, func, args, kwargs,
+                               attempts=attempts)
+
     def require_option(self, name):
         value = self.options.get(name)
         if not value:
@@ -49,9 +129,260 @@ class Backend(object):
         return value
 
 
+class EndpointBatcher(object):
+    """
+    Collects the endpoint changes of every load balancer for
+    `STRETCH_LB_BATCH_WINDOW` seconds, then applies them with one backend
+    call per load balancer and action. Callers block until their change has
+    been applied, and receive any error raised while applying it. If a batch
+    fails, its changes are applied one at a time, so that only the callers
+    whose change fails receive an error. Changes are collected from every
+    greenlet of the process.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.batches = {}
+
+    def apply(self, action, lb, host, port):
+        """
+        :Parameters:
+          - `action`: `add` or `remove`.
+          - `lb`: the load balancer.
+          - `host`: the endpoint's host.
+          - `port`: the endpoint's port.
+        """
+        window = settings.STRETCH_LB_BATCH_WINDOW
+        if not window:
+            return self.flush_batch(action, lb, [(host, port)])
+
+        key = (lb.pk, action)
+        batch = self.batches.get(key)
+        if not batch:
+            batch = {'lb': lb, 'endpoints': [], 'results': {}}
+            self.batches[key] = batch
+            gevent.spawn_later(window, self.flush, key)
+        endpoint = (host, port)
+        if endpoint not in batch['results']:
+            batch['endpoints'].append(endpoint)
+            batch['results'][endpoint] = AsyncResult()
+        return batch['results'][endpoint].get()
+
+    def flush(self, key):
+        action = key[1]
+        batch = self.batches.pop(key)
+        endpoints, results = batch['endpoints'], batch['results']
+        try:
+            self.flush_batch(action, batch['lb'], endpoints)
+        except Exception as e:
+            if len(endpoints) == 1:
+                results[endpoints[0]].set_exception(e)
+                return
+            log.warning('Failed to apply %s endpoint changes (%s) to %s, '
+                        'applying them one at a time' %
+                        (len(endpoints), action, key[0]))
+            for endpoint in endpoints:
+                try:
+                    self.flush_batch(action, batch['lb'], [endpoint])
+                except Exception as e:
+                    results[endpoint].set_exception(e)
+                else:
+                    results[endpoint].set(None)
+        else:
+            for result in results.values():
+                result.set(None)
+
+    def flush_batch(self, action, lb, endpoints):
+        log.info('Applying %s endpoint changes (%s) to %s' %
+                 (len(endpoints), action, lb.pk))
+        if action == 'add':
+            self.backend.lb_add_endpoints(lb, endpoints)
+        else:
+            self.backend.lb_remove_endpoints(lb, endpoints)
+
+
+class Catalog(object):
+    """
+    A cached listing of cloud resources, indexed by id and name. The listing
+    is fetched again once it is older than `ttl` seconds. Resources created
+    or deleted through the backend are added or removed right away, so the
+    cache only goes stale through changes made elsewhere.
+    """
+    def __init__(self, list_func, ttl=None):
+        self.list_func = list_func
+        self.ttl = ttl
+        self.by_id = {}
+        self.by_name = {}
+        self.loaded_at = None
+
+    def all(self):
+        self.refresh()
+        return self.by_id.values()
+
+    def get(self, obj_id):
+        self.refresh()
+        return self.by_id.get(obj_id)
+
+    def find(self, name):
+        """
+        Returns the resource named `name`. A miss fetches the listing again
+        in case the resource was created elsewhere.
+        """
+        self.refresh()
+        obj = self.by_name.get(name)
+        if obj is None and self.loaded_at is not None:
+            self.invalidate()
+            self.refresh()
+            obj = self.by_name.get(name)
+        return obj
+
+    def add(self, obj):
+        self.by_id[obj.id] = obj
+        self.by_name[obj.name] = obj
+
+    def remove(self, obj):
+        self.by_id.pop(obj.id, None)
+        if self.by_name.get(obj.name) is obj:
+            del self.by_name[obj.name]
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def refresh(self):
+        ttl = settings.STRETCH_BACKEND_CATALOG_TTL if self.ttl is None \
+            else self.ttl
+        if self.loaded_at is not None and time.time() - self.loaded_at < ttl:
+            return
+        self.load(self.list_func())
+
+    def load(self, objs):
+        """
+        Replaces the cached listing with `objs`, a listing fetched elsewhere.
+        """
+        self.by_id = {}
+        self.by_name = {}
+        for obj in objs:
+            self.add(obj)
+        self.loaded_at = time.time()
+
+
+class StatusPoller(object):
+    """
+    Waits for cloud resources to reach a status. Waiters record their
+    resource as a `PendingResource` and read its status from the database,
+    while `poll` lists the resources of every waiter at once, from one
+    place: the periodic `stretch.tasks.poll_resources` task. Every worker
+    process thus shares one listing per `STRETCH_BACKEND_POLL_INTERVAL`
+    seconds, however many resources they wait on.
+
+    :Parameters:
+      - `name`: identifies the poller's resources across processes, e.g. by
+      account, region and kind of resource.
+      - `list_func`: lists the resources with their status.
+      - `refresh_func`: reloads a resource in place once it has reached its
+      status.
+      - `catalog`: optional `Catalog` to refresh with every listing.
+    """
+    RATE_LIMIT_CODES = (413, 429)
+    # Missed polls after which waiters poll for themselves
+    STALE_POLLS = 3
+
+    def __init__(self, name, list_func, refresh_func, catalog=None):
+        self.name = name
+        self.list_func = list_func
+        self.refresh_func = refresh_func
+        self.catalog = catalog
+
+    def wait(self, obj, statuses=('ACTIVE', 'ERROR')):
+        """
+        Waits until `obj` reaches one of `statuses`, then reloads and returns
+        it. Raises `DeadlineExceeded` if the current deadline or
+        `STRETCH_BACKEND_WAIT_TIMEOUT` runs out first. Waiters poll for
+        themselves once `poll_resources` has missed a few polls, e.g. while
+        beat is not running.
+        """
+        from stretch.models import PendingResource
+
+        interval = settings.STRETCH_BACKEND_POLL_INTERVAL
+        pending = PendingResource.objects.create(poller=self.name,
+                                                 resource_id=str(obj.id))
+        try:
+            with utils.deadline(settings.STRETCH_BACKEND_WAIT_TIMEOUT):
+                while True:
+                    record = PendingResource.objects.get(pk=pending.pk)
+                    if record.status in statuses:
+                        break
+                    stale = timezone.now() - timedelta(
+                        seconds=interval * self.STALE_POLLS)
+                    if (record.polled_at or record.created_at) < stale:
+                        self._poll_inline()
+                    utils.get_deadline().check()
+                    gevent.sleep(utils.get_timeout(interval))
+        finally:
+            pending.delete()
+
+        self.refresh_func(obj)
+        if self.catalog:
+            self.catalog.add(obj)
+        return obj
+
+    def poll(self):
+        """
+        Lists the resources once if any are waited on, and records the
+        status of those that are. Rate limited listings are skipped until
+        the next poll.
+        """
+        from stretch.models import PendingResource
+
+        pending = PendingResource.objects.filter(poller=self.name)
+        ids = set(pending.values_list('resource_id', flat=True))
+        if not ids:
+            return
+
+        try:
+            objs = self.list_func()
+        except Exception as e:
+            if getattr(e, 'code', None) not in self.RATE_LIMIT_CODES:
+                raise
+            log.warning('Rate limited, skipping a poll of %s' % self.name)
+            return
+
+        if self.catalog:
+            self.catalog.load(objs)
+
+        now = timezone.now()
+        for obj in objs:
+            if str(obj.id) in ids:
+                pending.filter(resource_id=str(obj.id)).update(
+                    status=obj.status, polled_at=now)
+
+    def _poll_inline(self):
+        """
+        Polls from a waiter. Failures are logged rather than raised, so that
+        the waiter keeps waiting until its deadline.
+        """
+        log.warning('Resources of %s have not been polled for %s intervals, '
+                    'polling them in place' % (self.name, self.STALE_POLLS))
+        try:
+            self.poll()
+        except Exception:
+            log.exception('Failed to poll %s' % self.name)
+
+
 def get_image_name():
+    """
+    Returns the name of the host image for the current stretch version and
+    image bootstrap script, and the prefix shared by every host image.
+    """
     prefix = settings.STRETCH_BACKEND_IMAGE_PREFIX
-    return '%s-%s' % (prefix, stretch.__version__), prefix
+    return '%s-%s-%s' % (prefix, stretch.__version__,
+                         get_scripts_hash()), prefix
+
+
+def get_scripts_hash():
+    path = os.path.join(os.path.dirname(__file__), 'scripts',
+                        'image-bootstrap.sh')
+    with open(path) as f:
+        return hashlib.sha1(f.read()).hexdigest()[:8]
 
 
 def get_backend(env):
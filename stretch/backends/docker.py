@@ -1,3 +1,8 @@
+from stretch.backend import Backend
+from stretch.salt_api import caller_client
+from stretch.agent.objects import LoadBalancer
+
+
 class DockerBackend(Backend):
     def __init__(self, options):
         super(DockerBackend, self).__init__(options)
@@ -9,11 +14,15 @@ class DockerBackend(Backend):
     def delete_host(self, host):
         pass
 
-    def lb_add_endpoint(self, lb, host, port):
-        LoadBalancer(lb.pk).add_endpoint(host, port)
+    def lb_add_endpoints(self, lb, endpoints):
+        lb_obj = LoadBalancer(lb.pk)
+        for host, port in endpoints:
+            lb_obj.add_endpoint(host, port)
 
-    def lb_remove_endpoint(self, lb, host, port):
-        LoadBalancer(lb.pk).remove_endpoint(host, port)
+    def lb_remove_endpoints(self, lb, endpoints):
+        lb_obj = LoadBalancer(lb.pk)
+        for host, port in endpoints:
+            lb_obj.remove_endpoint(host, port)
 
     def create_lb(self, lb):
         LoadBalancer.create({'id': lb.pk})
@@ -1,3 +1,20 @@
+import os
+import pyrax
+import logging
+import functools
+from fabric.api import run, env, put, cd
+from fabric.contrib.files import upload_template
+from django.conf import settings
+
+import stretch
+from stretch import utils
+from stretch.backend import Backend, Catalog, StatusPoller, get_image_name
+
+
+log = logging.getLogger('stretch')
+script_dir = os.path.join(os.path.dirname(stretch.__file__), 'scripts')
+
+
 class RackspaceBackend(Backend):
     def __init__(self, options):
         super(RackspaceBackend, self).__init__(options)
@@ -15,93 +32,172 @@ class RackspaceBackend(Backend):
         self.cs = pyrax.connect_to_cloudservers(region=self.region)
         self.clb = pyrax.connect_to_cloud_loadbalancers(region=self.region)
 
+        self.target = 'backend:rackspace:%s' % self.region
+
+        # Catalogs list through `call`, pollers skip rate limited listings
+        list_images = functools.partial(self.call, self.cs.images.list)
+        list_flavors = functools.partial(self.call, self.cs.flavors.list)
+        list_servers = functools.partial(self.call, self.cs.servers.list)
+        list_lbs = functools.partial(self.call, self.clb.list)
+        self.images = Catalog(list_images)
+        self.flavors = Catalog(list_flavors)
+        self.servers = Catalog(list_servers)
+        self.lbs = Catalog(list_lbs)
+
+        # Pending builds are polled together rather than one by one, by
+        # `poll_resources`
+        poller_name = '%s:%s:%%s' % (self.target, self.username)
+        self.server_poller = StatusPoller(poller_name % 'servers',
+            self.cs.servers.list, self.refresh, catalog=self.servers)
+        self.image_poller = StatusPoller(poller_name % 'images',
+            self.cs.images.list, self.refresh, catalog=self.images)
+        self.lb_poller = StatusPoller(poller_name % 'lbs', self.clb.list,
+                                      self.refresh, catalog=self.lbs)
+
         try:
-            self.image = [img for img in self.cs.images.list()
+            self.image = [img for img in self.images.all()
                           if self.image_name in img.name][0]
         except IndexError:
             raise self.ImageNotFound('image "%s" not found' % self.image_name)
 
         try:
-            self.flavor = [flavor for flavor in self.cs.flavors.list()
+            self.flavor = [flavor for flavor in self.flavors.all()
                            if flavor.ram == self.flavor_ram][0]
         except IndexError:
             raise self.FlavorNotFound('flavor with ram "%s" not found'
                                       % self.flavor_ram)
 
     def create_host(self, host):
+        """
+        Boots a server for the host from the latest baked image, or from the
+        base image if none has been baked. Images are baked by `bake_image`
+        in the background, never while creating a host.
+        """
         log.info('Creating host %s...' % host.fqdn)
 
         image_name, prefix = get_image_name()
-        create_image, im_id = self.should_create_image(image_name, prefix)
-        image_id = im_id or self.image.id
+        image = self.get_latest_image(image_name, prefix) or self.image
+        log.info('Using image: %s' % image.name)
 
-        server = self.cs.servers.create(host.fqdn, image_id, self.flavor.id)
-        pyrax.utils.wait_for_build(server, interval=10)
+        server = self.call(self.cs.servers.create,
+                           (host.fqdn, image.id, self.flavor.id), attempts=1)
+        self.servers.add(server)
+        server = self.server_poller.wait(server)
         if server.status != 'ACTIVE':
             raise Exception('failed to create host')
         log.info('Finished creating host')
 
-        if self.use_public_network:
-            address = server.accessIPv4
-        else:
-            address = server.networks['private'][0]
-
-        self.provision_host(server, address, host, create_image, image_name,
-                            prefix)
+        address = self.get_address(server)
+        # Hosts booted from an outdated or base image bootstrap themselves
+        self.provision_host(server, address, host,
+                            bootstrap_image=(image.name != image_name))
         log.info('Finished configuring host')
         return address
 
-    def should_create_image(self, image_name, prefix):
-        create_image = False
-        image_id = None
-
-        if self.store_images:
-            images = [i for i in self.cs.images.list() if i.name == image_name]
-            if images:
-                image = images[0]
-                log.info('Using image: %s' % image.name)
-                pyrax.utils.wait_until(image, 'status', ['ACTIVE', 'ERROR'],
-                                       attempts=0)
-                image_id = image.id
-            else:
-                # Create new image
-                create_image = True
-                log.info('a new image (%s) will be created from this build'
-                         % image_name)
-                if self.delete_unused_images:
-                    # Delete unused images
-                    log.info('Deleting unused images...')
-                    for image in self.cs.images.list():
-                        if (image.name != image_name and
-                                image.name.startswith(prefix)):
-                            log.info('Deleting image %s...' % image.name)
-                            image.delete()
-
-        return create_image, image_id
-
-    def provision_host(self, server, address, host, create_image, image_name,
-                       prefix):
+    def get_latest_image(self, image_name, prefix):
+        """
+        Returns the image named `image_name` if it has been baked, otherwise
+        the most recently created baked image, or `None` if there is none.
+        """
+        if not self.store_images:
+            return None
+
+        images = [i for i in self.images.all()
+                  if i.name.startswith(prefix) and i.status == 'ACTIVE']
+        for image in images:
+            if image.name == image_name:
+                return image
+        if images:
+            return max(images, key=lambda i: i.created)
+        return None
+
+    def bake_image(self):
+        """
+        Bakes the image for the current stretch version and image bootstrap
+        script from a temporary server, unless it exists or is already being
+        baked. Unused images are deleted once the new image is built.
+        """
+        if not self.store_images:
+            return None
+
+        image_name, prefix = get_image_name()
+        image = self.images.find(image_name)
+        if image and image.status != 'ERROR':
+            return image
+
+        server_name = '%s-bake' % image_name
+        if self.servers.find(server_name):
+            log.info('Image %s is already being baked' % image_name)
+            return None
+
+        log.info('Baking image %s...' % image_name)
+        server = self.call(self.cs.servers.create,
+                           (server_name, self.image.id, self.flavor.id),
+                           attempts=1)
+        self.servers.add(server)
+        try:
+            server = self.server_poller.wait(server)
+            if server.status != 'ACTIVE':
+                raise Exception('failed to create image server')
+            self.connect(server, self.get_address(server))
+            self.bootstrap_image()
+
+            image_id = self.call(server.create_image, (image_name,),
+                                 attempts=1)
+            image = self.call(self.cs.images.get, (image_id,))
+            self.images.add(image)
+            image = self.image_poller.wait(image)
+            if image.status != 'ACTIVE':
+                raise Exception('failed to create image')
+        finally:
+            self.call(server.delete)
+            self.servers.remove(server)
+        log.info('Finished baking image %s' % image_name)
+
+        if self.delete_unused_images:
+            log.info('Deleting unused images...')
+            for old_image in self.images.all():
+                if (old_image.name != image_name and
+                        old_image.name.startswith(prefix)):
+                    log.info('Deleting image %s...' % old_image.name)
+                    self.call(old_image.delete)
+                    self.images.remove(old_image)
+
+        return image
+
+    def poll_resources(self):
+        for poller in (self.server_poller, self.image_poller, self.lb_poller):
+            poller.poll()
+
+    def refresh(self, obj):
+        # Reloads in place, which keeps attributes only returned on create
+        # like `adminPass`
+        self.call(obj.get)
+
+    def get_address(self, server):
+        if self.use_public_network:
+            return server.accessIPv4
+        else:
+            return server.networks['private'][0]
+
+    def connect(self, server, address):
         env.host_string = 'root@%s' % address
         env.password = server.adminPass
         env.disable_known_hosts = True
 
-        script_dir = os.path.join(os.path.dirname(__file__), 'scripts')
-
-        log.info('Provisioning host %s...' % host.fqdn)
+    def bootstrap_image(self):
         with cd('/root'):
             file_name = 'image-bootstrap.sh'
+            utils.get_deadline().check()
             put(os.path.join(script_dir, file_name), file_name)
-            run('/bin/bash %s' % file_name)
-
-        if create_image:
-            # Create image
-            log.info('Creating image (%s) from host...' % image_name)
-            image_id = server.create_image(image_name)
-            image = self.cs.images.get(image_id)
-            pyrax.utils.wait_until(image, 'status', ['ACTIVE', 'ERROR'],
-                                   attempts=0)
-            if image.status != 'ACTIVE':
-                raise Exception('failed to create image')
+            run('/bin/bash %s' % file_name, timeout=utils.get_timeout())
+
+    def provision_host(self, server, address, host, bootstrap_image=True):
+        self.connect(server, address)
+
+        if bootstrap_image:
+            log.info('Provisioning host %s...' % host.fqdn)
+            self.bootstrap_image()
 
         log.info('Configuring host %s...' % host.fqdn)
 
@@ -120,28 +216,30 @@ class RackspaceBackend(Backend):
         parts = address.split(':')
         options['etcd_host_address'], options['etcd_host_port'] = parts
 
+        utils.get_deadline().check()
         upload_template('host-bootstrap.sh', '/root/host-bootstrap.sh',
                         options, use_jinja=True, template_dir=script_dir)
-        run('/bin/bash /root/host-bootstrap.sh')
+        run('/bin/bash /root/host-bootstrap.sh', timeout=utils.get_timeout())
 
     def delete_host(self, host):
-        for server in self.cs.list():
-            if server.name == host.fqdn:
-                server.delete()
+        server = self.servers.find(host.fqdn)
+        if server:
+            self.call(server.delete)
+            self.servers.remove(server)
 
     def create_lb(self, lb):
         port = 80
 
-        lb_obj = self.clb.create(
-            lb.pk,
-            port=port,
-            protocol=lb.protocol.upper(),
-            condition='ENABLED',
-            virtual_ips=[self.clb.VirtualIP(type='PUBLIC')],
-            algorithm='LEAST_CONNECTIONS'
-        )
+        lb_obj = self.call(self.clb.create, (str(lb.pk),), {
+            'port': port,
+            'protocol': lb.protocol.upper(),
+            'condition': 'ENABLED',
+            'virtual_ips': [self.clb.VirtualIP(type='PUBLIC')],
+            'algorithm': 'LEAST_CONNECTIONS'
+        }, attempts=1)
 
-        pyrax.utils.wait_for_build(lb_obj)
+        self.lbs.add(lb_obj)
+        lb_obj = self.lb_poller.wait(lb_obj)
         if lb_obj.status != 'ACTIVE':
             raise Exception('failed to create load balancer')
 
@@ -163,23 +261,63 @@ class RackspaceBackend(Backend):
         return lb_obj.sourceAddresses['ipv4Public'], port
 
     def delete_lb(self, lb):
-        self.clb.get(lb.pk).delete()
-
-    def lb_add_endpoint(self, lb, host, port):
-        lb_obj = self.clb.get(lb.pk)
-        node = self.get_node(host, port)
-        lb_obj.add_nodes([node])
-        pyrax.utils.wait_for_build(lb_obj)
-
-    def lb_remove_endpoint(self, lb, host, port):
-        lb_obj = self.clb.get(lb.pk)
-        try:
-            node = [n for n in lb_obj.nodes if n.address == host
-                                            and n.port == port][0]
-        except KeyError:
-            raise Exception('failed to get node from load balancer')
-        node.delete()
-        pyrax.utils.wait_for_build(lb_obj)
+        lb_obj = self.get_lb(lb)
+        self.call(lb_obj.delete)
+        self.lbs.remove(lb_obj)
+
+    def lb_add_endpoints(self, lb, endpoints):
+        lb_obj = self.get_lb(lb)
+        self.call(lb_obj.add_nodes, ([self.get_node(host, port)
+                                      for host, port in endpoints],))
+        self.lb_poller.wait(lb_obj)
+
+    def lb_remove_endpoints(self, lb, endpoints):
+        """
+        Deletes the nodes of `endpoints`. Endpoints without a node are
+        treated as already removed, so that they do not fail the rest of a
+        batch.
+        """
+        lb_obj = self.get_lb(lb)
+        self.call(lb_obj.get)
+        nodes = [n for n in lb_obj.nodes if (n.address, n.port) in endpoints]
+        if len(nodes) != len(endpoints):
+            found = [(n.address, n.port) for n in nodes]
+            log.warning('Endpoints already removed from %s: %s' %
+                        (lb.pk, [e for e in endpoints if e not in found]))
+        if not nodes:
+            return
+
+        if len(nodes) == 1:
+            self.call(nodes[0].delete)
+        else:
+            # Bulk deletes take at most 10 nodes
+            for i in xrange(0, len(nodes), 10):
+                ids = '&'.join('id=%s' % n.id for n in nodes[i:i + 10])
+                self.call(self.clb.method_delete,
+                          ('/loadbalancers/%s/nodes?%s' % (lb_obj.id, ids),))
+        self.lb_poller.wait(lb_obj)
+
+    def lb_drain_host(self, lb, address):
+        """
+        Sets the host's nodes to the DRAINING condition. Cloud load balancers
+        do not report connections per node, so drained hosts are given the
+        whole drain timeout.
+        """
+        lb_obj = self.get_lb(lb)
+        self.call(lb_obj.get)
+        for node in lb_obj.nodes:
+            if node.address == address:
+                node.condition = 'DRAINING'
+                self.call(node.update)
+                self.lb_poller.wait(lb_obj)
+        return True
+
+    def get_lb(self, lb):
+        # Load balancers are created with the model's primary key as name
+        lb_obj = self.lbs.find(str(lb.pk))
+        if not lb_obj:
+            raise Exception('load balancer %s not found' % lb.pk)
+        return lb_obj
 
     def get_node(self, host, port):
         return self.clb.Node(
@@ -193,3 +331,4 @@ class RackspaceBackend(Backend):
 
     class ImageNotFound(Exception):
         pass
+
@@ -0,0 +1,221 @@
+import time
+import random
+import logging
+import itertools
+import collections
+import gevent
+from django.conf import settings
+
+from stretch import utils
+from stretch.backend import Backend
+
+
+log = logging.getLogger('stretch')
+
+
+# Seconds that calls take, as a mean and standard deviation, roughly matching
+# Rackspace and stretch agents
+DEFAULT_LATENCY = {
+    'create_host': (300.0, 60.0),
+    'delete_host': (5.0, 1.0),
+    'create_lb': (60.0, 15.0),
+    'delete_lb': (5.0, 1.0),
+    'lb_add_endpoints': (20.0, 5.0),
+    'lb_remove_endpoints': (20.0, 5.0),
+    'lb_drain_host': (10.0, 3.0),
+    'pull_node': (30.0, 10.0),
+    'prefetch_node': (30.0, 10.0),
+    'add_instance': (2.0, 0.5),
+    'remove_instance': (2.0, 0.5),
+    'restart_instance': (10.0, 3.0),
+    'reload_instance': (1.0, 0.2)
+}
+
+# The most connections that a simulated endpoint starts with
+MAX_CONNECTIONS = 100
+
+
+class SimulatedFailure(Exception):
+    pass
+
+
+class Simulator(object):
+    """
+    Simulates the latency, failures and rate limit of calls to a remote API.
+    Calls sleep cooperatively, so thousands of simulated calls can overlap in
+    greenlets of one process.
+
+    :Parameters:
+      - `latency`: call name to a `(mean, stddev)` tuple of seconds,
+      overriding `DEFAULT_LATENCY`. Latencies are normally distributed and
+      never negative.
+      - `failure_rate`: call name to the probability that the call fails.
+      - `rate_limit`: the maximum calls per second, or `None`. Calls over the
+      limit wait for their turn.
+      - `time_scale`: the factor that every latency is multiplied by, e.g.
+      `0.01` to run 100 times faster than real time.
+      - `seed`: optional seed for reproducible runs.
+    """
+    def __init__(self, latency={}, failure_rate={}, rate_limit=None,
+                 time_scale=1.0, seed=None):
+        self.latency = dict(DEFAULT_LATENCY, **latency)
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.next_call_at = 0.0
+        self.stats = collections.defaultdict(collections.Counter)
+
+    def call(self, name):
+        """
+        Simulates a call, raising `SimulatedFailure` if it fails.
+        """
+        self.stats[name]['calls'] += 1
+        self.throttle(name)
+
+        mean, stddev = self.latency.get(name, (0.0, 0.0))
+        gevent.sleep(max(self.random.gauss(mean, stddev), 0.0) *
+                     self.time_scale)
+
+        if self.random.random() < self.failure_rate.get(name, 0.0):
+            self.stats[name]['failures'] += 1
+            raise SimulatedFailure('simulated %s failure' % name)
+
+    def throttle(self, name):
+        if not self.rate_limit:
+            return
+        now = time.time()
+        call_at = max(now, self.next_call_at)
+        self.next_call_at = call_at + self.time_scale / self.rate_limit
+        if call_at > now:
+            self.stats[name]['throttled'] += 1
+            gevent.sleep(call_at - now)
+
+
+class SimulatedBackend(Backend):
+    """
+    A backend that simulates servers and load balancers in-process, for load
+    testing scaling and deploys without a cloud. Accepts the options of
+    `Simulator`. Hosts do not run salt minions, so they skip accepting keys
+    and synchronizing states.
+
+    Use it with `stretch.config_managers.LocalConfigManager` and
+    `SimulatedAgentClient`.
+    """
+    def __init__(self, options):
+        super(SimulatedBackend, self).__init__(options)
+        self.uses_salt = False
+        self.simulator = Simulator(
+            latency=options.get('latency', {}),
+            failure_rate=options.get('failure_rate', {}),
+            rate_limit=options.get('rate_limit'),
+            time_scale=options.get('time_scale', 1.0),
+            seed=options.get('seed')
+        )
+        self.hosts = {}
+        self.lbs = {}
+        self.connections = {}
+        self.draining = set()
+        self.addresses = ('10.%s.%s.%s' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+                          for i in itertools.count(1))
+
+    def create_host(self, host):
+        self.simulator.call('create_host')
+        address = next(self.addresses)
+        self.hosts[host.fqdn] = address
+        return address
+
+    def delete_host(self, host):
+        self.simulator.call('delete_host')
+        address = self.hosts.pop(host.fqdn, None)
+        self.connections.pop(address, None)
+        self.draining.discard(address)
+
+    def create_lb(self, lb):
+        self.simulator.call('create_lb')
+        self.lbs[str(lb.pk)] = set()
+        return next(self.addresses), 80
+
+    def delete_lb(self, lb):
+        self.simulator.call('delete_lb')
+        self.lbs.pop(str(lb.pk), None)
+
+    def lb_add_endpoints(self, lb, endpoints):
+        self.simulator.call('lb_add_endpoints')
+        self.lbs.setdefault(str(lb.pk), set()).update(endpoints)
+        for host, port in endpoints:
+            self.connections[host] = self.simulator.random.randint(
+                0, MAX_CONNECTIONS)
+
+    def lb_remove_endpoints(self, lb, endpoints):
+        self.simulator.call('lb_remove_endpoints')
+        self.lbs.get(str(lb.pk), set()).difference_update(endpoints)
+
+    def lb_drain_host(self, lb, address):
+        self.simulator.call('lb_drain_host')
+        self.draining.add(address)
+        return True
+
+    def lb_get_connections(self, lb):
+        """
+        Returns the connections of the load balancer's hosts. Connections of
+        draining hosts halve every time they are counted.
+        """
+        connections = {}
+        for host, port in self.lbs.get(str(lb.pk), ()):
+            if host in self.draining:
+                self.connections[host] //= 2
+            connections[host] = self.connections.get(host, 0)
+        return connections
+
+
+class SimulatedAgentClient(object):
+    """
+    Simulates the agent of a host. The profile of every simulated agent is
+    taken from the `Simulator` options in `STRETCH_SIMULATED_AGENT`.
+    """
+    def __init__(self, host):
+        self.host = host
+        self.simulator = get_agent_simulator()
+
+    def add_node(self, node):
+        pass
+
+    def remove_node(self, node):
+        pass
+
+    def pull_node(self, node, env, release=None):
+        self.simulator.call('pull_node')
+
+    def prefetch_node(self, node, release):
+        self.simulator.call('prefetch_node')
+
+    def get_images(self):
+        return []
+
+    def get_stats(self):
+        return {'cpu': self.simulator.random.random(),
+                'memory': self.simulator.random.random()}
+
+    def add_instance(self, instance, host=None):
+        self.simulator.call('add_instance')
+
+    def apply_batch(self, nodes=(), pulls=(), instances=()):
+        for pull in pulls:
+            self.simulator.call('pull_node')
+        if instances:
+            self.simulator.call('add_instance')
+
+    def remove_instance(self, instance):
+        self.simulator.call('remove_instance')
+
+    def reload_instance(self, instance):
+        self.simulator.call('reload_instance')
+
+    def restart_instance(self, instance):
+        self.simulator.call('restart_instance')
+
+
+@utils.memoized
+def get_agent_simulator():
+    return Simulator(**settings.STRETCH_SIMULATED_AGENT)
@@ -1,3 +1,51 @@
 import djcelery
+from datetime import timedelta
+from kombu import Exchange, Queue
 
 djcelery.setup_loader()
+
+
+# Builds are CPU-bound, deploys wait on agents, and provisioning waits on
+# backends for minutes, so each gets its own queue and workers.
+CELERY_DEFAULT_QUEUE = 'default'
+CELERY_QUEUES = tuple(Queue(name, Exchange(name), routing_key=name)
+                      for name in ('default', 'builds', 'deploys',
+                                   'provisioning'))
+CELERY_ROUTES = {
+    'stretch.tasks.create_release': {'queue': 'builds'},
+    'stretch.tasks.bake_images': {'queue': 'provisioning'},
+    'stretch.models.Environment.deploy': {'queue': 'deploys'},
+    'stretch.models.Environment.rollback': {'queue': 'deploys'},
+    'stretch.models.Environment.autoload': {'queue': 'deploys'},
+    'stretch.models.Environment.prefetch': {'queue': 'deploys'},
+    'stretch.tasks.deploy_to_hosts': {'queue': 'deploys'},
+    'stretch.tasks.finish_deploy': {'queue': 'deploys'},
+    'stretch.tasks.fail_deploy': {'queue': 'deploys'},
+    'stretch.models.Environment.fill_warm_pool': {'queue': 'provisioning'},
+    'stretch.models.Environment.sync_hosts': {'queue': 'provisioning'},
+    'stretch.models.Host._provision': {'queue': 'provisioning'},
+    'stretch.tasks.create_host': {'queue': 'provisioning'},
+    'stretch.tasks.add_warm_host': {'queue': 'provisioning'},
+    'stretch.tasks.delete_host': {'queue': 'provisioning'},
+    'stretch.tasks.finish_scaling': {'queue': 'provisioning'},
+}
+
+# Periodic tasks, run by `stretch beat`
+CELERYBEAT_SCHEDULE = {
+    'autoscale': {
+        'task': 'stretch.tasks.autoscale',
+        'schedule': timedelta(seconds=60)
+    },
+    # Lists pending cloud resources for waiters in every worker
+    'poll-resources': {
+        'task': 'stretch.tasks.poll_resources',
+        'schedule': timedelta(seconds=5),
+        'options': {'expires': 5}
+    },
+    # Runs that are still queued by the next one are dropped
+    'bake-images': {
+        'task': 'stretch.tasks.bake_images',
+        'schedule': timedelta(hours=1),
+        'options': {'expires': 60 * 60}
+    }
+}
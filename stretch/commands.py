@@ -1,4 +1,5 @@
 import sys
+import socket
 import argparse
 import subprocess
 import multiprocessing
@@ -6,6 +7,7 @@ import os
 os.environ['DJANGO_SETTINGS_MODULE'] = 'stretch.settings'
 
 from django.core import management
+from django.conf import settings
 from djcelery.management.commands import celery
 
 from stretch import agent
@@ -17,6 +19,37 @@ def run_gunicorn(app):
     subprocess.call(['gunicorn', app, '-w', str(workers)])
 
 
+def run_celery_worker(queue):
+    options = settings.STRETCH_CELERY_WORKERS.get(queue, {})
+    argv = ['manage.py', 'celery', 'worker', '-Q', queue,
+            '-n', '%s.%s' % (queue, socket.gethostname())]
+    if 'pool' in options:
+        argv += ['-P', options['pool']]
+    if 'concurrency' in options:
+        argv += ['-c', str(options['concurrency'])]
+    if 'prefetch_multiplier' in options:
+        argv += ['--', 'celeryd.prefetch_multiplier=%s' %
+                 options['prefetch_multiplier']]
+    celery.Command().run_from_argv(argv)
+
+
+def run_celery_workers(queues):
+    """
+    Runs a worker for every queue with the queue's options from
+    `STRETCH_CELERY_WORKERS`. Workers for several queues run in separate
+    processes.
+    """
+    if len(queues) == 1:
+        return run_celery_worker(queues[0])
+
+    workers = [multiprocessing.Process(target=run_celery_worker, args=(queue,))
+               for queue in queues]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
 def run(args=sys.argv[1:]):
     parser = argparse.ArgumentParser(prog='stretch')
     subparsers = parser.add_subparsers(help="Commands:", dest='command')
@@ -26,7 +59,10 @@ def run(args=sys.argv[1:]):
     subparsers.add_parser('endpoint', help='Run the endpoint supervisor')
     subparsers.add_parser('instance', help='Run the instance supervisor')
     subparsers.add_parser('autoload', help='Run the autoload handler')
-    subparsers.add_parser('celery', help='Run celery queues')
+    celery_parser = subparsers.add_parser('celery', help='Run celery queues')
+    celery_parser.add_argument('queues', nargs='*',
+        help='Queues to run workers for (default: all)')
+    subparsers.add_parser('beat', help='Run the periodic task scheduler')
     subparsers.add_parser('server', help='Run the server')
 
     # Set default option
@@ -47,6 +83,9 @@ def run(args=sys.argv[1:]):
     elif args.command == 'autoload':
         management.call_command('autoload')
     elif args.command == 'celery':
-        celery.Command().run_from_argv(['manage.py', 'celery', 'worker'])
+        run_celery_workers(args.queues or
+                           sorted(settings.STRETCH_CELERY_WORKERS.keys()))
+    elif args.command == 'beat':
+        celery.Command().run_from_argv(['manage.py', 'celery', 'beat'])
     elif args.command == 'server':
         run_gunicorn('stretch.wsgi:application')
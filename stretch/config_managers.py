@@ -3,7 +3,7 @@ import collections
 import logging
 from django.conf import settings
 
-from stretch import utils
+from stretch import utils, resilience
 
 
 log = logging.getLogger('stretch')
@@ -81,28 +81,63 @@ class EtcdConfigManager(ConfigManager):
             raise ValueError('incorrectly formatted address "%s"; expected '
                              '"ip:port"' % address)
         self.etcd_client = etcd.Etcd(host=host, port=int(port))
+        self.target = 'etcd:%s' % address
 
     def set(self, key, value):
         # TODO: Remove lstrip with etcd-py 0.0.6
-        self.etcd_client.set(key.lstrip('/'), value)
+        self.call(self.etcd_client.set, key.lstrip('/'), value)
 
     def get(self, key):
-        return self.etcd_client.get(key).value
+        return self.call(self.etcd_client.get, key).value
 
     def delete(self, key):
         try:
-            self.etcd_client.delete(key)
+            self.call(self.etcd_client.delete, key)
             return
         except etcd.EtcdError:
             pass
 
         try:
-            for k, v in self.etcd_client.get_recursive(key).iteritems():
-                self.etcd_client.delete(k)
+            for k, v in self.call(self.etcd_client.get_recursive,
+                                  key).iteritems():
+                self.call(self.etcd_client.delete, k)
         except ValueError as e:
             log.info(e.message)
 
+    def call(self, func, *args):
+        return resilience.call(self.target, func, args,
+                               retryable=self.is_transient)
+
+    @staticmethod
+    def is_transient(e):
+        # Errors returned by etcd, like missing keys, are not retried
+        return not isinstance(e, (etcd.EtcdError, ValueError))
+
+
+class LocalConfigManager(ConfigManager):
+    """
+    Keeps configuration in memory, for simulated environments that run
+    without etcd. Keys are shared by every system in the process.
+    """
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def get(self, key):
+        return self.values[key]
+
+    def delete(self, key):
+        prefix = '%s/' % key.rstrip('/')
+        for k in self.values.keys():
+            if k == key or k.startswith(prefix):
+                del self.values[k]
+
 
 @utils.memoized
 def get_config_manager():
-    return EtcdConfigManager(settings.ETCD_HOST)
+    manager_class = utils.get_class(settings.STRETCH_CONFIG_MANAGER)
+    if issubclass(manager_class, EtcdConfigManager):
+        return manager_class(settings.ETCD_HOST)
+    return manager_class()
@@ -14,6 +14,18 @@ class UndefinedBackend(Exception):
                 'settings.py')
 
 
+class DeadlineExceeded(Exception):
+    """Raised if an operation runs out of its time budget."""
+    def __str__(self):
+        return 'deadline exceeded'
+
+
+class CircuitOpen(Exception):
+    """Raised if a call's target has been failing and is not called."""
+    def __init__(self, target):
+        super(CircuitOpen, self).__init__('%s is unavailable' % target)
+
+
 class MissingFile(Exception):
     """Raised if a Snapshot cannot find a necessary file."""
     def __init__(self, expected):
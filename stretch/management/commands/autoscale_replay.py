@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import json
+from datetime import timedelta
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from optparse import make_option
+
+from stretch import models, autoscaling
+
+
+class Command(BaseCommand):
+    args = '<system> <env> <group>'
+    help = ("Replays a group's recorded autoscaling metrics through a policy "
+            'and prints the decisions it would have made')
+    option_list = BaseCommand.option_list + (
+        make_option('--policy', default=None,
+                    help="JSON policy options (default: the group's own)"),
+        make_option('--hours', type='int', default=24,
+                    help='hours of recorded metrics to replay'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 3:
+            raise CommandError('usage: autoscale_replay %s' % self.args)
+        system_name, env_name, group_name = args
+
+        try:
+            system = models.System.objects.get(name=system_name)
+            env = system.environments.get(name=env_name)
+            group = env.groups.get(name=group_name)
+        except ObjectDoesNotExist as e:
+            raise CommandError(e)
+
+        try:
+            policy = autoscaling.Policy(json.loads(options['policy'])
+                                        if options['policy']
+                                        else group.autoscaling)
+        except ValueError as e:
+            raise CommandError(e)
+
+        since = timezone.now() - timedelta(hours=options['hours'])
+        recorded = group.autoscaling_decisions.filter(
+            created_at__gte=since).order_by('created_at')
+        if not recorded:
+            raise CommandError('no recorded metrics since %s' % since)
+
+        start = recorded[0].created_at
+        samples = [((decision.created_at - start).total_seconds(),
+                    decision.metrics) for decision in recorded]
+        decisions = autoscaling.replay(policy, samples, group.minimum_nodes,
+                                       group.maximum_nodes)
+
+        host_seconds = 0.0
+        for i, decision in enumerate(decisions):
+            if i + 1 < len(decisions):
+                host_seconds += decision['desired'] * (
+                    decisions[i + 1]['time'] - decision['time'])
+            if decision['desired'] != decision['current']:
+                self.stdout.write('%7.0fs: %s -> %s hosts (%s)' % (
+                    decision['time'], decision['current'],
+                    decision['desired'], decision['reason']))
+
+        scalings = sum(1 for decision in decisions
+                       if decision['desired'] != decision['current'])
+        self.stdout.write('%s decisions, %s scalings, %.1f host hours' % (
+            len(decisions), scalings, host_seconds / 3600))
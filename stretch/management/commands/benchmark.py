@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+from celery import current_app
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import time
+
+from stretch import models
+from stretch.backends.simulated import SimulatedBackend
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks scaling and deploying a simulated environment.
+
+    Simulated agents and the `LocalConfigManager` keep their state in the
+    process that created them, which celery workers cannot see. The command
+    therefore runs every task eagerly in its own process, as if
+    `CELERY_ALWAYS_EAGER` were set, and needs no workers. The subtasks of a
+    scaling operation then run one after another, so scaling times measure
+    the work of each host rather than worker concurrency.
+    """
+    args = '<system> <env> <group>'
+    help = ('Scales a group of a simulated environment and deploys to it, '
+            'reporting how long each took')
+    option_list = BaseCommand.option_list + (
+        make_option('--hosts', type='int', default=1000,
+                    help='number of hosts to scale the group to'),
+        make_option('--release', default=None,
+                    help='SHA of a release to deploy once scaled'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 3:
+            raise CommandError('usage: benchmark %s' % self.args)
+        system_name, env_name, group_name = args
+
+        try:
+            system = models.System.objects.get(name=system_name)
+            env = system.environments.get(name=env_name)
+            group = env.groups.get(name=group_name)
+        except ObjectDoesNotExist as e:
+            raise CommandError(e)
+
+        if not isinstance(env.backend, SimulatedBackend):
+            raise CommandError('%s does not use a simulated backend' %
+                               env_name)
+
+        current_app.conf.CELERY_ALWAYS_EAGER = True
+        current_app.conf.CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
+
+        start = time.time()
+        operation = group.scale_to(options['hosts'])
+        if operation:
+            # The operation has finished by the time scale_to returns
+            operation = models.ScalingOperation.objects.get(pk=operation.pk)
+            self.report('scale_to(%s)' % options['hosts'], start,
+                        operation.status)
+
+        if options['release']:
+            release = system.releases.get(sha=options['release'])
+            start = time.time()
+            env.deploy(release)
+            self.report('deploy(%s)' % release.sha, start)
+
+        for name, counts in sorted(env.backend.simulator.stats.iteritems()):
+            self.stdout.write('%s: %s' % (name, ', '.join(
+                '%s %s' % (count, key)
+                for key, count in sorted(counts.iteritems()))))
+
+    def report(self, name, start, status=None):
+        line = '%s took %.1fs' % (name, time.time() - start)
+        if status:
+            line += ' (%s)' % status
+        self.stdout.write(line)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'StageTiming'
+        db.create_table(u'stretch_stagetiming', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('deploy', self.gf('django.db.models.fields.related.ForeignKey')(related_name='timings', null=True, to=orm['stretch.Deploy'])),
+            ('release', self.gf('django.db.models.fields.related.ForeignKey')(related_name='timings', null=True, to=orm['stretch.Release'])),
+            ('stage', self.gf('django.db.models.fields.CharField')(max_length=32)),
+            ('host', self.gf('django.db.models.fields.TextField')(null=True)),
+            ('instance', self.gf('django.db.models.fields.CharField')(max_length=36, null=True)),
+            ('started_at', self.gf('django.db.models.fields.DateTimeField')()),
+            ('finished_at', self.gf('django.db.models.fields.DateTimeField')(null=True)),
+            ('failed', self.gf('django.db.models.fields.BooleanField')(default=False)),
+        ))
+        db.send_create_signal(u'stretch', ['StageTiming'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'StageTiming'
+        db.delete_table(u'stretch_stagetiming')
+
+
+    models = {
+        u'stretch.deploy': {
+            'Meta': {'object_name': 'Deploy'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'environment': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'deploys'", 'to': u"orm['stretch.Environment']"}),
+            'existing_release': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'deploy_existing_releases'", 'null': 'True', 'to': u"orm['stretch.Release']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'nodes': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'release': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'deploy_releases'", 'null': 'True', 'to': u"orm['stretch.Release']"}),
+            'task_id': ('django.db.models.fields.CharField', [], {'max_length': '128', 'null': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.environment': {
+            'Meta': {'object_name': 'Environment'},
+            'app_paths': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'auto_deploy': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'config': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'current_release': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['stretch.Release']", 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'node_releases': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'system': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'environments'", 'to': u"orm['stretch.System']"}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'}),
+            'using_source': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        u'stretch.group': {
+            'Meta': {'object_name': 'Group'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'environment': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'groups'", 'to': u"orm['stretch.Environment']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'load_balancer': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'group'", 'unique': 'True', 'null': 'True', 'to': u"orm['stretch.LoadBalancer']"}),
+            'maximum_nodes': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'minimum_nodes': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'node': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['stretch.Node']"}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.host': {
+            'Meta': {'object_name': 'Host'},
+            'address': ('django.db.models.fields.GenericIPAddressField', [], {'max_length': '39'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'domain_name': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'environment': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'hosts'", 'to': u"orm['stretch.Environment']"}),
+            'fqdn': ('django.db.models.fields.TextField', [], {'unique': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'hosts'", 'null': 'True', 'to': u"orm['stretch.Group']"}),
+            'hostname': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'unique': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.instance': {
+            'Meta': {'object_name': 'Instance'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'environment': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'instances'", 'to': u"orm['stretch.Environment']"}),
+            'host': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'instances'", 'to': u"orm['stretch.Host']"}),
+            'id': ('uuidfield.fields.UUIDField', [], {'unique': 'True', 'max_length': '32', 'primary_key': 'True'}),
+            'node': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'instances'", 'to': u"orm['stretch.Node']"}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.loadbalancer': {
+            'Meta': {'object_name': 'LoadBalancer'},
+            'id': ('uuidfield.fields.UUIDField', [], {'max_length': '32', 'primary_key': 'True'}),
+            'options': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'port_name': ('django.db.models.fields.TextField', [], {}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        },
+        u'stretch.node': {
+            'Meta': {'object_name': 'Node'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'system': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'nodes'", 'to': u"orm['stretch.System']"}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.port': {
+            'Meta': {'object_name': 'Port'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'node': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'ports'", 'to': u"orm['stretch.Node']"}),
+            'number': ('django.db.models.fields.IntegerField', [], {}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.release': {
+            'Meta': {'object_name': 'Release'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'manifest': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'sha': ('django.db.models.fields.CharField', [], {'max_length': '28'}),
+            'system': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'releases'", 'to': u"orm['stretch.System']"}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        u'stretch.stagetiming': {
+            'Meta': {'object_name': 'StageTiming'},
+            'deploy': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'timings'", 'null': 'True', 'to': u"orm['stretch.Deploy']"}),
+            'failed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'finished_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'host': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'instance': ('django.db.models.fields.CharField', [], {'max_length': '36', 'null': 'True'}),
+            'release': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'timings'", 'null': 'True', 'to': u"orm['stretch.Release']"}),
+            'stage': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'started_at': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'stretch.system': {
+            'Meta': {'object_name': 'System'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'domain_name': ('django.db.models.fields.TextField', [], {'unique': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'unique': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'null': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['stretch']
\ No newline at end of file
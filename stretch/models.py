@@ -3,28 +3,29 @@ import math
 import logging
 import tarfile
 import json
-import time
+import gevent
 import uuid
 import jsonfield
 import uuidfield
 from contextlib import contextmanager
+from datetime import timedelta
 from distutils import dir_util
 from gevent import pool
-from celery import current_task, group
+from celery import current_task, chord, subtask
 from celery.contrib.methods import task
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models import signals as model_signals
 from django.dispatch import receiver
 from django.core.validators import RegexValidator
 from django.conf import settings
+from django.utils import timezone
 
 from stretch import (signals, source, utils, backend, parser, exceptions,
-                     config_managers)
+                     config_managers, planner, resilience, autoscaling)
 
 from stretch.agent import supervisors
-from stretch.salt_api import salt_client, wheel_client
-from stretch.agent.client import AgentClient
+from stretch.salt_api import salt_client, wheel_client, MinionEvents
 
 
 log = logging.getLogger('stretch')
@@ -102,6 +103,8 @@ class Environment(AuditedModel):
     using_source = models.BooleanField(default=False)
     config = jsonfield.JSONField(default={})
     app_paths = jsonfield.JSONField(default={})
+    node_releases = jsonfield.JSONField(default={})
+    warm_pool_size = models.IntegerField(default=0)
 
     @property
     @utils.memoized
@@ -109,39 +112,196 @@ class Environment(AuditedModel):
         """
         Returns the correct backend to be used with the current environment.
         """
-        return backends.get_backend(self)
+        return backend.get_backend(self)
 
-    @task
-    def deploy(self, obj):
+    @task(name='stretch.models.Environment.deploy')
+    def deploy(self, obj, nodes=None, timeout=None):
         """
         Deploys any release or source to the environment.
 
+        A release can be deployed to a subset of the environment's nodes.
+        Only instances of those nodes are pulled and restarted, and only their
+        plugins and templates are used. The release each node is on is
+        recorded in `node_releases` until the next full deploy.
+
         TODO: Multiple deploy tasks should not be able to run concurrently on
         a single environment.
 
         :Parameters:
           - `obj`: a release or source.
+          - `nodes`: optional list of node names to deploy to.
+          - `timeout`: the seconds the deploy has to finish. Defaults to
+          `STRETCH_DEPLOY_TIMEOUT`. A deploy that runs out of time fails
+          without saving the environment, and can be run again.
         """
         log.info('Deploying %s to %s/%s' % (obj, self.system.name, self.name))
 
-        if hasattr(obj, 'pull'):
-            # Object is source
-            deploy = self._save_deploy(current_task)
+        with TaskSlot.hold(self.system, 'deploy'), \
+                utils.deadline(timeout or settings.STRETCH_DEPLOY_TIMEOUT):
+            if hasattr(obj, 'pull'):
+                # Object is source
+                if nodes:
+                    raise ValueError('a source cannot be deployed to a subset '
+                                     'of nodes')
+                deploy = self._save_deploy(current_task)
+                self._set_release(None)
+            elif hasattr(obj, 'sha'):
+                # Object is release
+                if nodes and self.using_source:
+                    raise ValueError('a release cannot be deployed to a subset '
+                                     'of nodes of an environment using a '
+                                     'source')
+                deploy = self._save_deploy(current_task, obj, nodes)
+                if self.current_release:
+                    deploy.existing_snapshot = \
+                        self.current_release.get_snapshot()
+                self._set_release(obj, nodes)
+            else:
+                raise Exception('unable to deploy object "%s"' % obj)
+
+            self._deploy_obj(obj, deploy)
+
+    @task(name='stretch.models.Environment.rollback')
+    def rollback(self, release, timeout=None):
+        """
+        Rolls the environment back to a previous release.
+
+        Unlike a deploy, the release is neither extracted nor built. Hosts keep
+        the images of their recent releases, templates are mounted from the
+        copy stored with the release, and the release's manifest supplies the
+        migrations to roll the databases back to. Only the release being
+        rolled back from is extracted, and only if it has migrations.
+
+        Releases created without a manifest are deployed instead.
+
+        :Parameters:
+          - `release`: the release to roll back to.
+          - `timeout`: the seconds the rollback has to finish. Defaults to
+          `STRETCH_DEPLOY_TIMEOUT`.
+        """
+        if not release.manifest:
+            return self.deploy(release, timeout=timeout)
+
+        log.info('Rolling %s/%s back to %s' % (self.system.name, self.name,
+                                               release))
+
+        with TaskSlot.hold(self.system, 'deploy'), \
+                utils.deadline(timeout or settings.STRETCH_DEPLOY_TIMEOUT):
+            deploy = self._save_deploy(current_task, release)
+            existing_release = self.current_release
+            self._set_release(release)
+
+            with deploy.record('mount_templates'):
+                deploy.mount_release_templates(release)
+            self._deploy_to_instances(release, deploy=deploy)
+            utils.clear_path(deploy.template_path)
+
+            if existing_release:
+                existing_release.rollback_migrations(deploy, release)
+
+            self.save()
+
+    def plan(self, release, nodes=None):
+        """
+        Returns a `DeployPlan` describing what deploying `release` would do,
+        without deploying it.
+
+        :Parameters:
+          - `release`: the release to plan a deploy of.
+          - `nodes`: optional list of node names to limit the deploy to.
+        """
+        timings = StageTiming.percentiles(environment=self)
+        return planner.DeployPlan(self, release, nodes, timings)
+
+    def _set_release(self, release, nodes=None):
+        """
+        Points the environment at a release being deployed, or at its source
+        if `release` is `None`.
+
+        :Parameters:
+          - `release`: the release being deployed, or `None` for a source.
+          - `nodes`: optional list of node names the release is deployed to.
+        """
+        if release is None:
             self.current_release = None
+            self.node_releases = {}
             self.using_source = True
-        elif hasattr(obj, 'sha'):
-            # Object is release
-            deploy = self._save_deploy(current_task, obj)
-            if self.current_release:
-                deploy.existing_snapshot = self.current_release.get_snapshot()
-            self.current_release = obj
-            self.using_source = False
+            return
+
+        if nodes:
+            node_releases = dict(self.node_releases)
+            for node_name in nodes:
+                node_releases[node_name] = release.pk
+            self.node_releases = node_releases
         else:
-            raise Exception('unable to deploy object "%s"' % obj)
+            self.current_release = release
+            self.node_releases = {}
+        self.using_source = False
+
+    def get_node_release(self, node):
+        """
+        Returns the release that a node is on. This is the environment's
+        current release unless the node was deployed to by a node-scoped
+        deploy since the last full deploy.
+
+        :Parameters:
+          - `node`: the node.
+        """
+        release_id = self.node_releases.get(node.name)
+        if release_id:
+            return Release.objects.get(pk=release_id)
+        return self.current_release
+
+    def get_hosts(self, nodes=None):
+        """
+        Returns the environment's hosts, limited to hosts running instances of
+        `nodes` if given.
+
+        :Parameters:
+          - `nodes`: optional list of node names.
+        """
+        hosts = self.hosts.filter(provisioning_stage=None, warm=False)
+        if nodes:
+            return hosts.filter(instances__node__name__in=nodes).distinct()
+        return hosts
 
-        self._deploy_obj(obj, deploy)
+    @task(name='stretch.models.Environment.fill_warm_pool')
+    def fill_warm_pool(self):
+        """
+        Starts provisioning warm hosts until the environment's warm pool,
+        counting hosts that are still being provisioned, has
+        `warm_pool_size` hosts.
+        """
+        with Lock.hold('warm-pool'):
+            missing = self.warm_pool_size - self.hosts.filter(warm=True).count()
+            hosts = [Host.prepare(self, warm=True) for _ in xrange(missing)]
+        if hosts:
+            log.info('Refilling the warm pool of %s with %s hosts' %
+                     (self.name, len(hosts)))
+        expires_at = utils.Deadline(
+            settings.STRETCH_SCALING_TIMEOUT).expires_at
+        for host in hosts:
+            host._provision.delay(expires_at)
+
+    @task(name='stretch.models.Environment.sync_hosts')
+    def sync_hosts(self, nodes=None):
+        """
+        Installs the dependencies of the environment's hosts and synchronizes
+        their salt modules, with one salt call per batch of
+        `STRETCH_SALT_BATCH_SIZE` hosts.
 
-    @task
+        :Parameters:
+          - `nodes`: optional list of node names to limit the hosts to.
+        """
+        backend = self.backend
+        if backend and not backend.uses_salt:
+            return
+        hosts = list(self.get_hosts(nodes))
+        log.info('Synchronizing %s hosts of %s/%s' % (
+            len(hosts), self.system.name, self.name))
+        Host.sync_many(hosts)
+
+    @task(name='stretch.models.Environment.autoload')
     def autoload(self, source, nodes):
         """
         Called indirectly by the `sync_source` signal. Only functions if the
@@ -154,7 +314,6 @@ class Environment(AuditedModel):
         if self.backend.autoloads:
             log.info('Autoloading %s' % source)
 
-            deferreds = []
             # Use stub deploy for plugins. This deploy is not saved because it
             # represents a minor, incremental change.
             deploy = Deploy.create(environment=self)
@@ -164,19 +323,41 @@ class Environment(AuditedModel):
             # plugins will never trigger an autoload.
             source.run_build_plugins(deploy, nodes)
             node_names = [node.name for node in nodes]
+            reloads = utils.Scheduler(None)
             for instance in self.instances.all():
                 if instance.node.name in node_names:
                     # A simple `reload()` is sufficient to load any file
                     # changes and restart processes. A `restart()` would have
                     # been called if the Docker node image were recompiled.
-                    deferreds.append(instance.reload())
+                    reloads.spawn(None, instance.pk, instance.reload)
+            reloads.join()
+
+    @task(name='stretch.models.Environment.prefetch')
+    def prefetch(self, release):
+        """
+        Pulls the images of a release's nodes onto every host that runs those
+        nodes, ahead of a deploy. Hosts only pull the images, so instances
+        keep running the current release until the release is deployed.
+
+        Prefetches are rate limited: at most `STRETCH_PREFETCH_BATCH_SIZE`
+        hosts pull at the same time, and agents run prefetches one at a time
+        behind any pulls requested by a deploy.
+
+        :Parameters:
+          - `release`: the release to prefetch.
+        """
+        log.info('Prefetching %s for %s/%s' % (release, self.system.name,
+                                               self.name))
 
-            def get_task_list():
-                return defer.DeferredList(deferreds)
+        def prefetch_host(host):
+            for node in host.nodes:
+                host.agent.prefetch_node(node, release)
 
-            threads.blockingCallFromThread(reactor, get_task_list)
+        # Unlike `join()`, `map()` raises the first host's error.
+        pool.Pool(settings.STRETCH_PREFETCH_BATCH_SIZE).map(prefetch_host,
+                                                            self.get_hosts())
 
-    def _save_deploy(self, deploy_task, release=None):
+    def _save_deploy(self, deploy_task, release=None, nodes=None):
         """
         Called when the deploy has officially started. A record of the deploy
         is saved and returned for further usage in the pipeline.
@@ -184,12 +365,15 @@ class Environment(AuditedModel):
         :Parameters:
           - `deploy_task`: the celery task performing the deploy.
           - `release`: the release being deployed.
+          - `nodes`: the names of the nodes being deployed to, or `None` if
+          every node is.
         """
         deploy = Deploy.create(
             environment=self,
             existing_release=self.current_release,
             release=release,
-            task_id=deploy_task.request.id
+            task_id=deploy_task.request.id,
+            nodes=nodes
         )
         deploy.save()
         return deploy
@@ -205,34 +389,142 @@ class Environment(AuditedModel):
           - `deploy`: the corresponding `Deploy` object
         """
         snapshot = obj.get_snapshot()
-        with deploy.start(snapshot):
-            if self.using_source:
-                # Potential WARNING: If celery is used for deploying instances,
-                # app_paths will have to be saved in order to persist across
-                # processes. Since instances and hosts are deployed to by
-                # threads instead of separate processes, this is not a concern
-                # for now.
-                self.app_paths = snapshot.get_app_paths()
-                # Build new images for source
-                snapshot.build_and_push(None, self.system)
-                threads.blockingCallFromThread(reactor, self._deploy_to_instances)
-                #self._deploy_to_instances()
-            else:
-                # Object is release
-                # The release can be deployed immediately since the source
-                # images were compiled and pushed when the release was created.
-                threads.blockingCallFromThread(reactor, self._deploy_to_instances,
-                    obj)
-                #self._deploy_to_instances(obj)
 
-        # Clean up temporary snapshots
-        snapshot.clean_up()
-        if deploy.existing_snapshot:
-            deploy.existing_snapshot.clean_up()
+        batches = self._get_host_batches(deploy.nodes)
+        if len(batches) > 1:
+            # Hand the instance deploys to celery. The deploy is finished by
+            # the chord callback once every batch has been deployed to.
+            deploy.begin(snapshot)
+            self._build_snapshot(snapshot)
+            self._fan_out(deploy, batches)
+            return
+
+        try:
+            with deploy.start(snapshot):
+                self._build_snapshot(snapshot)
+                if self.using_source:
+                    self._deploy_to_instances(deploy=deploy)
+                else:
+                    # Object is release
+                    # The release can be deployed immediately since the source
+                    # images were compiled and pushed when the release was
+                    # created.
+                    self._deploy_to_instances(obj, deploy.nodes, deploy)
+        finally:
+            # Clean up temporary snapshots
+            snapshot.clean_up()
+            if deploy.existing_snapshot:
+                deploy.existing_snapshot.clean_up()
+
+        # The environment is only saved once the deploy succeeded, so a
+        # failed deploy leaves it on its previous release and can be rerun.
+        self.save()
+
+    def _build_snapshot(self, snapshot):
+        """
+        Builds new images if a source is being deployed. Releases need no
+        building since their images were compiled and pushed when the release
+        was created.
+        """
+        if self.using_source:
+            self.app_paths = snapshot.get_app_paths()
+            # Build new images for source
+            snapshot.build_and_push(None, self.system)
+
+    def _get_host_batches(self, nodes=None):
+        """
+        Splits the environment's hosts (or the hosts running `nodes`) into
+        batches of at most
+        `STRETCH_DEPLOY_BATCH_HOSTS` hosts to be deployed to by separate
+        celery subtasks. Returns a list of `(host_ids, restart_limit)` tuples,
+        or an empty list if deploys are not fanned out.
+
+        Every batch belongs to a single group and is given an equal share of
+        the group's batch size as its restart limit, so that a group never
+        restarts more instances at once than it would in a single process.
+        """
+        batch_hosts = settings.STRETCH_DEPLOY_BATCH_HOSTS
+        if not batch_hosts:
+            return []
+
+        batches = []
+        hosts = utils.group_by_attr(self.get_hosts(nodes), 'group')
+        for group, group_hosts in hosts.iteritems():
+            host_ids = [host.pk for host in group_hosts]
+            chunks = [host_ids[i:i + batch_hosts]
+                      for i in xrange(0, len(host_ids), batch_hosts)]
+            restart_limit = None
+            if group:
+                restart_limit = max(group.batch_size // len(chunks), 1)
+            batches += [(chunk, restart_limit) for chunk in chunks]
+        return batches
+
+    def _fan_out(self, deploy, batches):
+        """
+        Deploys to every batch of hosts in a separate celery subtask and
+        finishes the deploy through a chord callback.
+
+        Subtasks only receive the environment's primary key and the deploy's
+        compact context, since a signature of a method task would lose the
+        environment once serialized. `app_paths` is saved beforehand so that
+        subtasks running in other processes can read it. The release the
+        environment is on is only saved by the callback, which rebuilds it
+        from the deploy. A batch that fails marks the deploy as failed, and
+        the callback never runs. The snapshot and template paths in the
+        context must be reachable by the worker that runs the callback.
+
+        :Parameters:
+          - `deploy`: the started `Deploy`.
+          - `batches`: a list of `(host_ids, restart_limit)` tuples.
+        """
+        Environment.objects.filter(pk=self.pk).update(app_paths=self.app_paths)
+        context = deploy.context
+        errback = subtask('stretch.tasks.fail_deploy', (context,))
+        log.info('Deploying to %s in %s batches' % (self.name, len(batches)))
+        chord(subtask('stretch.tasks.deploy_to_hosts',
+                      (self.pk, context, host_ids, restart_limit),
+                      link_error=errback)
+              for host_ids, restart_limit in batches)(
+            subtask('stretch.tasks.finish_deploy', (self.pk, context)))
+
+    def _deploy_to_hosts(self, context, host_ids, restart_limit=None):
+        """
+        Deploys to a batch of hosts. Run by the subtasks of a fanned-out
+        deploy.
+
+        :Parameters:
+          - `context`: the deploy's context.
+          - `host_ids`: the primary keys of the hosts to deploy to.
+          - `restart_limit`: the maximum number of instances restarting at the
+          same time, or `None` for no limit.
+        """
+        deploy = Deploy.objects.get(pk=context['deploy_id'])
+        hosts = utils.Scheduler(settings.STRETCH_BATCH_SIZE)
+        restarts = utils.Scheduler(restart_limit or None)
 
+        with utils.deadline(expires_at=context['expires_at']):
+            for host in self.hosts.filter(pk__in=host_ids):
+                hosts.spawn(None, host.pk, host.pull_nodes, restarts,
+                            deploy.release, deploy.nodes, deploy)
+
+            # Every restart is scheduled by the time the hosts finish.
+            hosts.join()
+            restarts.join()
+
+    def _finish_deploy(self, context):
+        """
+        Finishes a fanned-out deploy after every batch has been deployed to.
+        Run by the chord callback of the deploy.
+
+        :Parameters:
+          - `context`: the deploy's context.
+        """
+        deploy = Deploy.load(context)
+        deploy.finish()
+        self._set_release(deploy.release, deploy.nodes)
         self.save()
 
-    def _deploy_to_instances(self, release=None):
+    def _deploy_to_instances(self, release=None, nodes=None, deploy=None):
         """
         Pulls all associated nodes for every host in the environment. After the
         nodes are pulled, all associated instances are restarted. Since this
@@ -242,8 +534,9 @@ class Environment(AuditedModel):
 
         A host has to pull nodes before its instances can restart and use the
         updated node. In order to follow this constraint while retaining
-        concurrency, host and instance pools are used. Execution is blocked
-        until both of these pools become empty.
+        concurrency, host and instance schedulers are used. Execution is
+        blocked until both of these schedulers finish, and the first host or
+        instance error fails the deploy.
 
         Batch size is used as a form of rate limiting to prevent excessive
         load on the image registry. A batch size of five means that a maximum
@@ -251,78 +544,58 @@ class Environment(AuditedModel):
         When a host is finished, another host is added to the pool. This
         continues until all hosts have pulled their images. When a host is
         finished pulling its images and templates, all of its instances are
-        added to an instance pool.
+        added to the instance scheduler.
 
-        An instance pool is given to every group in the environment. The
-        concurrency of each pool is determined by the number of instances it
-        contains.
+        Every group in the environment restarts at most its batch size of
+        instances at the same time. Hosts without a group restart their
+        instances without a limit.
+
+        The schedulers start the next host or instance the moment a slot frees
+        up, so no batch waits on a polling interval.
 
         :Parameters:
           - `release`: the release to deploy. Left `None` if a source is being
           deployed.
+          - `nodes`: optional list of node names to limit the deploy to.
+          - `deploy`: the deploy to record pull and restart timings for.
         """
+        hosts = utils.Scheduler(settings.STRETCH_BATCH_SIZE)
+        restarts = utils.Scheduler(
+            lambda group: group.batch_size if group else None)
 
-        def restart_instances(host):
-            result = Deferred()
-            state = {'count': 0, 'host_tasks_finished': False}
-            groups = {}
-
-            def on_restart_task_finished():
-                state['count'] -= 1
-                if state['host_tasks_finished'] and state['count'] == 0:
-                    restart.callback(None)
-
-            def restart_instances(host):
-                group = host.group
-                restart_tasks = []
-
-                if group:
-                    if group not in groups:
-                        batch_size = group.batch_size
-                        groups[group] = defer.DeferredSemaphore(batch_size)
-                    semaphore = groups[group]
-                    for instance in self.instances.get():
-                        restart_tasks.append(semaphore.run(instance.restart))
-                else:
-                    for instance in self.instanced.get():
-                        restart_tasks.append(instance.restart)
-
-                deferred = defer.DeferredList(restart_tasks)
-                state['count'] += 1
-                deferred.addCallback(on_restart_task_finished)
+        for host in self.get_hosts(nodes):
+            hosts.spawn(None, host.pk, host.pull_nodes, restarts, release,
+                        nodes, deploy)
 
-            def get_hosts():
-                for host in self.hosts.all():
-                    deferred = host.agent.pull_node()
-                    deferred.addCallback(restart_instances, host)
-                    yield deferred
+        # Every restart is scheduled by the time the hosts finish.
+        hosts.join()
+        restarts.join()
 
-            def on_host_tasks_finished():
-                state['host_tasks_finished'] = True
-
-            host_tasks = []
-            hosts = get_hosts()
-            cooperator = task.Cooperator()
-
-            for _ in xrange(settings.STRETCH_BATCH_SIZE):
-                deferreds.append(cooperator.coiterate(hosts))
-
-            host_task_list = defer.DeferredList(host_tasks)
-            host_task_list.addCallback(on_host_tasks_finished)
-
-            return defer.DeferredList([host_tasks, result])
+    @classmethod
+    def post_init(cls, sender, instance, **kwargs):
+        """
+        Remembers the saved warm pool size, so that `post_save` only refills
+        the warm pool when the size changes.
+        """
+        instance._saved_warm_pool_size = instance.warm_pool_size
 
     @classmethod
     def post_save(cls, sender, instance, created, **kwargs):
         """
         Adds the environment to the config manager if new. Environment
         configuration will be saved on every save. This allows the config
-        manager to propagate changes to an environment's `config`.
+        manager to propagate changes to an environment's `config`. The warm
+        pool is refilled if the environment is new or its size changed.
+        Claimed warm hosts refill it from `Group.scale_up`.
         """
         env = instance
         if created:
             env.system.config_manager.add_env(env)
         env.system.config_manager.sync_env_config(env)
+        resized = env.warm_pool_size != env._saved_warm_pool_size
+        if env.warm_pool_size and (created or resized):
+            env.fill_warm_pool.delay()
+        env._saved_warm_pool_size = env.warm_pool_size
 
     @classmethod
     def pre_delete(cls, sender, instance, **kwargs):
@@ -333,6 +606,7 @@ class Environment(AuditedModel):
         env.system.config_manager.remove_env(env)
 
 
+model_signals.post_init.connect(Environment.post_init, sender=Environment)
 model_signals.post_save.connect(Environment.post_save, sender=Environment)
 model_signals.pre_delete.connect(Environment.pre_delete, sender=Environment)
 
@@ -345,6 +619,7 @@ class Release(AuditedModel):
     name = models.TextField()
     sha = models.CharField('SHA', max_length=28)
     system = models.ForeignKey('System', related_name='releases')
+    manifest = jsonfield.JSONField(default={})
     unique_together = ('system', 'name', 'sha')
     archive_name = 'snapshot.tar.gz'
 
@@ -364,30 +639,47 @@ class Release(AuditedModel):
             system=system
         )
 
+        # The release is saved once it is built, so its timings are kept
+        # until then
+        timings = []
+
         # Copy to temporary directory
-        tmp_path = utils.temp_dir(path)
+        with StageTiming.record('snapshot', save=False) as timing:
+            timings.append(timing)
+            tmp_path = utils.temp_dir(path)
 
-        # Create snapshot
-        snapshot = parser.Snapshot(tmp_path)
+            # Create snapshot
+            snapshot = parser.Snapshot(tmp_path)
 
         # Build release from snapshot
         # Archive the release
-        utils.clear_path(release.data_dir)
+        with StageTiming.record('archive', save=False) as timing:
+            timings.append(timing)
+            utils.clear_path(release.data_dir)
 
-        # Tar release buffer
-        tar_path = os.path.join(release.data_dir, cls.archive_name)
-        tar_file = tarfile.open(tar_path, 'w:gz')
-        tar_file.add(tmp_path, '/')
-        tar_file.close()
+            # Tar release buffer
+            tar_path = os.path.join(release.data_dir, cls.archive_name)
+            tar_file = tarfile.open(tar_path, 'w:gz')
+            tar_file.add(tmp_path, '/')
+            tar_file.close()
+
+            # Record what a rollback to the release needs
+            release.manifest = snapshot.get_manifest()
+            release.store_templates(snapshot)
 
         # Build docker images
-        snapshot.build_and_push(release, system)
+        with StageTiming.record('build_images', save=False) as timing:
+            timings.append(timing)
+            snapshot.build_and_push(release, system)
 
         # Delete snapshot buffer
         utils.delete_path(tmp_path)
 
         # Build finished
         release.save()
+        for timing in timings:
+            timing.release = release
+        StageTiming.objects.bulk_create(timings)
         signals.release_created.send(sender=release)
         return release
 
@@ -398,13 +690,110 @@ class Release(AuditedModel):
         A temporary folder is created for the snapshot. The initializer is
         expected to clean up after usage with `snapshot.clean_up()`. This will
         delete the associated temporary folder.
+
+        If the release has been prepared, the prepared snapshot is copied
+        instead of extracting the archive, and the returned snapshot is marked
+        as prepared so that its build plugins are not run again.
         """
-        tar_path = os.path.join(self.data_dir, self.archive_name)
+        with utils.lock('release-%s' % self.sha):
+            if os.path.exists(self.prepared_marker):
+                tmp_path = utils.temp_dir(self.prepared_path)
+                snapshot = parser.Snapshot(tmp_path)
+                snapshot.prepared = True
+                return snapshot
+
         tmp_path = utils.temp_dir()
+        self._extract(tmp_path)
+        return parser.Snapshot(tmp_path)
+
+    def prepare(self, environment):
+        """
+        Extracts the release, parses it, and runs its build plugins once. The
+        result is cached so that every environment the release is deployed to
+        can reuse it instead of repeating the same work. Only the
+        environment-specific stages of a deploy are left to each environment.
+
+        Build plugins are run with an unsaved stub deploy of `environment`, as
+        they are for autoloads. Their output is shared by every environment
+        the release is deployed to.
+
+        Only the `STRETCH_PREPARED_RELEASES` most recent prepared releases of a
+        system are kept.
+
+        :Parameters:
+          - `environment`: the first environment the release is deployed to.
+        """
+        with utils.lock('release-%s' % self.sha):
+            if not os.path.exists(self.prepared_marker):
+                log.info('Preparing release %s' % self.name)
+                timing = StageTiming(stage='prepare', release=self,
+                                     started_at=timezone.now())
+                utils.clear_path(self.prepared_path)
+                self._extract(self.prepared_path)
+                snapshot = parser.Snapshot(self.prepared_path)
+                snapshot.run_build_plugins(Deploy.create(
+                    release=self, environment=environment))
+                open(self.prepared_marker, 'w').close()
+                timing.finished_at = timezone.now()
+                timing.save()
+
+        stale_releases = self.system.releases.exclude(pk=self.pk).order_by(
+            '-created_at')[settings.STRETCH_PREPARED_RELEASES - 1:]
+        for release in stale_releases:
+            release.clean_prepared()
+
+    def store_templates(self, snapshot):
+        """
+        Copies the templates of every node in `snapshot` to the release's
+        archive directory, so that they can be mounted by rollbacks without
+        extracting the release.
+        """
+        for node in snapshot.nodes:
+            templates_path = os.path.join(node.container.path, 'templates')
+            if os.path.exists(templates_path):
+                dir_util.copy_tree(templates_path,
+                                   os.path.join(self.templates_dir, node.name))
+
+    def rollback_migrations(self, deploy, release):
+        """
+        Migrates the databases of this release's migrations plugins down to
+        the latest migrations of `release`. Only this release has the down
+        migrations needed, so it is extracted if it has any migrations.
+
+        :Parameters:
+          - `deploy`: the rollback deploy.
+          - `release`: the release being rolled back to.
+        """
+        migrations = self.manifest.get('migrations')
+        if not migrations:
+            return
+
+        target_migrations = release.manifest.get('migrations', {})
+        snapshot = self.get_snapshot()
+        for plugin in snapshot.plugins:
+            if plugin.name == 'migrations':
+                migration = target_migrations.get(plugin.relative_path)
+                if migration:
+                    plugin.rollback(deploy, migration)
+                else:
+                    # Leave the database alone since the rollback release
+                    # has no data about it
+                    log.info('Migration plugin not found in rollback '
+                             'release. Skipping.')
+        snapshot.clean_up()
+
+    def clean_prepared(self):
+        """
+        Deletes the release's prepared snapshot, if any.
+        """
+        with utils.lock('release-%s' % self.sha):
+            utils.delete_path(self.cache_dir)
+
+    def _extract(self, path):
+        tar_path = os.path.join(self.data_dir, self.archive_name)
         tar_file = tarfile.open(tar_path)
-        tar_file.extractall(tmp_path)
+        tar_file.extractall(path)
         tar_file.close()
-        return parser.Snapshot(tmp_path)
 
     @property
     def data_dir(self):
@@ -413,6 +802,25 @@ class Release(AuditedModel):
         """
         return os.path.join(settings.STRETCH_DATA_DIR, 'releases', self.sha)
 
+    @property
+    def templates_dir(self):
+        return os.path.join(self.data_dir, 'templates')
+
+    @property
+    def cache_dir(self):
+        """
+        Returns the directory holding the release's prepared snapshot.
+        """
+        return os.path.join(settings.STRETCH_CACHE_DIR, 'releases', self.sha)
+
+    @property
+    def prepared_path(self):
+        return os.path.join(self.cache_dir, 'snapshot')
+
+    @property
+    def prepared_marker(self):
+        return os.path.join(self.cache_dir, 'prepared')
+
 
 class Port(AuditedModel):
     """
@@ -494,6 +902,73 @@ class Instance(AuditedModel):
 
         return instance
 
+    @classmethod
+    def bulk_create(cls, env, placements):
+        """
+        Creates many instances across many hosts with one insert. The nodes
+        that each host is missing are found with one query, and each host's
+        agent adds and pulls them and adds the host's instances in one
+        request. Hosts are handled `STRETCH_BATCH_SIZE` at a time. Returns
+        the instances.
+
+        :Parameters:
+          - `env`: the instances' environment.
+          - `placements`: a list of `(host, node)` tuples, one per instance.
+        """
+        hosts = dict((host.pk, host) for host, node in placements)
+        existing = set(cls.objects.filter(host__in=hosts.keys())
+                       .values_list('host', 'node').distinct())
+
+        instances = [cls(id=uuid.uuid4().hex, environment=env, host=host,
+                         node=node) for host, node in placements]
+        cls.objects.bulk_create(instances)
+
+        host_instances = dict((host_id, []) for host_id in hosts)
+        missing_nodes = dict((host_id, {}) for host_id in hosts)
+        for instance in instances:
+            host_id, node = instance.host.pk, instance.node
+            host_instances[host_id].append(instance)
+            if (host_id, node.pk) not in existing:
+                missing_nodes[host_id][node.pk] = node
+
+        releases = {}
+
+        def get_pulls(nodes):
+            for node in nodes:
+                if node.pk not in releases:
+                    releases[node.pk] = env.get_node_release(node)
+            pulls = [cls.get_pull(env, node, releases[node.pk])
+                     for node in nodes]
+            return [pull for pull in pulls if pull]
+
+        def apply_batch(host_id):
+            nodes = missing_nodes[host_id].values()
+            hosts[host_id].agent.apply_batch(nodes, get_pulls(nodes),
+                                             host_instances[host_id])
+
+        pool.Pool(settings.STRETCH_BATCH_SIZE).map(apply_batch, hosts.keys())
+        return instances
+
+    @classmethod
+    def get_pull(cls, env, node, release):
+        """
+        Returns the `(node, env, release)` arguments to pull a node that is
+        new to a host with, or `None` if the environment has not yet been
+        deployed to.
+
+        :Parameters:
+          - `env`: the environment.
+          - `node`: the node.
+          - `release`: the release the node is on in the environment.
+        """
+        if release:
+            # Use the release the node is on in the environment
+            return (node, env, release)
+        elif env.using_source:
+            return (node, env, None)
+        # Environment has not yet been deployed to
+        return None
+
     def sync_node(self, node):
         """
         Sync the instance's node to the agent. The node will be pulled if it
@@ -505,15 +980,10 @@ class Instance(AuditedModel):
         # REM: block
         if node not in self.host.nodes:
             self.host.agent.add_node(node)
-            if self.environment.current_release:
-                # Use the environment's release
-                self.host.agent.pull(node,
-                    release=self.environment.current_release)
-            elif self.environment.using_source:
-                self.host.agent.pull(node)
-            else:
-                # Environment has not yet been deployed to
-                pass
+            env = self.environment
+            pull = self.get_pull(env, node, env.get_node_release(node))
+            if pull:
+                self.host.agent.pull_node(*pull)
 
     def reload(self):
         """
@@ -538,14 +1008,19 @@ class Instance(AuditedModel):
         """
         return self.environment.system.config_manager.get_instance_key(self)
 
-    def restart(self):
+    def restart(self, deploy=None):
         """
         When the agent restarts an instance, it restarts with the newest
         revision of the node. Restarting should take place after the host pulls
         its nodes.
+
+        :Parameters:
+          - `deploy`: the deploy to record the restart's timing for.
         """
         # Restart instance
-        self.safe_run(self.host.agent.restart_instance)
+        with StageTiming.record('restart', deploy=deploy, host=self.host.name,
+                                instance=str(self.pk)):
+            self.safe_run(self.host.agent.restart_instance)
 
     def safe_run(self, func):
         """
@@ -668,6 +1143,45 @@ class LoadBalancer(models.Model):
         else:
             log.info('Unable to find port with name "%s"' % self.port_name)
 
+    def drain_host(self, host, timeout=None):
+        """
+        Stops sending new connections to a host and waits until its open
+        connections have finished or `timeout` seconds have passed. Hosts of
+        backends that cannot count connections are given the whole timeout.
+        Returns immediately if the backend cannot drain hosts.
+
+        :Parameters:
+          - `host`: the host to drain.
+          - `timeout`: the longest time to wait. Defaults to
+          `STRETCH_DRAIN_TIMEOUT`.
+        """
+        if not host.address:
+            return
+        if not self.backend.lb_drain_host(self, host.address):
+            return
+
+        log.info('Draining %s...' % host.fqdn)
+        if timeout is None:
+            timeout = settings.STRETCH_DRAIN_TIMEOUT
+        with utils.deadline(timeout) as drain_deadline:
+            while not drain_deadline.expired:
+                connections = self.get_connections()
+                if connections is not None and not connections.get(
+                        host.address):
+                    log.info('Drained %s' % host.fqdn)
+                    return
+                gevent.sleep(min(settings.STRETCH_DRAIN_POLL_INTERVAL,
+                               max(drain_deadline.remaining(), 0)))
+        log.info('Stopped draining %s after %ss' % (host.fqdn, timeout))
+
+    def get_connections(self):
+        """
+        Returns a dict of host address to the connections that the load
+        balancer has open to the host, or `None` if the backend cannot count
+        them.
+        """
+        return self.backend.lb_get_connections(self)
+
     @property
     def backend(self):
         backend = self.group.environment.backend
@@ -701,40 +1215,170 @@ class Host(AuditedModel):
     Hosts can either be managed or unmanaged. Managed hosts are created when a
     group is scaled, but unmanaged hosts have no parent group since they are
     created and provisioned manually.
+
+    Managed hosts are saved as soon as they are created and move through the
+    `PROVISIONING_STAGES` in order. `provisioning_stage` is the stage a host
+    is in, or `None` once it is provisioned. Hosts being provisioned are left
+    out of deploys. A host's claim on its stage expires at
+    `provisioning_expires_at` unless its worker renews it.
+
+    Warm hosts are managed hosts without a group. They are provisioned ahead
+    of time, prefetch images instead of creating an instance, and are claimed
+    by groups when scaling up.
     """
+    PROVISIONING_STAGES = ('create', 'accept_key', 'sync', 'instance',
+                           'prefetch')
+
     fqdn = models.TextField(unique=True)
     name = models.TextField(unique=True)
     hostname = models.TextField()
     domain_name = models.TextField(null=True)
     environment = models.ForeignKey('Environment', related_name='hosts')
-    address = models.GenericIPAddressField()
+    group = models.ForeignKey('Group', related_name='hosts', null=True)
+    address = models.GenericIPAddressField(null=True)
+    provisioning_stage = models.CharField(max_length=16, null=True)
+    provisioning_expires_at = models.DateTimeField(null=True)
+    warm = models.BooleanField(default=False)
 
     @classmethod
-    def create(cls, env, group):
+    def create(cls, env, group=None, warm=False):
         """
         Creates, provisions, and saves a new host.
 
+        Hosts created at the same time overlap: every host waits only for a
+        free slot in its next stage, so one host can be synchronized while
+        others are still being built. If provisioning fails, the host is
+        deleted along with its server and minion key.
+
+        :Parameters:
+          - `env`: the host's environment.
+          - `group`: the host's group.
+          - `warm`: `True` to add the host to the environment's warm pool
+          instead of a group.
+        """
+        host = cls.prepare(env, group, warm)
+        host.provision()
+        return host
+
+    @classmethod
+    def prepare(cls, env, group=None, warm=False):
+        """
+        Saves a new host that is queued for provisioning.
+
         :Parameters:
           - `env`: the host's environment.
           - `group`: the host's group.
+          - `warm`: `True` to add the host to the environment's warm pool
+          instead of a group.
         """
         domain_name = env.system.domain_name
         hostname = utils.generate_random_hex(8)
         fqdn = '%s.%s' % (hostname, domain_name) if domain_name else hostname
 
-        host = cls(fqdn=fqdn, name=fqdn, hostname=hostname,
-                   domain_name=domain_name, environment=env, group=group)
-
         if not env.backend:
             raise exceptions.UndefinedBackend()
-        host.address = env.backend.create_host(host)
-        host.finish_provisioning()
-        host.save()
-        log.info('Creating new instance for host...')
-        host.create_instance(group.node)
 
+        host = cls(fqdn=fqdn, name=fqdn, hostname=hostname,
+                   domain_name=domain_name, environment=env, group=group,
+                   warm=warm, provisioning_stage='queued')
+        host.save()
         return host
 
+    @classmethod
+    def claim_warm(cls, group, amount):
+        """
+        Moves up to `amount` provisioned warm hosts of the group's environment
+        into the group and returns them. Claimed hosts still need to create
+        their instance with `finish_claim`.
+
+        :Parameters:
+          - `group`: the group claiming the hosts.
+          - `amount`: the maximum number of hosts to claim.
+        """
+        with Lock.hold('warm-pool'):
+            hosts = list(group.environment.hosts.filter(
+                warm=True, provisioning_stage=None)[:amount])
+            cls.objects.filter(pk__in=[host.pk for host in hosts]).update(
+                warm=False, group=group, provisioning_stage='claimed')
+        for host in hosts:
+            host.warm = False
+            host.group = group
+            host.provisioning_stage = 'claimed'
+        log.info('Claimed %s warm hosts for %s' % (len(hosts), group.name))
+        return hosts
+
+    def provision(self):
+        """
+        Provisions a host saved by `prepare`. Hosts in a group finish by
+        creating the group's instance. Warm hosts finish by prefetching the
+        images of the environment's groups.
+        """
+        with self._provisioning_cleanup():
+            with self.provisioning('create'):
+                self.address = self.environment.backend.create_host(self)
+                self.save()
+            if self.uses_salt:
+                with MinionEvents(self.fqdn) as events:
+                    with self.provisioning('accept_key'):
+                        self._accept_key(events)
+                    with self.provisioning('sync'):
+                        self.sync(events)
+            if self.group:
+                with self.provisioning('instance'):
+                    log.info('Creating new instance for host...')
+                    self.create_instance(self.group.node)
+            else:
+                with self.provisioning('prefetch'):
+                    self.prefetch_nodes()
+
+    def finish_claim(self):
+        """
+        Creates the group's instance on a warm host claimed by the group.
+        """
+        with self._provisioning_cleanup():
+            with self.provisioning('instance'):
+                self.create_instance(self.group.node)
+
+    @contextmanager
+    def _provisioning_cleanup(self):
+        """
+        Marks the host as provisioned once the body of the `with` statement
+        finishes, or deletes the host if it fails.
+        """
+        try:
+            yield
+        except:
+            log.error('Provisioning %s failed in %s' %
+                      (self.fqdn, self.provisioning_stage))
+            try:
+                self.delete()
+            except Exception:
+                log.exception('Failed to clean up %s' % self.fqdn)
+            raise
+        self.provisioning_stage = None
+        self.provisioning_expires_at = None
+        self.save()
+
+    def prefetch_nodes(self):
+        """
+        Pulls the current image of every group's node in the environment, so
+        that the host starts serving quickly once a group claims it. The
+        nodes are added to the agent first, since it only prefetches the
+        images of nodes it has.
+        """
+        env = self.environment
+        nodes = dict((group.node.pk, group.node)
+                     for group in env.groups.all())
+        releases = [(node, env.get_node_release(node))
+                    for node in nodes.values()]
+        releases = [(node, release) for node, release in releases if release]
+        if not releases:
+            return
+
+        self.agent.apply_batch(nodes=[node for node, release in releases])
+        for node, release in releases:
+            self.agent.prefetch_node(node, release)
+
     @classmethod
     def create_unmanaged(cls, env, name, hostname, fqdn):
         host = cls(fqdn=fqdn, name=name, hostname=hostname,
@@ -744,68 +1388,234 @@ class Host(AuditedModel):
         return host
 
     def create_instance(self, node):
-        Instance.create(self.environment, self, node)
+        Instance.bulk_create(self.environment, [(self, node)])
+
+    @contextmanager
+    def provisioning(self, stage):
+        """
+        Moves the host to a provisioning stage once the stage has room for
+        it, then runs the body of the `with` statement. At most
+        `STRETCH_PROVISIONING_LIMITS[stage]` hosts, across every worker, are
+        in a stage at once. Waiting hosts stay in their previous stage.
+
+        The claim on the stage lasts `STRETCH_PROVISIONING_LEASE` seconds and
+        is renewed every third of the lease while the body runs. Claims of
+        hosts whose worker died expire, and their room in the stage is taken
+        by the next waiting host.
 
-    def sync(self):
+        :Parameters:
+          - `stage`: one of `PROVISIONING_STAGES`.
+        """
+        limit = settings.STRETCH_PROVISIONING_LIMITS.get(stage)
+        lease = settings.STRETCH_PROVISIONING_LEASE
+        while True:
+            with Lock.hold('provisioning'):
+                now = timezone.now()
+                hosts = Host.objects.filter(provisioning_stage=stage,
+                                            provisioning_expires_at__gt=now)
+                if not limit or hosts.count() < limit:
+                    expires_at = now + timedelta(seconds=lease)
+                    Host.objects.filter(pk=self.pk).update(
+                        provisioning_stage=stage,
+                        provisioning_expires_at=expires_at)
+                    self.provisioning_stage = stage
+                    self.provisioning_expires_at = expires_at
+                    break
+            utils.get_deadline().check()
+            gevent.sleep(settings.STRETCH_PROVISIONING_POLL_INTERVAL)
+
+        def renew():
+            Host.objects.filter(pk=self.pk).update(
+                provisioning_expires_at=timezone.now() + timedelta(
+                    seconds=lease))
+
+        log.info('Provisioning %s: %s' % (self.fqdn, stage))
+        with utils.heartbeat(renew, lease / 3.0):
+            yield
+
+    def pull_nodes(self, restarts, release=None, nodes=None, deploy=None):
+        """
+        Pulls every node used by the host's instances. Once the nodes are
+        pulled, the host's instances are restarted in the host group's slots
+        of `restarts`, which limits how many instances restart at the same
+        time.
+
+        :Parameters:
+          - `restarts`: the `utils.Scheduler` to restart instances in.
+          - `release`: the release to pull. Left `None` if a source is being
+          deployed.
+          - `nodes`: optional list of node names to limit the pull to.
+          - `deploy`: the deploy to record pull and restart timings for.
+        """
+        with StageTiming.record('pull', deploy=deploy, host=self.name):
+            for node in self.nodes:
+                if not nodes or node.name in nodes:
+                    self.agent.pull_node(node, self.environment, release)
+        instances = self.instances.all()
+        if nodes:
+            instances = instances.filter(node__name__in=nodes)
+        for instance in instances:
+            restarts.spawn(self.group, instance.pk, instance.restart, deploy)
+
+    def sync(self, events=None):
+        """
+        Installs the host's dependencies and synchronizes its salt modules.
+
+        :Parameters:
+          - `events`: optional `MinionEvents` of the host, used to start as
+          soon as the minion does.
+        """
+        if events:
+            events.wait('start')
+        Host.sync_many([self])
+
+    @classmethod
+    def sync_many(cls, hosts):
+        """
+        Installs the dependencies of many hosts and synchronizes their salt
+        modules, with one list-targeted salt call per batch of hosts.
+
+        :Parameters:
+          - `hosts`: the hosts to synchronize.
+        """
         # Install dependencies
-        log.info('Installing dependencies...')
-        for _ in xrange(10):
-            result = self._call('state.highstate')
-            if result != {}:
-                log.debug(result)
-                break
+        log.info('Installing dependencies on %s hosts...' % len(hosts))
+        cls.retry_call_many(hosts, 'state.highstate')
         # Synchronize modules
-        log.info('Synchronizing modules...')
-        for _ in xrange(10):
-            result = self._call('saltutil.sync_modules')
-            if result != {}:
-                log.debug(result)
-                break
+        log.info('Synchronizing modules on %s hosts...' % len(hosts))
+        cls.retry_call_many(hosts, 'saltutil.sync_modules')
 
     def finish_provisioning(self):
-        self._accept_key()
-        self.sync()
+        with MinionEvents(self.fqdn) as events:
+            self._accept_key(events)
+            self.sync(events)
+
+    @task(name='stretch.models.Host._provision')
+    def _provision(self, expires_at=None):
+        with TaskSlot.hold(self.environment.system, 'provision'), \
+                utils.deadline(expires_at=expires_at):
+            self.provision()
 
-    def _accept_key(self):
+    def _accept_key(self, events=None):
+        """
+        Accepts the host's minion key, as soon as the minion asks for it if
+        `events` are given, and otherwise by polling with backoff.
+
+        :Parameters:
+          - `events`: optional `MinionEvents` of the host.
+        """
         log.info('Accepting minion key (%s)...' % self.fqdn)
 
-        success = False
-        for _ in xrange(30):
-            result = wheel_client().call_func('key.accept', match=self.fqdn)
-            if result != {}:
-                success = True
-                break
-            time.sleep(2.0)
+        success = self._try_accept_key()
+        if not success and events:
+            timeout = utils.get_timeout(settings.STRETCH_SALT_EVENT_TIMEOUT)
+            if events.wait('pending', timeout):
+                success = self._try_accept_key()
+        if not success:
+            for delay in utils.jittered_backoff(30, base=1.0, cap=10.0):
+                utils.get_deadline().check()
+                gevent.sleep(delay)
+                if self._try_accept_key():
+                    success = True
+                    break
 
         if success:
             log.info('Accepted minion key')
         else:
             raise Exception('failed to accept minion key')
 
+    def _try_accept_key(self):
+        return resilience.call('salt', wheel_client().call_func,
+                               ('key.accept',), {'match': self.fqdn}) != {}
+
     def _delete_key(self):
-        wheel_client().call_func('key.delete', match=self.fqdn)
+        resilience.call('salt', wheel_client().call_func, ('key.delete',),
+                        {'match': self.fqdn})
+
+    @classmethod
+    def call_many(cls, hosts, fun, arg=()):
+        """
+        Calls a salt function on many hosts, targeting each batch of
+        `STRETCH_SALT_BATCH_SIZE` hosts with one list-targeted call. Returns a
+        list of `(host, result)` tuples in the order of `hosts`, where
+        `result` is `None` if the host's minion did not return.
+
+        :Parameters:
+          - `hosts`: the hosts to call the function on.
+          - `fun`: the salt function, e.g. `state.highstate`.
+          - `arg`: optional arguments of the function.
+        """
+        hosts = list(hosts)
+        batch_size = settings.STRETCH_SALT_BATCH_SIZE or max(len(hosts), 1)
+        kwargs = {'expr_form': 'list'}
+        timeout = utils.get_timeout(settings.STRETCH_SALT_TIMEOUT)
+        if timeout is not None:
+            kwargs['timeout'] = int(math.ceil(timeout))
+
+        results = []
+        for i in xrange(0, len(hosts), batch_size):
+            batch = hosts[i:i + batch_size]
+            returns = resilience.call('salt', salt_client().cmd,
+                ([host.fqdn for host in batch], fun, list(arg)), kwargs)
+            results.extend((host, returns.get(host.fqdn)) for host in batch)
+        return results
+
+    @classmethod
+    def retry_call_many(cls, hosts, fun, arg=()):
+        """
+        Calls a salt function on many hosts like `call_many`, calling it again
+        on the hosts whose minions did not return and backing off between
+        attempts. Returns the hosts whose minions never returned.
 
-    def _call(self, *args, **kwargs):
-        return salt_client().cmd(self.fqdn, *args, **kwargs)
+        :Parameters:
+          - `hosts`: the hosts to call the function on.
+          - `fun`: the salt function.
+          - `arg`: optional arguments of the function.
+        """
+        pending = list(hosts)
+        delays = utils.jittered_backoff(9, base=1.0, cap=10.0)
+        while True:
+            failed = []
+            for host, result in cls.call_many(pending, fun, arg):
+                if result is None:
+                    failed.append(host)
+                else:
+                    log.debug('%s: %s' % (host.fqdn, result))
+            pending = failed
+            delay = next(delays, None)
+            if not pending or delay is None:
+                break
+            utils.get_deadline().check()
+            gevent.sleep(delay)
+
+        for host in pending:
+            log.warning('%s did not return from %s' % (host.fqdn, fun))
+        return pending
 
     @property
     def nodes(self):
-        nodes = []
-        for instance in self.instances.all():
-            if instance.node not in nodes:
-                nodes.append(instance.node)
-        return nodes
+        return list(Node.objects.filter(instances__host=self).distinct())
 
     @property
     @utils.memoized
     def agent(self):
-        return AgentClient(self.address)
+        return utils.get_class(settings.STRETCH_AGENT_CLIENT)(self)
+
+    @property
+    def uses_salt(self):
+        """
+        Returns `False` if the host's backend does not run salt minions, as
+        with simulated hosts.
+        """
+        backend = self.environment.backend
+        return not backend or backend.uses_salt
 
     @classmethod
     def pre_delete(cls, sender, instance, **kwargs):
         host = instance
-        host._delete_key()
-        if host.group:
+        if host.uses_salt:
+            host._delete_key()
+        if host.group or host.warm:
             if not host.environment.backend:
                 raise exceptions.UndefinedBackend()
             host.environment.backend.delete_host(host)
@@ -828,23 +1638,148 @@ class Group(AuditedModel):
     node = models.ForeignKey('Node')
     load_balancer = models.OneToOneField('LoadBalancer', null=True,
                                          related_name='group')
+    # Options of the group's `autoscaling.Policy`; empty to scale manually
+    autoscaling = jsonfield.JSONField(default={})
     unique_together = ('environment', 'name')
 
-    def scale_up(self, amount):
+    def scale_up(self, amount, timeout=None):
+        """
+        Starts creating `amount` hosts in parallel celery tasks and returns
+        the `ScalingOperation` that tracks them. Hosts are claimed from the
+        environment's warm pool first, which is then refilled in the
+        background.
+
+        :Parameters:
+          - `amount`: the number of hosts to create.
+          - `timeout`: the seconds the hosts have to be provisioned in.
+          Defaults to `STRETCH_SCALING_TIMEOUT`. Hosts that run out of time
+          are deleted.
+        """
         self._check_valid_amount(self.hosts.count() + amount)
-        group(self._create_host.s() for _ in xrange(amount))().get()
+        expires_at = self._get_scaling_deadline(timeout)
+        claimed = Host.claim_warm(self, amount)
+        operation = self._start_scaling('up', amount,
+            [subtask('stretch.tasks.add_warm_host',
+                     (self.pk, host.pk, expires_at)) for host in claimed] +
+            [subtask('stretch.tasks.create_host', (self.pk, expires_at))
+             for _ in xrange(amount - len(claimed))])
+        if claimed:
+            self.environment.fill_warm_pool.delay()
+        return operation
+
+    def scale_down(self, amount, timeout=None):
+        """
+        Starts deleting `amount` hosts in parallel celery tasks and returns
+        the `ScalingOperation` that tracks them.
 
-    def scale_down(self, amount):
+        :Parameters:
+          - `amount`: the number of hosts to delete.
+          - `timeout`: the seconds the hosts have to be deleted in. Defaults
+          to `STRETCH_SCALING_TIMEOUT`.
+        """
         self._check_valid_amount(self.hosts.count() - amount)
-        hosts = self.hosts.all()[0:amount]
-        group(self._delete_host.s(host.pk) for host in hosts)().get()
+        hosts = self.get_least_loaded_hosts(amount)
+        expires_at = self._get_scaling_deadline(timeout)
+        return self._start_scaling('down', amount,
+            [subtask('stretch.tasks.delete_host',
+                     (self.pk, host.pk, expires_at)) for host in hosts])
+
+    def get_least_loaded_hosts(self, amount):
+        """
+        Returns the `amount` active hosts of the group with the fewest load
+        balancer connections, and then the lowest CPU load reported by their
+        agents. Hosts whose load is unknown, like unreachable hosts, count as
+        idle. Hosts that are being provisioned or deleted are left out.
+
+        :Parameters:
+          - `amount`: the number of hosts to return.
+        """
+        hosts = list(self.hosts.filter(provisioning_stage=None, warm=False))
+        connections, stats = self.get_host_loads(hosts)
+        connections = connections or {}
+        hosts.sort(key=lambda host: (connections.get(host.address, 0),
+                                     stats.get(host.pk, {}).get('cpu', 0)))
+        return hosts[:amount]
+
+    def get_host_loads(self, hosts):
+        """
+        Returns a `(connections, stats)` tuple with the load of `hosts`:
+        a dict of host address to load balancer connections, or `None` if
+        the group has no load balancer or its backend cannot count
+        connections, and a dict of host primary key to the stats reported by
+        the host's agent. Agents are asked `STRETCH_LOAD_CONCURRENCY` at a
+        time, and hosts whose agents fail are left out.
+
+        :Parameters:
+          - `hosts`: the hosts of the group.
+        """
+        connections = None
+        if self.load_balancer:
+            connections = self.load_balancer.get_connections()
+
+        stats = {}
 
-    def scale_to(self, amount):
+        def get_stats(host):
+            try:
+                stats[host.pk] = host.agent.get_stats()
+            except Exception:
+                log.exception('Failed to get the load of %s' % host.fqdn)
+
+        host_pool = pool.Pool(settings.STRETCH_LOAD_CONCURRENCY)
+        for host in hosts:
+            if host.address:
+                host_pool.spawn(get_stats, host)
+        host_pool.join()
+        return connections, stats
+
+    def autoscale(self):
+        """
+        Scales the group to the number of hosts decided by its autoscaling
+        policy, unless the group is already scaling. Returns the recorded
+        `AutoscalingDecision`, or `None` if the group does not autoscale or
+        is scaling.
+        """
+        if not self.autoscaling:
+            return None
+        if self.scaling_operations.filter(
+                status=ScalingOperation.RUNNING).exists():
+            log.info('Not autoscaling %s while it is scaling' % self.name)
+            return None
+
+        policy = autoscaling.Policy(self.autoscaling)
+        hosts = list(self.hosts.filter(provisioning_stage=None))
+        metrics = autoscaling.collect_metrics(hosts,
+                                              *self.get_host_loads(hosts))
+        since_scaling = None
+        last_operation = self.scaling_operations.order_by('-created_at')[:1]
+        if last_operation:
+            since_scaling = (timezone.now() -
+                             last_operation[0].created_at).total_seconds()
+
+        current = self.hosts.count()
+        desired, reason = policy.decide(current, metrics, self.minimum_nodes,
+                                        self.maximum_nodes, since_scaling)
+        decision = AutoscalingDecision(group=self, metrics=metrics,
+                                       current=current, desired=desired,
+                                       reason=reason)
+        if desired != current:
+            log.info('Autoscaling %s from %s to %s hosts: %s' % (
+                self.name, current, desired, reason))
+            decision.operation = self.scale_to(desired)
+        decision.save()
+        return decision
+
+    def scale_to(self, amount, timeout=None):
+        """
+        Scales the group to `amount` hosts. Returns the `ScalingOperation`,
+        or `None` if the group already has `amount` hosts.
+        """
         relative_amount = amount - self.hosts.count()
         if relative_amount > 0:
-            self.scale_up(relative_amount)
+            return self.scale_up(relative_amount, timeout)
         elif relative_amount < 0:
-            self.scale_down(-relative_amount)
+            return self.scale_down(-relative_amount, timeout)
+        return None
 
     def create_load_balancer(self, port_name, protocol, options={}):
         if not self.load_balancer:
@@ -861,13 +1796,79 @@ class Group(AuditedModel):
         if not valid:
             raise ValueError('invalid scaling amount')
 
-    @task
-    def _create_host(self):
-        Host.create(self.environment, self)
+    def _get_scaling_deadline(self, timeout=None):
+        return utils.Deadline(
+            timeout or settings.STRETCH_SCALING_TIMEOUT).expires_at
+
+    def _start_scaling(self, action, amount, subtasks):
+        """
+        Runs the host subtasks of a scaling operation in a chord and returns
+        the operation without waiting for them. The chord callback records
+        the results.
+
+        Subtasks are tasks of `stretch.tasks` that take the group's primary
+        key, since a signature of a method task would lose the group once
+        serialized.
+        """
+        operation = ScalingOperation.objects.create(group=self, action=action,
+                                                    amount=amount)
+        log.info('Scaling %s %s by %s (%s)' % (self.name, action, amount,
+                                               operation.pk))
+        result = chord(subtasks)(subtask('stretch.tasks.finish_scaling',
+                                         (self.pk, operation.pk)))
+        operation.task_id = result.id
+        operation.save()
+        return operation
+
+    def _create_host(self, expires_at=None):
+        with TaskSlot.hold(self.environment.system, 'provision'), \
+                utils.deadline(expires_at=expires_at):
+            # Failures are returned rather than raised so that the chord
+            # callback still runs and records them.
+            try:
+                host = Host.create(self.environment, self)
+            except Exception as e:
+                log.exception('Failed to create a host for %s' % self.name)
+                return {'host': None, 'error': str(e)}
+            return {'host': host.fqdn, 'error': None}
+
+    def _add_warm_host(self, host_id, expires_at=None):
+        with utils.deadline(expires_at=expires_at):
+            host = Host.objects.get(pk=host_id)
+            try:
+                host.finish_claim()
+            except Exception as e:
+                log.exception('Failed to add warm host %s' % host.fqdn)
+                return {'host': host.fqdn, 'error': str(e)}
+            return {'host': host.fqdn, 'error': None}
+
+    def _delete_host(self, host_id, expires_at=None):
+        with utils.deadline(expires_at=expires_at):
+            try:
+                host = Host.objects.get(pk=host_id)
+                if self.load_balancer:
+                    self.load_balancer.drain_host(host)
+                host.delete()
+            except Exception as e:
+                log.exception('Failed to delete host %s' % host_id)
+                return {'host': host_id, 'error': str(e)}
+            return {'host': host.fqdn, 'error': None}
+
+    def _finish_scaling(self, results, operation_id):
+        """
+        Finishes a scaling operation after every host subtask has returned.
 
-    @task
-    def _delete_host(self, host_id):
-        Host.objects.get(pk=host_id).delete()
+        :Parameters:
+          - `results`: the results of the host subtasks.
+          - `operation_id`: the primary key of the `ScalingOperation`.
+        """
+        if self.load_balancer:
+            # Endpoints of new instances are added as they are registered,
+            # so only make sure the load balancer is watched.
+            endpoints = supervisors.endpoint_supervisor_client()
+            endpoints.add_group(self.pk, self.config_key)
+        operation = ScalingOperation.objects.get(pk=operation_id)
+        operation.finish(results)
 
     @property
     def config_key(self):
@@ -879,13 +1880,96 @@ class Group(AuditedModel):
                    settings.STRETCH_BATCH_SIZE)
 
 
+class ScalingOperation(AuditedModel):
+    """
+    A scale up or down of a group. Scaling runs in the background, so the
+    operation is returned right away and can be polled for its status. Once
+    every host has been created or deleted, `results` holds the host and
+    error, if any, of each.
+    """
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    group = models.ForeignKey('Group', related_name='scaling_operations')
+    action = models.CharField(max_length=8)
+    amount = models.IntegerField()
+    status = models.CharField(max_length=16, default=RUNNING)
+    task_id = models.CharField(max_length=128, null=True)
+    results = jsonfield.JSONField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def finish(self, results):
+        """
+        Records the results of the host subtasks. The operation fails if any
+        host failed.
+
+        :Parameters:
+          - `results`: the results of the host subtasks.
+        """
+        self.results = results
+        if any(result['error'] for result in results):
+            self.status = self.FAILED
+        else:
+            self.status = self.FINISHED
+        self.finished_at = timezone.now()
+        self.save()
+        log.info('Scaling %s %s' % (self.pk, self.status))
+
+    def as_dict(self):
+        hosts = self.group.hosts.exclude(provisioning_stage=None)
+        return {
+            'id': self.pk,
+            'group': self.group.name,
+            'action': self.action,
+            'amount': self.amount,
+            'status': self.status,
+            'results': self.results,
+            'provisioning': dict(hosts.values_list('fqdn',
+                                                   'provisioning_stage'))
+        }
+
+
+class AutoscalingDecision(AuditedModel):
+    """
+    A decision of a group's autoscaling policy and the metrics it was made
+    from. Decisions are recorded whether or not the group scaled, so that
+    their metrics can be replayed through other policies with
+    `autoscaling.replay`.
+    """
+    group = models.ForeignKey('Group', related_name='autoscaling_decisions')
+    metrics = jsonfield.JSONField(default={})
+    current = models.IntegerField()
+    desired = models.IntegerField()
+    reason = models.TextField()
+    operation = models.ForeignKey('ScalingOperation', null=True)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'group': self.group.name,
+            'created_at': self.created_at.isoformat(),
+            'metrics': self.metrics,
+            'current': self.current,
+            'desired': self.desired,
+            'reason': self.reason,
+            'operation': self.operation_id
+        }
+
+
 class Deploy(AuditedModel):
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
     release = models.ForeignKey('Release', related_name='deploy_releases',
                                 null=True)
     existing_release = models.ForeignKey('Release',
         related_name='deploy_existing_releases', null=True)
     environment = models.ForeignKey('Environment', related_name='deploys')
     task_id = models.CharField(max_length=128, null=True)
+    nodes = jsonfield.JSONField(null=True)
+    status = models.CharField(max_length=16, default=RUNNING)
 
     @classmethod
     def create(cls, *args, **kwargs):
@@ -894,37 +1978,414 @@ class Deploy(AuditedModel):
         deploy.existing_snapshot = None
         return deploy
 
+    @classmethod
+    def load(cls, context):
+        """
+        Returns the deploy described by `context` with its snapshots, for use
+        in a process other than the one that started the deploy.
+
+        :Parameters:
+          - `context`: the deploy's context.
+        """
+        deploy = cls.objects.get(pk=context['deploy_id'])
+        deploy.snapshot = parser.Snapshot(context['snapshot_path'])
+        deploy.snapshot.prepared = True
+        deploy.existing_snapshot = None
+        if context['existing_snapshot_path']:
+            deploy.existing_snapshot = parser.Snapshot(
+                context['existing_snapshot_path'])
+        return deploy
+
     @contextmanager
     def start(self, snapshot):
-        self.snapshot = snapshot
-        self.snapshot.run_build_plugins(self)
-        self.snapshot.run_pre_deploy_plugins(self)
-        template_path = os.path.join(settings.STRETCH_CACHE_DIR, 'templates',
-                                     str(self.environment.pk))
-
-        with self.snapshot.mount_templates(template_path):
+        try:
+            self.begin(snapshot)
             yield
+            self.finish()
+        except Exception:
+            self.fail()
+            raise
 
-        utils.clear_path(template_path)
-        self.snapshot.run_post_deploy_plugins(self)
+    def begin(self, snapshot):
+        """
+        Runs the stages of the deploy that come before instances are deployed
+        to: build plugins (unless the snapshot is prepared), pre-deploy
+        plugins, and template mounting.
+        """
+        self.snapshot = snapshot
+        if not self.snapshot.prepared:
+            with self.record('build_plugins'):
+                self.snapshot.run_build_plugins(self, self.snapshot_nodes)
+        with self.record('pre_deploy'):
+            self.snapshot.run_pre_deploy_plugins(self, self.snapshot_nodes)
+        with self.record('mount_templates'):
+            self.mount_templates(self.snapshot, self.template_path)
+
+    def finish(self):
+        """
+        Runs the stages of the deploy that come after instances are deployed
+        to, and deletes the deploy's snapshots.
+        """
+        utils.clear_path(self.template_path)
+        with self.record('post_deploy'):
+            self.snapshot.run_post_deploy_plugins(self, self.snapshot_nodes)
         utils.delete_path(self.snapshot.path)
         if self.existing_snapshot:
             utils.delete_path(self.existing_snapshot.path)
+        self.status = self.FINISHED
+        self.save()
+
+    def fail(self):
+        """
+        Marks the deploy as failed.
+        """
+        self.status = self.FAILED
+        self.save()
+        log.info('Deploy %s failed' % self.pk)
+
+    def record(self, stage, host=None, instance=None):
+        """
+        Returns a context manager that records the timing of a stage of the
+        deploy.
+        """
+        return StageTiming.record(stage, deploy=self, host=host,
+                                  instance=instance)
+
+    def get_critical_path(self):
+        """
+        Returns the chain of recorded stages that determined the deploy's
+        duration. Stages run once per deploy come first, followed by the pull
+        of the host and the restart of the instance that finished last, and
+        post-deploy plugins. Time an instance spent waiting for a restart slot
+        after its host pulled is reported as a `queued` stage.
+        """
+        timings = list(self.timings.exclude(finished_at=None).order_by(
+            'started_at'))
+        path = [t for t in timings
+                if t.stage in ('build_plugins', 'pre_deploy', 'mount_templates')]
+
+        restarts = [t for t in timings if t.stage == 'restart']
+        pulls = [t for t in timings if t.stage == 'pull']
+        if restarts:
+            last = max(restarts, key=lambda t: t.finished_at)
+            host_pulls = [t for t in pulls if t.host == last.host]
+            if host_pulls:
+                pull = host_pulls[-1]
+                path.append(pull)
+                queued = last.started_at - pull.finished_at
+                if queued.total_seconds() > 0:
+                    path.append(StageTiming(
+                        stage='queued', deploy=self, host=last.host,
+                        instance=last.instance, started_at=pull.finished_at,
+                        finished_at=last.started_at))
+            path.append(last)
+        elif pulls:
+            path.append(max(pulls, key=lambda t: t.finished_at))
+
+        path.extend(t for t in timings if t.stage == 'post_deploy')
+        return [{
+            'stage': t.stage,
+            'host': t.host,
+            'instance': t.instance,
+            'started_at': t.started_at.isoformat(),
+            'seconds': t.duration
+        } for t in path]
 
-    @contextmanager
     def mount_templates(self, snapshot, path):
-        utils.clear_path(path)
-        for node in snapshot.nodes:
-            try:
-                node_obj = self.environment.system.nodes.get(name=node.name)
-            except Node.DoesNotExist:
-                pass
+        nodes = self.snapshot_nodes
+        if nodes is None:
+            utils.clear_path(path)
+            nodes = snapshot.nodes
+        for node in nodes:
+            self._mount_node_templates(node.name, os.path.join(
+                node.container.path, 'templates'), path)
+
+    def mount_release_templates(self, release):
+        """
+        Mounts the templates stored with `release` without extracting it.
+        """
+        utils.clear_path(self.template_path)
+        for node_name in release.manifest.get('nodes', []):
+            self._mount_node_templates(node_name, os.path.join(
+                release.templates_dir, node_name), self.template_path)
+
+    def _mount_node_templates(self, node_name, templates_path, path):
+        try:
+            node_obj = self.environment.system.nodes.get(name=node_name)
+        except Node.DoesNotExist:
+            pass
+        else:
+            dest_path = os.path.join(path, str(node_obj.pk))
+            utils.clear_path(dest_path)
+            if os.path.exists(templates_path):
+                dir_util.copy_tree(templates_path, dest_path)
+
+    @property
+    def snapshot_nodes(self):
+        """
+        Returns the snapshot nodes that the deploy is limited to, or `None` if
+        the deploy covers every node.
+        """
+        if not self.nodes:
+            return None
+        return [node for node in self.snapshot.nodes
+                if node.name in self.nodes]
+
+    @property
+    def template_path(self):
+        return os.path.join(settings.STRETCH_CACHE_DIR, 'templates',
+                            str(self.environment.pk))
+
+    @property
+    def context(self):
+        """
+        Returns a compact, serializable description of the deploy that lets
+        other processes take part in it.
+        """
+        existing_snapshot_path = None
+        if self.existing_snapshot:
+            existing_snapshot_path = self.existing_snapshot.path
+        return {
+            'deploy_id': self.pk,
+            'snapshot_path': self.snapshot.path,
+            'existing_snapshot_path': existing_snapshot_path,
+            'template_path': self.template_path,
+            'nodes': [node.name for node in self.snapshot.nodes],
+            'expires_at': utils.get_deadline().expires_at
+        }
+
+
+class StageTiming(models.Model):
+    """
+    The start and end of a stage of a deploy or release, optionally scoped to
+    a host or instance.
+
+    Deploys record `build_plugins`, `pre_deploy`, `mount_templates` and
+    `post_deploy` once, `pull` per host, and `restart` per instance. Releases
+    record `snapshot`, `archive` and `build_images` when created, and
+    `prepare` when prepared.
+    """
+    deploy = models.ForeignKey('Deploy', related_name='timings', null=True)
+    release = models.ForeignKey('Release', related_name='timings', null=True)
+    stage = models.CharField(max_length=32)
+    host = models.TextField(null=True)
+    instance = models.CharField(max_length=36, null=True)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True)
+    failed = models.BooleanField(default=False)
+
+    @classmethod
+    @contextmanager
+    def record(cls, stage, save=True, **kwargs):
+        """
+        Times the body of the `with` statement as `stage`. The timing is
+        saved when the body exits, and marked as failed if it raised. Nothing
+        is saved if neither a deploy nor a release is given, which lets
+        callers record stages unconditionally.
+
+        :Parameters:
+          - `stage`: the name of the stage.
+          - `save`: `False` to leave saving to the caller.
+          - `kwargs`: the timing's deploy, release, host, or instance.
+        """
+        timing = cls(stage=stage, started_at=timezone.now(), **kwargs)
+        try:
+            yield timing
+        except:
+            timing.failed = True
+            raise
+        finally:
+            timing.finished_at = timezone.now()
+            if save and (timing.deploy or timing.release):
+                timing.save()
+
+    @classmethod
+    def percentiles(cls, environment=None, deploys=None):
+        """
+        Returns the 50th and 95th percentile durations, in seconds, of every
+        deploy stage across recent successful stages.
+
+        :Parameters:
+          - `environment`: optional environment to limit the deploys to.
+          - `deploys`: the number of recent deploys to use. Defaults to
+          `STRETCH_TIMING_DEPLOYS`.
+        """
+        recent_deploys = Deploy.objects.order_by('-created_at')
+        if environment:
+            recent_deploys = recent_deploys.filter(environment=environment)
+        deploy_ids = list(recent_deploys.values_list('pk', flat=True)[
+            :deploys or settings.STRETCH_TIMING_DEPLOYS])
+
+        durations = {}
+        timings = cls.objects.filter(deploy__in=deploy_ids, failed=False) \
+            .exclude(finished_at=None)
+        for timing in timings:
+            durations.setdefault(timing.stage, []).append(timing.duration)
+
+        return dict((stage, {
+            'count': len(values),
+            'p50': utils.percentile(values, 50),
+            'p95': utils.percentile(values, 95)
+        }) for stage, values in durations.iteritems())
+
+    @property
+    def duration(self):
+        return (self.finished_at - self.started_at).total_seconds()
+
+
+class Lock(models.Model):
+    """
+    A named lock shared by the workers of every host through the database,
+    unlike `utils.lock`, which only covers one host.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+
+    @classmethod
+    @contextmanager
+    def hold(cls, name):
+        """
+        Holds the lock while the body of the `with` statement runs in a
+        transaction. The lock's row is locked with `SELECT ... FOR UPDATE`, so
+        other holders wait for the transaction to end. The lock is released
+        with the transaction if the worker dies.
+
+        :Parameters:
+          - `name`: the lock's name.
+        """
+        with transaction.commit_on_success():
+            cls.objects.get_or_create(name=name)
+            cls.objects.select_for_update().get(name=name)
+            yield
+
+
+class TaskSlot(models.Model):
+    """
+    A worker slot held or requested by a system's build, deploy, or
+    provisioning task.
+
+    Every system shares the same celery workers. To keep one system's backlog
+    from starving another, tasks hold a slot while they run. At most
+    `STRETCH_WORKER_SLOTS` slots are held at once, and a system never holds
+    more than its `STRETCH_SYSTEM_CONCURRENCY` cap. When slots are contended,
+    the next free slot goes to the waiting system with the fewest held slots
+    relative to its weight in `STRETCH_SYSTEM_WEIGHTS`. Tasks that are not
+    admitted are retried by celery after `STRETCH_SCHEDULER_RETRY_DELAY`
+    seconds, which frees the worker in the meantime.
+
+    Held slots expire after `STRETCH_SCHEDULER_LEASE` seconds unless their
+    task renews them, so that tasks lost with their worker do not hold them
+    forever. Running tasks renew their slot every third of the lease.
+    """
+    system = models.ForeignKey('System', related_name='task_slots')
+    kind = models.CharField(max_length=16)
+    task_id = models.CharField(max_length=128, unique=True)
+    active = models.BooleanField(default=False)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    @classmethod
+    @contextmanager
+    def hold(cls, system, kind):
+        """
+        Holds a slot for the current task while the body of the `with`
+        statement runs. If no slot is available, the task is retried later.
+        Bodies not run by a celery task, or run by a task that already holds a
+        slot, run immediately.
+
+        :Parameters:
+          - `system`: the system the task works for.
+          - `kind`: the kind of task, e.g. `build`, `deploy`, or `provision`.
+        """
+        request = getattr(current_task, 'request', None)
+        task_id = getattr(request, 'id', None)
+
+        if (not task_id or
+                cls.objects.filter(task_id=task_id, active=True).exists()):
+            yield
+            return
+
+        if not cls.request(system, kind, task_id):
+            log.info('Waiting for a worker slot for %s (%s)' %
+                     (system.name, kind))
+            raise current_task.retry(
+                countdown=settings.STRETCH_SCHEDULER_RETRY_DELAY,
+                max_retries=None)
+
+        def renew():
+            cls.objects.filter(task_id=task_id).update(
+                expires_at=timezone.now() + timedelta(
+                    seconds=settings.STRETCH_SCHEDULER_LEASE))
+
+        try:
+            with utils.heartbeat(renew,
+                                 settings.STRETCH_SCHEDULER_LEASE / 3.0):
+                yield
+        finally:
+            cls.objects.filter(task_id=task_id).delete()
+
+    @classmethod
+    def request(cls, system, kind, task_id):
+        """
+        Requests a slot for a task and returns `True` if it was admitted.
+        Tasks that are not admitted are recorded as waiting so that other
+        systems leave room for them, unless their system is already at its
+        concurrency cap.
+        """
+        with Lock.hold('task-slots'):
+            now = timezone.now()
+            cls.objects.filter(expires_at__lt=now).delete()
+
+            slot, _ = cls.objects.get_or_create(task_id=task_id, defaults={
+                'system': system,
+                'kind': kind,
+                'expires_at': now
+            })
+
+            held = list(cls.objects.filter(active=True).values_list(
+                'system__name', flat=True))
+            waiting = set(cls.objects.filter(active=False).values_list(
+                'system__name', flat=True))
+
+            def usage(name):
+                weight = settings.STRETCH_SYSTEM_WEIGHTS.get(name, 1)
+                return held.count(name) / float(weight)
+
+            def capped(name):
+                cap = settings.STRETCH_SYSTEM_CONCURRENCY.get(
+                    name, settings.STRETCH_WORKER_SLOTS)
+                return held.count(name) >= cap
+
+            # Systems at their cap cannot take a free slot, so they do not
+            # keep it from others
+            admitted = (len(held) < settings.STRETCH_WORKER_SLOTS and
+                        not capped(system.name) and
+                        all(usage(system.name) <= usage(name)
+                            for name in waiting if not capped(name)))
+
+            if admitted:
+                slot.active = True
+                lease = settings.STRETCH_SCHEDULER_LEASE
             else:
-                dest_path = os.path.join(path, str(node_obj.pk))
-                utils.clear_path(dest_path)
-                templates_path = os.path.join(node.container.path, 'templates')
-                if os.path.exists(templates_path):
-                    dir_util.copy_tree(templates_path, dest_path)
+                # Waiting slots expire unless the task keeps retrying
+                lease = settings.STRETCH_SCHEDULER_RETRY_DELAY * 3
+            slot.expires_at = now + timedelta(seconds=lease)
+            slot.save()
+            return admitted
+
+
+class PendingResource(models.Model):
+    """
+    A cloud resource that a worker waits on to reach a status, e.g. a server
+    being built. `stretch.tasks.poll_resources` lists the resources of every
+    poller with waiters once per run and records their status here, so that
+    waiters in every worker process share one listing. See
+    `backend.StatusPoller`.
+    """
+    poller = models.CharField(max_length=128, db_index=True)
+    resource_id = models.CharField(max_length=64)
+    status = models.CharField(max_length=32, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    polled_at = models.DateTimeField(null=True)
 
 
 @receiver(signals.sync_source)
@@ -948,6 +2409,17 @@ def on_load_sources(sender, **kwargs):
 @receiver(signals.release_created)
 def on_release_created(sender, **kwargs):
     release = sender
-    for env in release.system.environments.all():
+    environments = release.system.environments.all()
+
+    auto_deploy_envs = [env for env in environments if env.auto_deploy]
+    if len(auto_deploy_envs) > 1:
+        # Extract, parse and build the release once for all of the deploys.
+        release.prepare(auto_deploy_envs[0])
+
+    for env in environments:
         if env.auto_deploy:
             env.deploy.delay(release)
+        elif settings.STRETCH_PREFETCH_IMAGES:
+            # Deploys pull their own images, so only environments that are
+            # deployed to later benefit from a prefetch.
+            env.prefetch.delay(release)
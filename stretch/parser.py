@@ -9,7 +9,7 @@ import logging
 from StringIO import StringIO
 from contextlib import contextmanager
 
-from stretch import utils, contexts, exceptions
+from stretch import utils, contexts, exceptions, resilience
 from stretch.plugins import create_plugin
 
 
@@ -26,6 +26,8 @@ class Snapshot(object):
         self.relative_path = '/'
         self.nodes = []
         self.containers = []
+        # `True` if build plugins have already been run on the snapshot
+        self.prepared = False
 
         # Begin parsing source
         self.parse()
@@ -99,17 +101,17 @@ class Snapshot(object):
 
     def run_build_plugins(self, deploy, nodes=None):
         for plugin in self.plugins:
-            if nodes and plugin.parent in nodes:
+            if nodes is None or plugin.parent in nodes:
                 plugin.build(deploy)
 
     def run_pre_deploy_plugins(self, deploy, nodes=None):
         for plugin in self.plugins:
-            if nodes and plugin.parent in nodes:
+            if nodes is None or plugin.parent in nodes:
                 plugin.pre_deploy(deploy)
 
     def run_post_deploy_plugins(self, deploy, nodes=None):
         for plugin in self.plugins:
-            if nodes and plugin.parent in nodes:
+            if nodes is None or plugin.parent in nodes:
                 plugin.post_deploy(deploy)
 
     def get_app_paths(self):
@@ -119,6 +121,22 @@ class Snapshot(object):
                 app_paths[node.name] = node.app_path
         return app_paths
 
+    def get_manifest(self):
+        """
+        Returns a summary of the snapshot that allows it to be rolled back to
+        without extracting it: the names of its nodes and the latest migration
+        of each migrations plugin, by the plugin's relative path.
+        """
+        migrations = {}
+        for plugin in self.plugins:
+            if plugin.name == 'migrations':
+                migrations[plugin.relative_path] = \
+                    plugin.get_latest_migration()
+        return {
+            'nodes': [node.name for node in self.nodes],
+            'migrations': migrations
+        }
+
     def clean_up(self):
         utils.delete_path(self.path)
 
@@ -262,8 +280,9 @@ class Container(object):
                 # Base container
                 self.tag = 'stretch_base/%s' % system.pk
             elif release:
-                # Node container
-                self.tag = node.get_image()
+                # Node container, tagged by release so that hosts can keep the
+                # images of previous releases for rollbacks
+                self.tag = '%s:%s' % (node.get_image(), release.sha)
             else:
                 # Local container
                 self.tag = node.get_image(local=True)
@@ -273,13 +292,15 @@ class Container(object):
             with open(os.path.join(self.path, 'Dockerfile'), 'w') as f:
                 f.write(dockerdata)
 
+            utils.get_deadline().check()
             log.debug(docker_client.build(self.path, self.tag))
 
             # Push node containers to registry
             if not self.parent:
                 log.info('Pushing %s to registry' % self.tag)
                 # TODO: use api for push
-                log.debug(utils.check_output(['docker', 'push', self.tag]))
+                log.debug(resilience.call('registry', utils.check_output,
+                                          (['docker', 'push', self.tag],)))
                 cert = settings.STRETCH_REGISTRY.cert
                 # TODO: push with cert if available
                 # log.debug(docker_client.push(self.tag))
@@ -0,0 +1,239 @@
+import os
+import math
+import logging
+from gevent import pool
+from django.conf import settings
+
+
+log = logging.getLogger('stretch')
+
+
+class DeployPlan(object):
+    """
+    A dry run of a release deploy. The plan is computed from the database
+    topology, the difference between the environment's current release and
+    the release, and the image inventories reported by host agents. Nothing
+    is pulled, restarted, or saved.
+
+    The estimated duration follows the deploy pipeline: build plugins (unless
+    the release is prepared), pre-deploy plugins, and template mounting run
+    once, hosts pull their images in a pool of `STRETCH_BATCH_SIZE`, each
+    group restarts its instances in batches of its batch size, and post-deploy
+    plugins run last. Only the stages on the critical path are estimated: the
+    setup stages, the pulls of the host that finishes last once its group's
+    restart batches are added, that group's restart batches, and the
+    post-deploy plugins.
+
+    Stage durations are the median of recent recorded stage timings. Stages
+    that have not been recorded yet fall back to `STRETCH_PLAN_STAGE_SECONDS`.
+    """
+    setup_stages = ('build_plugins', 'pre_deploy', 'mount_templates')
+
+    def __init__(self, env, release, nodes=None, timings=None):
+        """
+        :Parameters:
+          - `env`: the environment to deploy to.
+          - `release`: the release to deploy.
+          - `nodes`: optional list of node names to limit the deploy to.
+          - `timings`: optional stage timing percentiles, as returned by
+          `StageTiming.percentiles`.
+        """
+        self.environment = env
+        self.release = release
+        self.nodes = nodes
+        self.timings = timings or {}
+        self.hosts = []
+        self.groups = []
+        self.critical_path = []
+        self.duration = 0.0
+
+        hosts = list(env.get_hosts(nodes))
+        inventories = pool.Pool(settings.STRETCH_BATCH_SIZE).map(
+            self.get_inventory, hosts)
+        self.inventories = dict(zip([host.pk for host in hosts], inventories))
+
+        self.diff = self.get_diff()
+        self.hosts = [self.plan_host(host) for host in hosts]
+        self.groups = self.plan_groups()
+        self.plan_critical_path()
+
+    def get_estimate(self, stage):
+        """
+        Returns the estimated number of seconds that `stage` takes.
+        """
+        timing = self.timings.get(stage)
+        if timing and timing['count']:
+            return timing['p50']
+        return settings.STRETCH_PLAN_STAGE_SECONDS[stage]
+
+    def get_inventory(self, host):
+        """
+        Returns a dictionary of the images on `host` and their sizes in bytes,
+        or `None` if the host's agent could not be reached.
+        """
+        try:
+            images = host.agent.get_images()
+        except Exception as e:
+            log.warning('Unable to get image inventory of %s: %s' %
+                        (host.name, e))
+            return None
+        return dict((image['image'], image['size']) for image in images)
+
+    def get_diff(self):
+        """
+        Returns the difference between the environment's current release and
+        the release being deployed.
+        """
+        manifest = self.release.manifest
+        existing_release = self.environment.current_release
+        existing_manifest = existing_release.manifest if existing_release \
+            else {}
+
+        node_names = set(manifest.get('nodes', []))
+        existing_node_names = set(existing_manifest.get('nodes', []))
+        migrations = manifest.get('migrations', {})
+        existing_migrations = existing_manifest.get('migrations', {})
+
+        return {
+            'existing_release': existing_release.sha if existing_release
+                else None,
+            'added_nodes': sorted(node_names - existing_node_names),
+            'removed_nodes': sorted(existing_node_names - node_names),
+            'migrations': sorted(path for path, migration
+                in migrations.iteritems()
+                if existing_migrations.get(path) != migration),
+            'prepared': os.path.exists(self.release.prepared_marker)
+        }
+
+    def plan_host(self, host):
+        """
+        Returns the pulls and restarts that a deploy would perform on `host`.
+        """
+        inventory = self.inventories[host.pk]
+        pulls = []
+        for node in host.nodes:
+            if self.nodes and node.name not in self.nodes:
+                continue
+            image = '%s:%s' % (node.get_image(local=False, private=True),
+                               self.release.sha)
+            present = bool(inventory) and image in inventory
+            pulls.append({
+                'node': node.name,
+                'image': image,
+                'present': present,
+                'bytes': 0 if present else self.get_image_size(image)
+            })
+
+        instances = host.instances.all()
+        if self.nodes:
+            instances = instances.filter(node__name__in=self.nodes)
+
+        transfer = sum(pull['bytes'] or 0 for pull in pulls)
+        return {
+            'name': host.name,
+            'group': host.group.name if host.group else None,
+            'inventory': inventory is not None,
+            'pulls': pulls,
+            'bytes': transfer,
+            'restarts': instances.count(),
+            'seconds': (len(pulls) * self.get_estimate('pull') +
+                        float(transfer) / settings.STRETCH_PLAN_PULL_RATE)
+        }
+
+    def get_image_size(self, image):
+        """
+        Returns the size of `image` as reported by any host that has it. If
+        no host has it, the most recent size of the node's image from a
+        previous release is used. Returns `None` if the size is unknown.
+        """
+        repository = image.rsplit(':', 1)[0]
+        fallback = None
+        for inventory in self.inventories.values():
+            for name, size in (inventory or {}).iteritems():
+                if name == image:
+                    return size
+                if name.rsplit(':', 1)[0] == repository:
+                    fallback = max(fallback, size)
+        return fallback
+
+    def plan_groups(self):
+        """
+        Returns the number of instance restarts and restart batches of every
+        group touched by the deploy.
+        """
+        groups = []
+        for group in self.environment.groups.all():
+            restarts = sum(host['restarts'] for host in self.hosts
+                           if host['group'] == group.name)
+            if not restarts:
+                continue
+            batch_size = max(group.batch_size, 1)
+            groups.append({
+                'name': group.name,
+                'restarts': restarts,
+                'batch_size': batch_size,
+                'batches': int(math.ceil(restarts / float(batch_size)))
+            })
+        return groups
+
+    def plan_critical_path(self):
+        """
+        Estimates the deploy's duration and the chain of stages that
+        determines it.
+        """
+        self.critical_path = []
+        for stage in self.setup_stages:
+            if stage == 'build_plugins' and self.diff['prepared']:
+                continue
+            self.add_stage(stage, None, self.get_estimate(stage))
+
+        # Hosts start pulling as soon as a slot in the host pool frees up
+        slots = [0.0] * settings.STRETCH_BATCH_SIZE
+        pulled_at = {}
+        for host in self.hosts:
+            slot = slots.index(min(slots))
+            slots[slot] += host['seconds']
+            pulled_at[host['name']] = (slots[slot], host)
+
+        # A host's instances restart once the host pulled. Restart slots are
+        # shared by every host of a group, so the host may wait for all of its
+        # group's batches.
+        batches = dict((group['name'], group['batches'])
+                       for group in self.groups)
+        slowest = None
+        for name, (finished_at, host) in pulled_at.iteritems():
+            restart_batches = batches.get(host['group'], 1 if host['restarts']
+                                          else 0)
+            restart_seconds = restart_batches * self.get_estimate('restart')
+            total = finished_at + restart_seconds
+            if slowest is None or total > slowest[0]:
+                slowest = (total, finished_at, restart_seconds, host)
+
+        if slowest:
+            total, finished_at, restart_seconds, host = slowest
+            self.add_stage('pull', host['name'], finished_at)
+            self.add_stage('restart', host['group'] or host['name'],
+                           restart_seconds)
+
+        self.add_stage('post_deploy', None, self.get_estimate('post_deploy'))
+
+    def add_stage(self, stage, target, seconds):
+        self.critical_path.append({
+            'stage': stage,
+            'target': target,
+            'seconds': seconds
+        })
+        self.duration = sum(s['seconds'] for s in self.critical_path)
+
+    def as_dict(self):
+        return {
+            'environment': self.environment.name,
+            'release': self.release.sha,
+            'nodes': self.nodes,
+            'diff': self.diff,
+            'hosts': self.hosts,
+            'groups': self.groups,
+            'bytes': sum(host['bytes'] for host in self.hosts),
+            'critical_path': self.critical_path,
+            'duration': self.duration
+        }
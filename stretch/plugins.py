@@ -172,6 +172,46 @@ class MigrationsPlugin(Plugin):
         # Clean up
         os.remove(rendered_file)
 
+    def rollback(self, deploy, migration):
+        """
+        Migrates the database down to `migration` using the migrations of this
+        plugin. Used by rollbacks, which take the migration to roll back to
+        from the target release's manifest instead of its files.
+
+        :Parameters:
+          - `deploy`: the rollback deploy.
+          - `migration`: the latest migration of the target release.
+        """
+        self.setup()
+        path = self.get_path()
+
+        deploy_contexts = [contexts.create_deploy_context(deploy)]
+        context = self.options.get('context')
+        if context:
+            deploy_contexts.append(context)
+
+        rendered_file = self.render_template(('database.json',), path,
+                                             deploy_contexts)
+
+        os.chdir(path)
+        self.env.call_npm(['install'])
+        call(['db-migrate', '-e', 'stretch', 'down', migration])
+
+        os.remove(rendered_file)
+
+    def get_latest_migration(self):
+        """
+        Returns the file name of the plugin's latest migration, or `None` if it
+        has no migrations.
+        """
+        path = os.path.join(self.get_path(), 'migrations')
+        if not os.path.exists(path):
+            return None
+        migrations = [m for m in os.listdir(path) if m.split('-')[0].isdigit()]
+        if not migrations:
+            return None
+        return reduce(self.get_later_migration, migrations)
+
     @staticmethod
     def get_later_migration(m1, m2):
         if int(m1.split('-')[0]) > int(m2.split('-')[0]):
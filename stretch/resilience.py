@@ -0,0 +1,190 @@
+import time
+import logging
+import threading
+import collections
+import gevent
+from django.conf import settings
+
+from stretch import utils, exceptions
+
+
+log = logging.getLogger('stretch')
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# Kind of target (the part of the target before the first colon) to counters
+# of calls, failures, retries, rejected calls and opened breakers
+stats = collections.defaultdict(collections.Counter)
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the health of one call target. After `threshold` consecutive
+    failures the breaker opens and calls to the target fail fast with
+    `CircuitOpen`. Once `reset_timeout` seconds have passed, one trial call is
+    let through: the breaker closes if it succeeds and stays open for another
+    `reset_timeout` if it fails.
+
+    :Parameters:
+      - `target`: the name of the target, e.g. `agent:10.0.0.1`.
+      - `threshold`: consecutive failures that open the breaker.
+      - `reset_timeout`: seconds before an open breaker lets a call through.
+    """
+    def __init__(self, target, threshold, reset_timeout):
+        self.target = target
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_call(self):
+        """
+        Raises `CircuitOpen` if the target may not be called yet.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.time() - self.opened_at < self.reset_timeout:
+                raise exceptions.CircuitOpen(self.target)
+            # Let this call through as the trial and hold back the others
+            self.opened_at = time.time()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """
+        Records a failed call. Returns `True` if it opened the breaker.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.threshold:
+                return False
+            opened = self.opened_at is None
+            self.opened_at = time.time()
+            return opened
+
+
+def get_breaker(target):
+    with _breakers_lock:
+        breaker = _breakers.get(target)
+        if not breaker:
+            breaker = _breakers[target] = CircuitBreaker(target,
+                settings.STRETCH_BREAKER_THRESHOLD,
+                settings.STRETCH_BREAKER_RESET_TIMEOUT)
+        return breaker
+
+
+def get_kind(target):
+    return target.split(':')[0]
+
+
+def is_transient(e):
+    """
+    Returns `False` for errors that retrying cannot fix: HTTP and API errors
+    with a 4xx status code other than 413 and 429. Everything else, such as
+    connection errors and timeouts, is assumed to be transient.
+    """
+    code = getattr(e, 'code', None)
+    response = getattr(e, 'response', None)
+    if response is not None:
+        code = getattr(response, 'status_code', code)
+    if not isinstance(code, int):
+        return True
+    return not 400 <= code < 500 or code in (413, 429)
+
+
+def call(target, func, args=(), kwargs=None, attempts=None,
+         retryable=is_transient):
+    """
+    Calls `func` on behalf of `target`, retrying transient failures with
+    jittered exponential backoff. Calls fail fast with `CircuitOpen` while
+    the target's circuit breaker is open. The attempts and backoff of each
+    kind of target are given by `STRETCH_RETRY_POLICIES`.
+
+    Errors that are not retryable are raised right away and do not count
+    against the target, since the target did respond. `DeadlineExceeded` is
+    never retried.
+
+    :Parameters:
+      - `target`: the target's kind, optionally followed by a colon and the
+      target's name, e.g. `etcd` or `agent:10.0.0.1`. Each target has its
+      own circuit breaker.
+      - `func`: the function to call.
+      - `args`: positional arguments of `func`.
+      - `kwargs`: keyword arguments of `func`.
+      - `attempts`: the maximum number of calls, overriding the policy. Use
+      `1` for calls that are not safe to repeat.
+      - `retryable`: returns whether an error may be retried.
+    """
+    kind = get_kind(target)
+    policy = settings.STRETCH_RETRY_POLICIES.get(kind, {})
+    if attempts is None:
+        attempts = policy.get('attempts', 1)
+    delays = utils.jittered_backoff(attempts - 1, policy.get('base', 1.0),
+                                    policy.get('cap', 30.0))
+    breaker = get_breaker(target)
+
+    while True:
+        try:
+            breaker.before_call()
+        except exceptions.CircuitOpen:
+            stats[kind]['rejected'] += 1
+            raise
+        stats[kind]['calls'] += 1
+
+        try:
+            result = func(*args, **(kwargs or {}))
+        except exceptions.DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not retryable(e):
+                breaker.record_success()
+                raise
+            stats[kind]['failures'] += 1
+            if breaker.record_failure():
+                stats[kind]['opened'] += 1
+                log.warning('Circuit breaker of %s opened' % target)
+            delay = next(delays, None)
+            if delay is None or breaker.is_open:
+                raise
+            stats[kind]['retries'] += 1
+            log.debug('Retrying %s in %.1fs: %s' % (target, delay, e))
+            utils.get_deadline().check()
+            gevent.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def get_stats():
+    """
+    Returns the counters of each kind of target and the targets whose
+    circuit breakers are open.
+    """
+    with _breakers_lock:
+        open_targets = sorted(target for target, breaker
+                              in _breakers.iteritems() if breaker.is_open)
+    return {
+        'counters': dict((kind, dict(counters))
+                         for kind, counters in stats.iteritems()),
+        'open': open_targets
+    }
+
+
+def reset():
+    """
+    Forgets every circuit breaker and counter.
+    """
+    with _breakers_lock:
+        _breakers.clear()
+    stats.clear()
@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+import salt.client
+import salt.config
+import salt.wheel
+import salt.utils.event
+from django.conf import settings
+
+from stretch import utils
+
+
+log = logging.getLogger('stretch')
+
+
+@utils.memoized
+def master_opts():
+    return salt.config.master_config(
+        os.path.join(settings.STRETCH_SALT_CONF_PATH, 'master'))
+
+
+@utils.memoized
+def salt_client():
+    return salt.client.LocalClient(
+        os.path.join(settings.STRETCH_SALT_CONF_PATH, 'master'))
+
+
+@utils.memoized
+def wheel_client():
+    return salt.wheel.Wheel(master_opts())
+
+
+@utils.memoized
+def caller_client():
+    return salt.client.Caller()
+
+
+class MinionEvents(object):
+    """
+    Listens to the salt master's event bus for the events of one minion. Use
+    it as a context manager around the provisioning steps that wait on the
+    minion, so that events fired in between are not missed.
+
+    If the event bus cannot be reached, as when stretch does not run on the
+    salt master, `wait` returns `False` right away and callers fall back to
+    polling.
+
+    :Parameters:
+      - `minion_id`: the minion's id, which is the host's fqdn.
+    """
+    def __init__(self, minion_id):
+        self.minion_id = minion_id
+        self.event = None
+
+    def __enter__(self):
+        try:
+            self.event = salt.utils.event.MasterEvent(
+                master_opts()['sock_dir'])
+        except Exception:
+            log.warning('Salt event bus unavailable, polling %s instead' %
+                        self.minion_id)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.event and hasattr(self.event, 'destroy'):
+            self.event.destroy()
+        self.event = None
+
+    def wait(self, kind, timeout=None):
+        """
+        Waits for an event of the minion and returns `True` once it arrives,
+        or `False` if it did not arrive within `timeout` seconds.
+
+        :Parameters:
+          - `kind`: `pending` when the minion's key awaits acceptance, or
+          `start` when the minion has started.
+          - `timeout`: the seconds to wait. Defaults to
+          `STRETCH_SALT_EVENT_TIMEOUT`.
+        """
+        if not self.event:
+            return False
+
+        if timeout is None:
+            timeout = settings.STRETCH_SALT_EVENT_TIMEOUT
+        wait_until = time.time() + timeout
+        while True:
+            remaining = wait_until - time.time()
+            if remaining <= 0:
+                return False
+            event = self.event.get_event(wait=min(remaining, 1.0), full=True)
+            if event and self.matches(kind, event['tag'], event['data']):
+                log.debug('Received %s event of %s' % (kind, self.minion_id))
+                return True
+
+    def matches(self, kind, tag, data):
+        if data.get('id') != self.minion_id:
+            return False
+        if kind == 'pending':
+            return tag == 'salt/auth' and data.get('act') == 'pend'
+        elif kind == 'start':
+            return tag in ('minion_start',
+                           'salt/minion/%s/start' % self.minion_id)
+        return False
@@ -230,8 +230,116 @@ STRETCH_TEMP_DIR = '/tmp/stretch'
 STRETCH_DATA_DIR = '/var/lib/stretch'
 STRETCH_CACHE_DIR = '/var/cache/stretch'
 STRETCH_BACKEND_IMAGE_PREFIX = 'stretch-host-image'
+# Seconds before backends list their images, flavors, servers and load
+# balancers again
+STRETCH_BACKEND_CATALOG_TTL = 60
+# Seconds between a waiter's checks of the status recorded for a pending
+# cloud resource, and seconds after which pending resources left behind by
+# lost workers are no longer polled. Statuses are recorded by the
+# `poll-resources` periodic task.
+STRETCH_BACKEND_POLL_INTERVAL = 2
+STRETCH_BACKEND_PENDING_TTL = 6 * 60 * 60
+# Maximum seconds a worker waits on a cloud resource, unless its deadline is
+# shorter
+STRETCH_BACKEND_WAIT_TIMEOUT = 60 * 60
+# Seconds that load balancer endpoint changes are collected for before they
+# are applied together (0 applies every change on its own)
+STRETCH_LB_BATCH_WINDOW = 0.5
 STRETCH_SALT_CONF_PATH = '/etc/salt'
 STRETCH_BATCH_SIZE = 5
+STRETCH_PREFETCH_IMAGES = False
+STRETCH_PREFETCH_BATCH_SIZE = 2
+STRETCH_PREPARED_RELEASES = 3
+# Hosts per celery subtask when fanning out deploys (0 deploys in-process)
+STRETCH_DEPLOY_BATCH_HOSTS = 0
+# Deploy planner estimates: registry throughput per host in bytes per second,
+# and the seconds each deploy stage is assumed to take until it has recorded
+# timings
+STRETCH_PLAN_PULL_RATE = 10 * 1024 * 1024
+STRETCH_PLAN_STAGE_SECONDS = {
+    'build_plugins': 30.0,
+    'pre_deploy': 10.0,
+    'mount_templates': 1.0,
+    'pull': 5.0,
+    'restart': 10.0,
+    'post_deploy': 10.0
+}
+# Number of recent deploys that stage timing percentiles are computed from
+STRETCH_TIMING_DEPLOYS = 50
+# Fair scheduling of builds, deploys and provisioning across systems: slots
+# shared by all systems, system name to share weight (default 1), system
+# name to maximum held slots, seconds between admission attempts, and
+# seconds before a held slot expires unless its running task renews it
+STRETCH_WORKER_SLOTS = 8
+STRETCH_SYSTEM_WEIGHTS = {}
+STRETCH_SYSTEM_CONCURRENCY = {}
+STRETCH_SCHEDULER_RETRY_DELAY = 5
+STRETCH_SCHEDULER_LEASE = 5 * 60
+# Seconds that deploys, scaling operations and release builds have to finish
+# (None for no deadline), and the longest single agent or salt call
+STRETCH_DEPLOY_TIMEOUT = None
+STRETCH_SCALING_TIMEOUT = None
+STRETCH_BUILD_TIMEOUT = None
+STRETCH_AGENT_TIMEOUT = 30
+STRETCH_SALT_TIMEOUT = 300
+# Seconds that provisioning waits for a minion's key or start event on the
+# salt master's event bus before falling back to polling
+STRETCH_SALT_EVENT_TIMEOUT = 120
+# Hosts targeted by each list-targeted salt call when calling a function on
+# many hosts (0 targets every host at once)
+STRETCH_SALT_BATCH_SIZE = 50
+# Scale-down removes the hosts with the fewest load balancer connections and
+# then the lowest CPU load, asking this many agents for their load at once.
+# Removed hosts are drained for at most `STRETCH_DRAIN_TIMEOUT` seconds,
+# counting their connections every `STRETCH_DRAIN_POLL_INTERVAL` seconds.
+STRETCH_LOAD_CONCURRENCY = 20
+STRETCH_DRAIN_TIMEOUT = 120
+STRETCH_DRAIN_POLL_INTERVAL = 5
+# Retries of failed agent, salt, backend, registry and etcd calls: the
+# maximum calls of each, and the base and cap in seconds of the jittered
+# exponential backoff between them
+STRETCH_RETRY_POLICIES = {
+    'agent': {'attempts': 3, 'base': 0.5, 'cap': 5.0},
+    'salt': {'attempts': 3, 'base': 1.0, 'cap': 10.0},
+    'backend': {'attempts': 4, 'base': 2.0, 'cap': 30.0},
+    'registry': {'attempts': 3, 'base': 2.0, 'cap': 30.0},
+    'etcd': {'attempts': 3, 'base': 0.2, 'cap': 2.0}
+}
+# Consecutive failures after which calls to a host, registry or API fail fast,
+# and seconds before a call is tried again
+STRETCH_BREAKER_THRESHOLD = 5
+STRETCH_BREAKER_RESET_TIMEOUT = 30
+# Classes of the configuration store and of agent clients. Simulated
+# environments use `stretch.config_managers.LocalConfigManager` and
+# `stretch.backends.simulated.SimulatedAgentClient`, whose latency, failure
+# and rate limit profile is given by `STRETCH_SIMULATED_AGENT`
+STRETCH_CONFIG_MANAGER = 'stretch.config_managers.EtcdConfigManager'
+STRETCH_AGENT_CLIENT = 'stretch.agent.client.AgentClient'
+STRETCH_SIMULATED_AGENT = {}
+# Hosts that may be in each provisioning stage at once across every worker
+# (missing or None for no limit), seconds between attempts to enter a full
+# stage, and seconds a host's claim on its stage lasts unless it is renewed
+STRETCH_PROVISIONING_LIMITS = {
+    'create': None,
+    'accept_key': None,
+    'sync': 4,
+    'instance': None,
+    'prefetch': None
+}
+STRETCH_PROVISIONING_POLL_INTERVAL = 2.0
+STRETCH_PROVISIONING_LEASE = 5 * 60
+# Worker options for every celery queue, used by `stretch celery`. Long tasks
+# are prefetched one at a time so that idle workers can take queued ones.
+STRETCH_CELERY_WORKERS = {
+    'default': {'pool': 'processes', 'concurrency': 4,
+                'prefetch_multiplier': 4},
+    'builds': {'pool': 'processes', 'concurrency': 2,
+               'prefetch_multiplier': 1},
+    'deploys': {'pool': 'processes', 'concurrency': 8,
+                'prefetch_multiplier': 1},
+    'provisioning': {'pool': 'processes', 'concurrency': 16,
+                     'prefetch_multiplier': 1}
+}
 
 ## Agent #
 STRETCH_AGENT_PORT = 24225
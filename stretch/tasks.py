@@ -1,11 +1,149 @@
+import logging
+from datetime import timedelta
 from celery import task
-from stretch import models
+from celery.signals import worker_process_init
+from django.conf import settings
+from django.utils import timezone
+from gevent import monkey
 
+from stretch import models, utils, backend
 
-@task()
-def create_release(system_name, source_options):
+
+log = logging.getLogger('stretch')
+
+
+@task(name='stretch.tasks.create_release')
+def create_release(system_name, source_options, timeout=None):
     system = models.System.objects.get(name=system_name)
-    release = system.create_release(source_options)
+    with models.TaskSlot.hold(system, 'build'), \
+            utils.deadline(timeout or settings.STRETCH_BUILD_TIMEOUT):
+        release = system.create_release(source_options)
+
+
+@task(name='stretch.tasks.deploy_to_hosts')
+def deploy_to_hosts(env_id, context, host_ids, restart_limit=None):
+    """
+    Deploys to a batch of hosts of a fanned-out deploy. See
+    `Environment._fan_out`.
+    """
+    env = models.Environment.objects.get(pk=env_id)
+    env._deploy_to_hosts(context, host_ids, restart_limit)
+
+
+@task(name='stretch.tasks.finish_deploy')
+def finish_deploy(results, env_id, context):
+    """
+    Finishes a fanned-out deploy once every batch subtask has returned.
+    """
+    models.Environment.objects.get(pk=env_id)._finish_deploy(context)
+
+
+@task(name='stretch.tasks.fail_deploy')
+def fail_deploy(task_id, context):
+    """
+    Marks a fanned-out deploy as failed. Linked as the errback of every
+    batch subtask, which passes the id of the failed subtask.
+    """
+    models.Deploy.objects.get(pk=context['deploy_id']).fail()
+
+
+@task(name='stretch.tasks.create_host')
+def create_host(group_id, expires_at=None):
+    """
+    Creates a host of a group as part of a scaling operation. See
+    `Group.scale_up`.
+    """
+    return models.Group.objects.get(pk=group_id)._create_host(expires_at)
+
+
+@task(name='stretch.tasks.add_warm_host')
+def add_warm_host(group_id, host_id, expires_at=None):
+    """
+    Adds a host claimed from the warm pool to a group as part of a scaling
+    operation. See `Group.scale_up`.
+    """
+    group = models.Group.objects.get(pk=group_id)
+    return group._add_warm_host(host_id, expires_at)
+
+
+@task(name='stretch.tasks.delete_host')
+def delete_host(group_id, host_id, expires_at=None):
+    """
+    Deletes a host of a group as part of a scaling operation. See
+    `Group.scale_down`.
+    """
+    return models.Group.objects.get(pk=group_id)._delete_host(host_id,
+                                                              expires_at)
+
+
+@task(name='stretch.tasks.finish_scaling')
+def finish_scaling(results, group_id, operation_id):
+    """
+    Finishes a scaling operation once every host subtask has returned.
+    """
+    group = models.Group.objects.get(pk=group_id)
+    group._finish_scaling(results, operation_id)
+
+
+@task(name='stretch.tasks.bake_images')
+def bake_images():
+    """
+    Bakes the current host image of every backend. Image names include the
+    stretch version and a hash of the image bootstrap script, so an image is
+    only baked after either changes. Scheduled by `CELERYBEAT_SCHEDULE`, so
+    that starting several workers does not bake the same image more than
+    once.
+    """
+    backend_map = backend.get_backend_map(settings.STRETCH_BACKENDS)
+    with utils.lock('bake-images'):
+        for envs in backend_map.values():
+            for env_backend in envs.values():
+                env_backend.bake_image()
+
+
+@task(name='stretch.tasks.poll_resources')
+def poll_resources():
+    """
+    Records the status of the cloud resources that workers wait on, with one
+    listing per backend poller. Scheduled by `CELERYBEAT_SCHEDULE`.
+    """
+    models.PendingResource.objects.filter(
+        created_at__lt=timezone.now() - timedelta(
+            seconds=settings.STRETCH_BACKEND_PENDING_TTL)).delete()
+
+    backend_map = backend.get_backend_map(settings.STRETCH_BACKENDS)
+    for envs in backend_map.values():
+        for env_backend in envs.values():
+            try:
+                env_backend.poll_resources()
+            except Exception:
+                log.exception('Failed to poll resources of %s' %
+                              env_backend.target)
+
+
+@task(name='stretch.tasks.autoscale')
+def autoscale():
+    """
+    Runs the autoscaling policy of every group that has one. Scheduled by
+    `CELERYBEAT_SCHEDULE`.
+    """
+    for group in models.Group.objects.all():
+        try:
+            group.autoscale()
+        except Exception:
+            log.exception('Failed to autoscale %s' % group.name)
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    """
+    Makes sockets cooperative in every worker process, so that the greenlets
+    of a task's `utils.Scheduler` run their agent and backend requests
+    concurrently instead of one at a time. Threads are left unpatched, which
+    keeps deadlines shared by the greenlets of a thread.
+    """
+    monkey.patch_socket()
+    monkey.patch_ssl()
 
 """
 @task()
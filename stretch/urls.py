@@ -1,6 +1,12 @@
 from django.conf.urls import patterns, include, url
 
 urlpatterns = patterns('',
-    url(r'^api/systems/(\w+)/releases/$', 'api.get_releases'),
-    url(r'^api/systems/(\w+)/deploy/$', 'api.deploy'),
+    url(r'^api/systems/(\w+)/releases/$', 'stretch.api.get_releases'),
+    url(r'^api/systems/(\w+)/deploy/$', 'stretch.api.deploy'),
+    url(r'^api/systems/(\w+)/rollback/$', 'stretch.api.rollback'),
+    url(r'^api/systems/(\w+)/plan/$', 'stretch.api.plan'),
+    url(r'^api/systems/(\w+)/sync/$', 'stretch.api.sync_hosts'),
+    url(r'^api/systems/(\w+)/scale/$', 'stretch.api.scale'),
+    url(r'^api/systems/(\w+)/scaling/(\d+)/$',
+        'stretch.api.get_scaling_operation'),
 )
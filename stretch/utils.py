@@ -1,4 +1,7 @@
 import os
+import math
+import time
+import logging
 import errno
 import importlib
 import lockfile
@@ -10,10 +13,17 @@ import collections
 import subprocess
 import tempfile
 import cPickle
-import time
+import threading
+import gevent
+from gevent import coros
+from contextlib import contextmanager
 from distutils import dir_util
 from django.conf import settings
 
+from stretch import exceptions
+
+
+log = logging.getLogger('stretch')
 
 class memoized(object):
     """
@@ -45,6 +55,94 @@ class UrlLocation(object):
             raise KeyError('no addresses exist with tag "%s"' % tag)
 
 
+class Deadline(object):
+    """
+    The time by which an operation has to finish. A deadline without an
+    expiry never runs out.
+    """
+    def __init__(self, seconds=None, expires_at=None):
+        self.expires_at = expires_at
+        if seconds is not None:
+            self.expires_at = time.time() + seconds
+
+    def remaining(self):
+        """
+        Returns the number of seconds left, or `None` if the deadline has no
+        expiry.
+        """
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.time()
+
+    @property
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        """
+        Raises `DeadlineExceeded` if the deadline has run out.
+        """
+        if self.expired:
+            raise exceptions.DeadlineExceeded()
+
+    def timeout(self, default=None):
+        """
+        Returns the timeout to give a call: `default` capped by the remaining
+        budget. Raises `DeadlineExceeded` if no budget is left.
+
+        :Parameters:
+          - `default`: the call's own timeout, or `None` for no timeout.
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+
+_deadlines = threading.local()
+
+
+@contextmanager
+def deadline(seconds=None, expires_at=None):
+    """
+    Gives the body of the `with` statement `seconds` to finish. Agent, salt,
+    backend, and subprocess calls made in the body take their timeouts from
+    the remaining budget. A nested deadline can only shorten the budget.
+    Greenlets spawned in the body share it since they run in the same thread.
+
+    :Parameters:
+      - `seconds`: the budget, or `None` to keep the current one.
+      - `expires_at`: the time the budget runs out, for deadlines passed
+      between processes.
+    """
+    outer = get_deadline()
+    current = Deadline(seconds, expires_at)
+    if outer.expires_at is not None and (current.expires_at is None or
+                                         outer.expires_at < current.expires_at):
+        current = outer
+    _deadlines.current = current
+    try:
+        yield current
+    finally:
+        _deadlines.current = outer
+
+
+def get_deadline():
+    return getattr(_deadlines, 'current', None) or Deadline()
+
+
+def get_timeout(default=None):
+    """
+    Returns the timeout for a call made under the current deadline. See
+    `Deadline.timeout`.
+    """
+    return get_deadline().timeout(default)
+
+
 def get_class(class_path):
     parts = class_path.split('.')
     module, class_name = '.'.join(parts[:-1]), parts[-1]
@@ -60,11 +158,48 @@ def makedirs(path):
         else:
             raise
 
-"""
 def lock(name):
-    lock_dir = settings.LOCK_DIR
+    lock_dir = settings.STRETCH_LOCK_DIR
+    makedirs(lock_dir)
     return lockfile.FileLock(os.path.join(lock_dir, '%s.lock' % name))
-"""
+
+
+@contextmanager
+def heartbeat(func, interval):
+    """
+    Calls `func` every `interval` seconds from a background thread while the
+    body of the `with` statement runs, e.g. to renew a lease. Errors are
+    logged rather than raised, and the thread's database connection is
+    closed when the body finishes.
+
+    :Parameters:
+      - `func`: called without arguments on every beat.
+      - `interval`: the number of seconds between beats.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                try:
+                    func()
+                except Exception:
+                    log.exception('Heartbeat failed')
+        finally:
+            # Settings import this module, so django.db cannot be imported
+            # until it is used
+            from django.db import connection
+            connection.close()
+
+    thread = threading.Thread(target=beat)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
 
 def generate_random_hex(length=16):
     hexdigits = '0123456789abcdef'
@@ -110,9 +245,31 @@ def clear_path(path):
     makedirs(path)
 
 
+def communicate(process):
+    """
+    Waits for `process` to exit and returns its output. The process is killed
+    if it outlives the current deadline.
+    """
+    timeout = get_timeout()
+    if timeout is None:
+        return process.communicate()
+
+    result = []
+    thread = threading.Thread(target=lambda: result.extend(
+        process.communicate()))
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        process.kill()
+        thread.join()
+        raise exceptions.DeadlineExceeded()
+    return result
+
+
 def check_output(*args, **kwargs):
     process = subprocess.Popen(stdout=subprocess.PIPE, *args, **kwargs)
-    output, unused_err = process.communicate()
+    output, unused_err = communicate(process)
     retcode = process.poll()
     if retcode:
         cmd = kwargs.get("args")
@@ -136,6 +293,28 @@ def path_contains(path, file_path):
     return not os.path.relpath(file_path, path).startswith('..')
 
 
+def percentile(values, p):
+    """
+    Returns the `p`th percentile of `values` using the nearest-rank method, or
+    `None` if `values` is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(math.ceil(p / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def jittered_backoff(attempts, base=1.0, cap=30.0):
+    """
+    Yields `attempts` delays in seconds that grow exponentially from `base` up
+    to `cap`, each drawn uniformly from zero to that bound so that retries of
+    many hosts spread out instead of arriving together.
+    """
+    for attempt in xrange(attempts):
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+
+
 def group_by_attr(items, attr_name):
     group = {}
     for item in items:
@@ -147,49 +326,116 @@ def group_by_attr(items, attr_name):
     return group
 
 
-def map_groups(callback, groups, batch_size, on_finish=None, interval=1.0):
-    results = {}
-    pending = dict((key, {}) for key in groups.keys())
-
-    def has_items(group):
-        for _, items in group.iteritems():
-            if items:
-                return True
-        return False
+class Scheduler(object):
+    """
+    Runs jobs concurrently in groups, each group with its own concurrency
+    limit. A group's next job starts the moment one of its running jobs
+    finishes, and completion callbacks fire as soon as each job returns
+    instead of on a polling interval.
 
-    while has_items(groups) or has_items(pending):
-        # Queue jobs
-        for group, items in groups.iteritems():
-            while len(pending[group]) < batch_size and items:
-                item = items.pop()
-                pending[group][item] = callback(item)
+    Jobs run in greenlets, so they should spend their time in cooperative
+    (gevent-patched) IO.
+    """
+    def __init__(self, limit, on_finish=None):
+        """
+        :Parameters:
+          - `limit`: the maximum number of concurrent jobs in a group, or a
+            function that returns the limit for a given group. A limit of
+            `None` runs every job of the group at once.
+          - `on_finish`: optional callback, called with a job's key and its
+            result when the job finishes.
+        """
+        self.limit = limit
+        self.on_finish = on_finish
+        self.semaphores = {}
+        self.jobs = {}
+
+    def spawn(self, group, key, func, *args, **kwargs):
+        """
+        Schedules `func(*args, **kwargs)` in `group` and returns its greenlet,
+        which can be used as a future. Scheduling never blocks; the job waits
+        for a free slot in its group.
+
+        :Parameters:
+          - `group`: the group the job belongs to.
+          - `key`: a key identifying the job's result.
+          - `func`: the job.
+        """
+        semaphore = self.get_semaphore(group)
+
+        def run():
+            if semaphore is None:
+                result = func(*args, **kwargs)
+            else:
+                semaphore.acquire()
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    semaphore.release()
+            if self.on_finish:
+                self.on_finish(key, result)
+            return result
 
-        time.sleep(interval)
+        job = self.jobs[key] = gevent.spawn(run)
+        return job
+
+    def get_semaphore(self, group):
+        if group not in self.semaphores:
+            limit = self.limit
+            if callable(limit):
+                limit = limit(group)
+            if limit is None:
+                self.semaphores[group] = None
+            else:
+                self.semaphores[group] = coros.BoundedSemaphore(max(limit, 1))
+        return self.semaphores[group]
+
+    def join(self):
+        """
+        Blocks until every scheduled job finishes and returns a dictionary of
+        results by key. The first job error is raised, and `DeadlineExceeded`
+        is raised if the current deadline runs out first.
+        """
+        keys = self.jobs.keys()
+        try:
+            results = wait([self.jobs[key] for key in keys], get_timeout())
+        except gevent.Timeout:
+            raise exceptions.DeadlineExceeded()
+        return dict(zip(keys, results))
 
-        # Collect finished jobs and their results
-        for group, items in dict(pending).iteritems():
-            for item, is_finished in dict(items).iteritems():
-                result = is_finished()
-                if result != None:
-                    if on_finish:
-                        on_finish(item, result)
-                    results[item] = result
-                    pending[group].pop(item, None)
 
-    return results
+def map_groups(callback, groups, batch_size, on_finish=None):
+    """
+    Calls `callback` on every item of every group, running at most
+    `batch_size` items of a group at the same time. Returns a dictionary of
+    results by item.
+
+    :Parameters:
+      - `callback`: called with an item; returns the item's result.
+      - `groups`: a dictionary of item lists by group.
+      - `batch_size`: the concurrency limit (or function of the group).
+      - `on_finish`: optional callback, called with an item and its result.
+    """
+    scheduler = Scheduler(batch_size, on_finish)
+    for group, items in groups.iteritems():
+        for item in items:
+            scheduler.spawn(group, item, callback, item)
+    return scheduler.join()
 
 
-def wait(is_finished, interval=2.0):
-    while True:
-        result = is_finished()
-        if result != False:
-            return result
-        time.sleep(interval)
+def wait(jobs, timeout=None):
+    """
+    Blocks until every job (greenlet) finishes and returns their results in
+    order. Control returns as soon as the last job completes. The first job
+    error is raised, and `gevent.Timeout` is raised if `timeout` passes.
+    """
+    gevent.joinall(jobs, timeout=timeout, raise_error=True)
+    return [job.get(block=False) for job in jobs]
 
 
 def run_cmd(cmd, allow_errors=False):
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = p.communicate()
+    stdout, stderr = communicate(p)
     if p.returncode != 0 and not allow_errors:
         raise Exception(stderr)
     return stdout, p.returncode
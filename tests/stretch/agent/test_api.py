@@ -1,8 +1,10 @@
+import json
 from mock import Mock, patch
-from nose.tools import assert_in
+from nose.tools import eq_, assert_in, assert_raises
 
 from stretch import testutils
 from stretch.agent import api, objects
+from stretch.agent.app import TaskException
 
 
 class TestApi(testutils.AgentTestCase):
@@ -50,8 +52,51 @@ class TestApi(testutils.AgentTestCase):
         instance.delete.assert_called_with()
 
 
-    #@patch('stretch.agent.objects.Node')
-    def test_pull(self):
+    @patch('stretch.agent.api.Thread')
+    @patch('stretch.agent.objects.Node')
+    def test_batch(self, Node, Thread):
+        Node.exists.side_effect = lambda node_id: node_id == '1'
+
+        response = self.client.post('/v1/batch', data=json.dumps({
+            'nodes': ['1', '2'], 'pulls': [], 'instances': []
+        }), content_type='application/json')
+
+        eq_(response.status_code, 201)
+        Node.create.assert_called_once_with({'id': '2'})
+        eq_(Thread.call_args[1]['args'][0], api.run_batch)
+        Thread.return_value.start.assert_called_with()
+
+    @patch('stretch.agent.objects.Instance')
+    @patch('stretch.agent.objects.Node')
+    def test_run_batch(self, Node, Instance):
+        api.run_batch(None, {
+            'pulls': [{'node_id': '1', 'sha': 'sha'}],
+            'instances': [{'id': '3', 'node_id': '1'}]
+        })
+        Node.assert_called_with('1')
+        Node.return_value.pull.assert_called_with({'sha': 'sha'})
+        Instance.create.assert_called_with({'id': '3', 'node_id': '1'})
+
+        Instance.create.side_effect = ValueError('failed')
+        with assert_raises(TaskException):
+            api.run_batch(None, {'instances': [{'id': '3'}]})
+
+    @patch('stretch.agent.objects.Node.prefetch')
+    def test_prefetch(self, prefetch):
+        data = {'sha': 'sha', 'image': 'image', 'task': 'prefetch'}
+        eq_(self.client.post('/v1/nodes/1/tasks', data=data).status_code, 404)
+
+        # Hosts add the nodes they prefetch with a batch
+        with patch('stretch.agent.api.Thread'):
+            self.client.post('/v1/batch', data=json.dumps({'nodes': ['1']}),
+                             content_type='application/json')
+        r = self.client.post('/v1/nodes/1/tasks', data=data)
+
+        eq_(r.status_code, 201)
+        prefetch.assert_called_with({'sha': 'sha', 'image': 'image'})
+
+    @patch('stretch.agent.objects.Node.pull')
+    def test_pull(self, pull):
         objects.Node.create({'id': '1'})
         r = self.client.post('/v1/nodes/1/tasks', data={
             'sha': None,
@@ -62,10 +107,15 @@ class TestApi(testutils.AgentTestCase):
             'image': 'image',
             'task': 'pull'
         })
-        raise Exception(r.data)
-        #raise Exception(dir(self.create_app()))
-
-        #Node.pull.assert_called_with()
+        eq_(r.status_code, 201)
+        pull.assert_called_with({
+            'sha': None,
+            'app_path': '/path',
+            'ports': {'http': 80, 'https': 443},
+            'env_id': '2',
+            'env_name': 'env',
+            'image': 'image'
+        })
 
     '''
     def test_reload_instance(self):
@@ -1,7 +1,10 @@
+import json
 from mock import Mock, patch
-from nose.tools import assert_raises
+from nose.tools import eq_, assert_raises
 from unittest import TestCase
 
+from stretch import utils
+from stretch.exceptions import DeadlineExceeded
 from stretch.testutils import mock_attr, patch_settings
 from stretch.agent.client import AgentClient
 
@@ -17,6 +20,10 @@ class TestClient(TestCase):
         patcher.start()
         self.addCleanup(patcher.stop)
 
+        patcher = patch_settings('STRETCH_AGENT_TIMEOUT', 30)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         self.host = mock_attr(address='127.0.0.1')
         self.host.environment = mock_attr(name='env', pk=2)
         self.host.environment.app_paths = {'node': '/path'}
@@ -27,13 +34,28 @@ class TestClient(TestCase):
         self.client.add_node(node)
         self.requests.post.assert_called_with(
             'https://127.0.0.1:1337/v1/nodes', data={'id': '1'},
-            cert='/cert.pem')
+            cert='/cert.pem', timeout=30)
+
+    @patch('stretch.agent.client.resilience.call')
+    def test_post_not_retried(self, call):
+        call.return_value = {'id': '2'}
+        self.client.add_node(mock_attr(pk=1))
+        eq_(call.call_args[1]['attempts'], 1)
+
+        with patch('stretch.agent.client.AgentClient.wait_for_task'):
+            self.client.run_task('a/1', 'reload')
+            eq_(call.call_args[1]['attempts'], 1)
+            self.client.apply_batch()
+            eq_(call.call_args[1]['attempts'], 1)
+
+        self.client.remove_node(mock_attr(pk=1))
+        eq_(call.call_args[1]['attempts'], None)
 
     def test_remove_node(self):
         node = mock_attr(pk=1)
         self.client.remove_node(node)
         self.requests.delete.assert_called_with(
-            'https://127.0.0.1:1337/v1/nodes/1', cert='/cert.pem')
+            'https://127.0.0.1:1337/v1/nodes/1', cert='/cert.pem', timeout=30)
 
     @patch('stretch.agent.client.AgentClient.run_task')
     def test_pull_with_release(self, run_task):
@@ -46,7 +68,7 @@ class TestClient(TestCase):
         release = Mock()
         release.sha = 'sha'
 
-        self.client.pull(node, release)
+        self.client.pull_node(node, self.host.environment, release)
         run_task.assert_called_with('nodes/1', 'pull', {
             'sha': 'sha',
             'app_path': None,
@@ -66,7 +88,7 @@ class TestClient(TestCase):
             mock_attr(name='https', number=443)
         ]
 
-        self.client.pull(node)
+        self.client.pull_node(node, self.host.environment)
         run_task.assert_called_with('nodes/1', 'pull', {
             'sha': None,
             'app_path': '/path',
@@ -77,25 +99,69 @@ class TestClient(TestCase):
         })
         node.get_image.assert_called_with(local=True)
 
+    @patch('stretch.agent.client.AgentClient.wait_for_task')
+    def test_apply_batch(self, wait_for_task):
+        self.requests.post.return_value.json.return_value = {'id': '5'}
+        node = mock_attr(name='node', pk=1)
+        node.get_image.return_value = 'image'
+        node.ports.all.return_value = [mock_attr(name='http', number=80)]
+        release = mock_attr(sha='sha')
+        instance = mock_attr(pk=3, config_key='/key')
+        instance.node.pk = 1
+        instance.host.name = 'host_name'
+
+        self.client.apply_batch([node], [(node, self.host.environment,
+                                          release)], [instance])
+
+        url, = self.requests.post.call_args[0]
+        kwargs = self.requests.post.call_args[1]
+        self.assertEquals(url, 'https://127.0.0.1:1337/v1/batch')
+        self.assertEquals(json.loads(kwargs['data']), {
+            'nodes': ['1'],
+            'pulls': [{
+                'node_id': '1',
+                'sha': 'sha',
+                'app_path': None,
+                'ports': {'http': 80},
+                'env_id': '2',
+                'env_name': 'env',
+                'image': 'image'
+            }],
+            'instances': [{
+                'id': '3',
+                'node_id': '1',
+                'host_name': 'host_name',
+                'config_key': '/key'
+            }]
+        })
+        wait_for_task.assert_called_with('5')
+
+    def test_get_stats(self):
+        self.requests.get.return_value.json.return_value = {'cpu': 0.5}
+        self.assertEquals(self.client.get_stats(), {'cpu': 0.5})
+        self.requests.get.assert_called_with(
+            'https://127.0.0.1:1337/v1/stats', cert='/cert.pem', timeout=30)
+
     def test_add_instance(self):
         instance = mock_attr(pk=1)
         instance.node.pk = 2
         instance.host.name = 'host_name'
         instance.config_key = '/key'
-        self.client.add_instance(instance)
+        self.client.add_instance(instance, instance.host)
         self.requests.post.assert_called_with(
             'https://127.0.0.1:1337/v1/instances', data={
                 'node_id': '2',
                 'config_key': '/key',
                 'id': '1',
                 'host_name': 'host_name'
-            }, cert='/cert.pem')
+            }, cert='/cert.pem', timeout=30)
 
     def test_remove_instance(self):
         instance = mock_attr(pk=1)
         self.client.remove_instance(instance)
         self.requests.delete.assert_called_with(
-            'https://127.0.0.1:1337/v1/instances/1', cert='/cert.pem')
+            'https://127.0.0.1:1337/v1/instances/1', cert='/cert.pem',
+            timeout=30)
 
     @patch('stretch.agent.client.AgentClient.run_task')
     def test_reload_instance(self, run_task):
@@ -127,7 +193,8 @@ class TestClient(TestCase):
         self.requests.post.assert_called_with(
             'https://127.0.0.1:1337/v1/a/1/tasks',
             data={'k': 'v', 'task': 'reload'},
-            cert='/cert.pem'
+            cert='/cert.pem',
+            timeout=30
         )
         task_running.assert_called_with('https://127.0.0.1:1337/v1/tasks/2')
 
@@ -137,7 +204,7 @@ class TestClient(TestCase):
         self.requests.get.return_value = response
         result = self.client.task_running('https://s/v1/tasks/2')
         self.requests.get.assert_called_with('https://s/v1/tasks/2',
-                                             cert='/cert.pem')
+                                             cert='/cert.pem', timeout=30)
         self.assertEquals(result, False)
 
         response = Mock()
@@ -151,3 +218,15 @@ class TestClient(TestCase):
         self.requests.get.return_value = response
         with assert_raises(Exception):
             self.client.task_running('https://s/v1/tasks/2')
+
+    @patch('gevent.sleep')
+    @patch('stretch.agent.client.AgentClient.task_running', return_value=True)
+    def test_run_task_deadline(self, task_running, sleep):
+        response = Mock()
+        response.json.return_value = {'id': '2'}
+        self.requests.post.return_value = response
+
+        with utils.deadline(60) as deadline:
+            deadline.expires_at = 0
+            with assert_raises(DeadlineExceeded):
+                self.client.run_task('a/1', 'reload')
@@ -11,11 +11,61 @@ def patch_func(func):
                  % func, Mock(return_value=None))
 
 
+class TestImagePuller(TestCase):
+    def setUp(self):
+        self.puller = objects.ImagePuller()
+
+    @patch('stretch.utils.run_cmd')
+    def test_pull(self, run_cmd):
+        self.puller.pull('image')
+        run_cmd.assert_called_with(['docker', 'pull', 'image'])
+        self.assertEquals(self.puller.pulling, {})
+        self.assertEquals(self.puller.deploy_pulls, 0)
+
+    @patch('stretch.utils.run_cmd')
+    def test_should_deduplicate_concurrent_pulls(self, run_cmd):
+        event = Mock()
+        self.puller.pulling['image'] = event
+        self.puller.pull('image')
+        event.wait.assert_called_with()
+        assert not run_cmd.called
+
+    @patch('stretch.utils.run_cmd')
+    def test_prefetch(self, run_cmd):
+        self.puller.pull('image', prefetch=True)
+        run_cmd.assert_called_with(['docker', 'pull', 'image'])
+        self.assertEquals(self.puller.prefetching, False)
+
+
 class TestTask(TestCase):
     def setUp(self):
         self.task = objects.Task()
 
 
+@patch('stretch.utils.run_cmd')
+def test_get_images(run_cmd):
+    run_cmd.return_value = ('\n'.join([
+        'REPOSITORY          TAG      IMAGE ID       CREATED       '
+        'VIRTUAL SIZE',
+        'reg/sys1/web        sha      8dbd9e392a96   2 days ago    '
+        '131.5 MB',
+        '<none>              <none>   1dcb94d56e0f   3 days ago    '
+        '120 MB'
+    ]), 0)
+    assert objects.get_images() == [{
+        'image': 'reg/sys1/web:sha',
+        'id': '8dbd9e392a96',
+        'size': 131500000
+    }]
+
+
+@patch('stretch.agent.objects.get_memory_usage', return_value=0.25)
+@patch('multiprocessing.cpu_count', return_value=4)
+@patch('os.getloadavg', return_value=(2.0, 1.0, 0.5))
+def test_get_stats(getloadavg, cpu_count, get_memory_usage):
+    assert objects.get_stats() == {'cpu': 0.5, 'memory': 0.25}
+
+
 class ObjectTestCase(TestCase):
     def apply_patch(self, patch):
         obj = patch.start()
@@ -160,12 +210,52 @@ class TestNode(ObjectTestCase):
         self.apply_patch(patch_func('__init__'))
         self.node = objects.Node('1')
 
-    def test_pull(self):
-        pass
+    @patch('stretch.agent.objects.utils.clear_path')
+    @patch('stretch.agent.objects.caller_client')
+    @patch('stretch.agent.objects.image_puller')
+    @patch('stretch.utils.run_cmd', return_value=('', 1))
+    def test_pull(self, run_cmd, image_puller, caller_client, clear_path):
+        self.node.data = {'_id': '1'}
+        self.node.update = Mock()
+        self.node.retain_image = Mock()
+        args = {'app_path': None, 'image': 'reg/sys1/node', 'sha': 'sha',
+                'env_id': '2'}
+
+        self.node.pull(args)
+
+        image_puller.pull.assert_called_with('reg/sys1/node:sha')
+        self.node.retain_image.assert_called_with('reg/sys1/node:sha')
+        caller_client.return_value.function.assert_called_with('cp.get_dir',
+            'salt://templates/2/1', self.node.get_templates_path())
+        self.node.update.assert_called_with(args)
 
     def test_get_templates_path(self):
         pass
 
+    @patch('stretch.utils.run_cmd', return_value=('', 1))
+    def test_prefetch(self, run_cmd):
+        self.node.prefetch({'sha': 'sha', 'image': 'reg/sys1/node'})
+        run_cmd.assert_called_with(['docker', 'pull', 'reg/sys1/node:sha'])
+        self.assertEquals(objects.image_puller.pulling, {})
+
+    @patch('stretch.agent.objects.image_puller')
+    @patch('stretch.utils.run_cmd', return_value=('', 0))
+    def test_should_reuse_local_image(self, run_cmd, image_puller):
+        self.node.prefetch({'sha': 'sha', 'image': 'reg/sys1/node'})
+        run_cmd.assert_called_with(['docker', 'inspect', 'reg/sys1/node:sha'],
+                                   allow_errors=True)
+        assert not image_puller.pull.called
+
+    @patch('stretch.agent.objects.image_history', 2)
+    @patch('stretch.utils.run_cmd')
+    def test_retain_image(self, run_cmd):
+        self.node.data = {'images': ['node:b', 'node:a']}
+        self.node.update = Mock()
+        self.node.retain_image('node:c')
+        run_cmd.assert_called_with(['docker', 'rmi', 'node:a'],
+                                   allow_errors=True)
+        self.node.update.assert_called_with({'images': ['node:c', 'node:b']})
+
     def test_pulled(self):
         with patch.dict(self.node.data, {'sha': 'sha', 'app_path': 'path'}):
             self.assertEquals(self.node.pulled, True)
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+from mock import patch
+from nose.tools import eq_
+from unittest import TestCase
+
+from stretch.models import Deploy, StageTiming
+
+
+class TestDeploy(TestCase):
+    def setUp(self):
+        self.deploy = Deploy()
+        self.start = datetime(2014, 1, 1)
+
+    def timing(self, stage, start, end, host=None, instance=None):
+        return StageTiming(stage=stage, host=host, instance=instance,
+            started_at=self.start + timedelta(seconds=start),
+            finished_at=self.start + timedelta(seconds=end))
+
+    @patch('stretch.models.Deploy.timings')
+    def test_get_critical_path(self, timings):
+        timings.exclude.return_value.order_by.return_value = [
+            self.timing('pre_deploy', 0, 2),
+            self.timing('mount_templates', 2, 3),
+            self.timing('pull', 3, 10, host='host1'),
+            self.timing('pull', 3, 5, host='host2'),
+            self.timing('restart', 5, 9, host='host2', instance='a'),
+            self.timing('restart', 10, 12, host='host1', instance='b'),
+            self.timing('restart', 12, 15, host='host1', instance='c'),
+            self.timing('post_deploy', 15, 16)
+        ]
+
+        path = self.deploy.get_critical_path()
+
+        eq_([(s['stage'], s['host'], s['instance'], s['seconds'])
+             for s in path], [
+            ('pre_deploy', None, None, 2.0),
+            ('mount_templates', None, None, 1.0),
+            ('pull', 'host1', None, 7.0),
+            ('queued', 'host1', 'c', 2.0),
+            ('restart', 'host1', 'c', 3.0),
+            ('post_deploy', None, None, 1.0)
+        ])
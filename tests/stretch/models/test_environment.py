@@ -1,8 +1,9 @@
-from mock import patch, Mock, MagicMock, DEFAULT, call
+import gevent
+from mock import patch, Mock, MagicMock, DEFAULT, ANY, call
 from nose.tools import eq_, assert_raises, raises
 from unittest import TestCase
 
-from stretch import models, testutils
+from stretch import models, tasks, testutils
 
 
 class TestEnvironment(TestCase):
@@ -10,7 +11,7 @@ class TestEnvironment(TestCase):
         self.system = models.System()
         self.env = models.Environment(name='env', system=self.system)
 
-    @patch('stretch.backends.get_backend')
+    @patch('stretch.backend.get_backend')
     def test_backend(self, get_backend):
         get_backend.return_value = 'foo'
         eq_(self.env.backend, 'foo')
@@ -26,7 +27,8 @@ class TestEnvironment(TestCase):
             environment=self.env,
             existing_release=current_release,
             release=release,
-            task_id=task.request.id
+            task_id=task.request.id,
+            nodes=None
         )
         deploy.save.assert_called_with()
 
@@ -77,12 +79,75 @@ class TestEnvironment(TestCase):
         current_release.get_snapshot.return_value = snapshot
         self.env.deploy(release)
 
-        _save_deploy.assert_called_with('task', release)
+        _save_deploy.assert_called_with('task', release, None)
         _deploy_obj.assert_called_with(release, deploy)
         eq_(deploy.existing_snapshot, snapshot)
         eq_(self.env.current_release, release)
         eq_(self.env.using_source, False)
 
+    @patch('stretch.models.current_task', 'task')
+    @patch.multiple('stretch.models.Environment', _save_deploy=DEFAULT,
+                    _deploy_obj=DEFAULT, current_release=DEFAULT)
+    def test_deploy_release_to_nodes(self, _save_deploy, _deploy_obj,
+                                     current_release):
+        release = Mock(spec=['sha', 'pk'])
+        release.pk = 3
+        deploy = Mock()
+        _save_deploy.return_value = deploy
+
+        self.env.deploy(release, ['web'])
+
+        _save_deploy.assert_called_with('task', release, ['web'])
+        _deploy_obj.assert_called_with(release, deploy)
+        eq_(self.env.current_release, current_release)
+        eq_(self.env.node_releases, {'web': 3})
+
+    @patch('stretch.models.current_task', 'task')
+    @patch('stretch.models.utils')
+    @patch.multiple('stretch.models.Environment', _save_deploy=DEFAULT,
+                    _deploy_to_instances=DEFAULT, save=DEFAULT,
+                    current_release=DEFAULT)
+    def test_rollback(self, utils, _save_deploy, _deploy_to_instances, save,
+                      current_release):
+        release = Mock()
+        release.manifest = {'nodes': ['web'], 'migrations': {}}
+        deploy = MagicMock()
+        _save_deploy.return_value = deploy
+        self.env.node_releases = {'web': 3}
+
+        self.env.rollback(release)
+
+        _save_deploy.assert_called_with('task', release)
+        deploy.mount_release_templates.assert_called_with(release)
+        _deploy_to_instances.assert_called_with(release, deploy=deploy)
+        current_release.rollback_migrations.assert_called_with(deploy,
+                                                               release)
+        assert not release.get_snapshot.called
+        eq_(self.env.current_release, release)
+        eq_(self.env.node_releases, {})
+        save.assert_called_with()
+
+    @patch('stretch.models.Environment.deploy')
+    def test_rollback_without_manifest(self, deploy):
+        release = Mock()
+        release.manifest = {}
+        self.env.rollback(release, timeout=10)
+        deploy.assert_called_with(release, timeout=10)
+
+    @raises(ValueError)
+    def test_deploy_source_to_nodes_fails(self):
+        self.env.deploy(Mock(spec=['pull']), ['web'])
+
+    @patch('stretch.models.Release.objects')
+    def test_get_node_release(self, objects):
+        node = testutils.mock_attr(name='web')
+        self.env.node_releases = {'web': 3}
+        eq_(self.env.get_node_release(node), objects.get.return_value)
+        objects.get.assert_called_with(pk=3)
+
+        self.env.node_releases = {}
+        eq_(self.env.get_node_release(node), None)
+
     @raises(Exception)
     def test_deploy_incompatible_object_fails(self):
         obj = Mock(spec=[])
@@ -98,7 +163,7 @@ class TestEnvironment(TestCase):
         deploy = MagicMock()
         self.env.using_source = True
         self.env._deploy_obj(source, deploy)
-        _deploy_to_instances.assert_called_with()
+        _deploy_to_instances.assert_called_with(deploy=deploy)
         save.assert_called_with()
         eq_(self.env.app_paths, ['a'])
         snapshot.build_and_push.assert_called_with(None, self.system)
@@ -108,12 +173,111 @@ class TestEnvironment(TestCase):
     def test_deploy_obj_release(self, save, _deploy_to_instances):
         release = Mock()
         deploy = MagicMock()
+        deploy.nodes = None
         self.env.using_source = False
         release.sha = 'sha'
         self.env._deploy_obj(release, deploy)
-        _deploy_to_instances.assert_called_with(release)
+        _deploy_to_instances.assert_called_with(release, None, deploy)
         save.assert_called_with()
 
+    @patch.multiple('stretch.models.Environment', _get_host_batches=DEFAULT,
+                    _fan_out=DEFAULT, save=DEFAULT)
+    def test_deploy_obj_fan_out(self, _get_host_batches, _fan_out, save):
+        release = Mock()
+        deploy = MagicMock()
+        batches = _get_host_batches.return_value = [([1], 1), ([2], 1)]
+        self.env.using_source = False
+
+        self.env._deploy_obj(release, deploy)
+
+        deploy.begin.assert_called_with(release.get_snapshot.return_value)
+        _fan_out.assert_called_with(deploy, batches)
+        assert not deploy.finish.called
+        assert not save.called
+
+    @testutils.patch_settings('STRETCH_DEPLOY_BATCH_HOSTS', 2)
+    @patch('stretch.models.Environment.hosts', Mock())
+    def test_get_host_batches(self):
+        group = testutils.mock_attr(batch_size=4)
+        hosts = [testutils.mock_attr(pk=i, group=group) for i in xrange(5)]
+        hosts.append(testutils.mock_attr(pk=5, group=None))
+        self.env.hosts.filter.return_value = hosts
+
+        batches = self.env._get_host_batches()
+
+        assert testutils.check_items_equal(batches, [
+            ([0, 1], 1), ([2, 3], 1), ([4], 1), ([5], None)
+        ])
+
+    @testutils.patch_settings('STRETCH_DEPLOY_BATCH_HOSTS', 0)
+    def test_get_host_batches_disabled(self):
+        eq_(self.env._get_host_batches(), [])
+
+    @patch('stretch.models.Environment.objects')
+    def test_fan_out(self, objects):
+        # The chord is not mocked, so its subtasks run eagerly from their
+        # signatures
+        env = objects.get.return_value
+        env._deploy_to_hosts.return_value = None
+        context = {'deploy_id': 2}
+        self.env.pk = 1
+
+        self.env._fan_out(Mock(context=context), [([1, 2], 2), ([3], None)])
+
+        objects.get.assert_called_with(pk=1)
+        eq_(env._deploy_to_hosts.call_args_list,
+            [call(context, [1, 2], 2), call(context, [3], None)])
+        env._finish_deploy.assert_called_with(context)
+
+    @patch('stretch.models.Deploy.load')
+    @patch.multiple('stretch.models.Environment', _deploy_to_hosts=DEFAULT,
+                    save=DEFAULT, objects=DEFAULT)
+    def test_fan_out_sets_release(self, load, _deploy_to_hosts, save,
+                                  objects):
+        # The callback runs on an environment loaded from the database,
+        # which is still on the previous release
+        release = models.Release(name='release', sha='sha')
+        env = models.Environment(name='env', system=self.system)
+        env.node_releases = {'node': 3}
+        objects.get.return_value = env
+        _deploy_to_hosts.return_value = None
+        load.return_value = Mock(release=release, nodes=None)
+        self.env.pk = 1
+
+        self.env._fan_out(Mock(context={'deploy_id': 2}), [([1], 1),
+                                                            ([2], 1)])
+
+        load.return_value.finish.assert_called_with()
+        eq_(env.current_release, release)
+        eq_(env.node_releases, {})
+        assert not env.using_source
+        save.assert_called_with()
+
+    @patch('stretch.models.Deploy.objects')
+    @patch.multiple('stretch.models.Environment', _deploy_to_hosts=DEFAULT,
+                    _finish_deploy=DEFAULT, objects=DEFAULT)
+    def test_fan_out_batch_error(self, deploys, _deploy_to_hosts,
+                                 _finish_deploy, objects):
+        objects.get.return_value = self.env
+        _deploy_to_hosts.side_effect = [None, Exception('batch failed')]
+        self.env.pk = 1
+
+        with assert_raises(Exception):
+            self.env._fan_out(Mock(context={'deploy_id': 2}), [([1], 1),
+                                                                ([2], 1)])
+
+        deploys.get.assert_called_with(pk=2)
+        deploys.get.return_value.fail.assert_called_once_with()
+        assert not _finish_deploy.called
+
+    def test_set_release_nodes(self):
+        release = models.Release(pk=2, name='release', sha='sha')
+        self.env.node_releases = {'a': 1}
+        self.env.using_source = True
+        self.env._set_release(release, ['b'])
+        eq_(self.env.node_releases, {'a': 1, 'b': 2})
+        assert not self.env.using_source
+
     def test_post_save_created(self):
         env = Mock()
         config_manager = env.system.config_manager
@@ -127,34 +291,128 @@ class TestEnvironment(TestCase):
         self.env.post_save(Mock(), env, False)
         config_manager.sync_env_config.assert_called_with(env)
 
+    @patch('stretch.models.Lock.hold', Mock(return_value=MagicMock()))
+    @patch('stretch.models.Environment.hosts', Mock())
+    @patch('stretch.models.Host.prepare')
+    def test_fill_warm_pool(self, prepare):
+        self.env.warm_pool_size = 3
+        self.env.hosts.filter.return_value.count.return_value = 1
+
+        self.env.fill_warm_pool()
+
+        self.env.hosts.filter.assert_called_with(warm=True)
+        eq_(prepare.call_args_list, [call(self.env, warm=True)] * 2)
+        eq_(prepare.return_value._provision.delay.call_count, 2)
+
+    def test_post_save_warm_pool(self):
+        env = Mock(warm_pool_size=0)
+        self.env.post_init(Mock(), env)
+        self.env.post_save(Mock(), env, False)
+        assert not env.fill_warm_pool.delay.called
+        env.warm_pool_size = 2
+        self.env.post_save(Mock(), env, False)
+        env.fill_warm_pool.delay.assert_called_once_with()
+        # Saves that leave the size alone do not refill the pool
+        self.env.post_save(Mock(), env, False)
+        eq_(env.fill_warm_pool.delay.call_count, 1)
+
+    def test_post_save_warm_pool_created(self):
+        env = Mock(warm_pool_size=2)
+        self.env.post_init(Mock(), env)
+        self.env.post_save(Mock(), env, True)
+        env.fill_warm_pool.delay.assert_called_with()
+
+    @testutils.patch_settings('STRETCH_PREFETCH_BATCH_SIZE', 2)
+    @patch('stretch.models.Environment.hosts', Mock())
+    def test_prefetch(self):
+        node = Mock()
+        hosts = [testutils.mock_attr(nodes=[node]) for _ in xrange(3)]
+        self.env.hosts.filter.return_value = hosts
+        release = Mock()
+
+        self.env.prefetch(release)
+
+        for host in hosts:
+            host.agent.prefetch_node.assert_called_with(node, release)
+
+    @testutils.patch_settings('STRETCH_PREFETCH_BATCH_SIZE', 2)
+    @patch('stretch.models.Environment.hosts', Mock())
+    def test_prefetch_fails(self):
+        hosts = [testutils.mock_attr(nodes=[Mock()]) for _ in xrange(3)]
+        hosts[1].agent.prefetch_node.side_effect = ValueError()
+        self.env.hosts.filter.return_value = hosts
+
+        with assert_raises(ValueError):
+            self.env.prefetch(Mock())
+
+    @patch('stretch.models.Environment.backend')
+    @patch('stretch.models.Environment.hosts', Mock())
+    @patch('stretch.models.Host.sync_many')
+    def test_sync_hosts(self, sync_many, backend):
+        hosts = [Mock(), Mock()]
+        self.env.hosts.filter.return_value = hosts
+
+        self.env.sync_hosts()
+        sync_many.assert_called_with(hosts)
+
+        sync_many.reset_mock()
+        backend.uses_salt = False
+        self.env.sync_hosts()
+        assert not sync_many.called
+
+    def mock_deploy_hosts(self, groups):
+        state = {'running': 0, 'max': 0}
+
+        def restart(deploy):
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+            gevent.sleep(0)
+            state['running'] -= 1
+
+        def mock_host(group):
+            host = testutils.mock_attr(group=group)
+            host.instances = [Mock(), Mock()]
+            for instance in host.instances:
+                instance.restart.side_effect = restart
+
+            def pull_nodes(restarts, release, nodes, deploy):
+                for instance in host.instances:
+                    restarts.spawn(host.group, instance.pk, instance.restart,
+                                   deploy)
+            host.pull_nodes.side_effect = pull_nodes
+            return host
+
+        hosts = [mock_host(group) for group in groups]
+        self.env.hosts.filter.return_value = hosts
+        return hosts, state
+
     @testutils.patch_settings('STRETCH_BATCH_SIZE', 5)
-    @patch('stretch.models.Environment.groups', Mock())
     @patch('stretch.models.Environment.hosts', Mock())
-    @patch('stretch.models.pool')
-    def test_deploy_to_instances(self, pool):
-        no_group_pool = Mock()
-        pools = [Mock(), Mock(), Mock()]
-        groups = [
-            testutils.mock_attr(batch_size=10),
-            testutils.mock_attr(batch_size=50)
-        ]
-        hosts = [
-            testutils.mock_attr(group=groups[0]),
-            testutils.mock_attr(group=groups[1]),
-            testutils.mock_attr(group=None)
-        ]
-        pool.Pool.side_effect = pools
-        pool.Group.return_value = no_group_pool
-        self.env.groups.all.return_value = groups
-        self.env.hosts.all.return_value = hosts
+    def test_deploy_to_instances(self):
+        group = testutils.mock_attr(batch_size=1)
+        hosts, state = self.mock_deploy_hosts([group, group])
+
+        self.env._deploy_to_instances('sha')
 
+        for host in hosts:
+            host.pull_nodes.assert_called_with(ANY, 'sha', None, None)
+            for instance in host.instances:
+                instance.restart.assert_called_with(None)
+        # The group's batch size limits its restarts
+        eq_(state['max'], 1)
+
+    @testutils.patch_settings('STRETCH_BATCH_SIZE', 5)
+    @patch('stretch.models.Environment.hosts', Mock())
+    def test_deploy_to_instances_without_group(self):
+        hosts, state = self.mock_deploy_hosts([None, None])
         self.env._deploy_to_instances('sha')
+        eq_(state['max'], 4)
 
-        pools[2].spawn.assert_has_calls([
-            call(hosts[0].pull_nodes, pools[0], 'sha'),
-            call(hosts[1].pull_nodes, pools[1], 'sha'),
-            call(hosts[2].pull_nodes, no_group_pool, 'sha')
-        ], any_order=True)
+    @testutils.patch_settings('STRETCH_BATCH_SIZE', 5)
+    @patch('stretch.models.Environment.hosts', Mock())
+    def test_deploy_to_instances_fails(self):
+        hosts, state = self.mock_deploy_hosts([None, None])
+        hosts[1].instances[0].restart.side_effect = ValueError()
 
-        for p in pool:
-            p.join.assert_called_with()
+        with assert_raises(ValueError):
+            self.env._deploy_to_instances('sha')
@@ -1,8 +1,9 @@
-from mock import Mock, patch
+from mock import Mock, patch, ANY
+from nose.tools import eq_, assert_raises
 from unittest import TestCase
 
 from stretch.testutils import patch_settings
-from stretch.models import Group
+from stretch.models import Group, ScalingOperation
 
 
 class TestGroup(TestCase):
@@ -117,3 +118,177 @@ class TestGroup(TestCase):
         config = self.lb.group.environment.system.config_manager
         config.delete.assert_called_with(self.lb.config_key)
         self.lb.backend.delete_lb.assert_called_with(self.lb)"""
+
+
+class TestGroupScaling(TestCase):
+    def setUp(self):
+        self.group = Group(name='group', minimum_nodes=1, maximum_nodes=10)
+        self.group.pk = 1
+
+        for attr in ('hosts', 'environment', '_create_host', '_delete_host',
+                     '_add_warm_host', '_finish_scaling'):
+            patcher = patch('stretch.models.Group.%s' % attr)
+            setattr(self, attr, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        self.hosts.count.return_value = 2
+        self.operation = Mock(pk=5)
+        patcher = patch('stretch.models.ScalingOperation.objects')
+        self.operations = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.operations.create.return_value = self.operation
+
+        patcher = patch('stretch.models.Host.claim_warm', return_value=[])
+        self.claim_warm = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('stretch.models.chord')
+    def test_scale_up(self, chord):
+        eq_(self.group.scale_up(3, timeout=60), self.operation)
+
+        self.operations.create.assert_called_with(group=self.group,
+                                                  action='up', amount=3)
+        subtasks = chord.call_args[0][0]
+        eq_([s.task for s in subtasks], ['stretch.tasks.create_host'] * 3)
+        eq_(subtasks[0].args[0], 1)
+        callback = chord.return_value.call_args[0][0]
+        eq_(callback.task, 'stretch.tasks.finish_scaling')
+        eq_(tuple(callback.args), (1, 5))
+        eq_(self.operation.task_id, chord.return_value.return_value.id)
+        self.operation.save.assert_called_with()
+        assert not chord.return_value.return_value.get.called
+        assert not self.environment.fill_warm_pool.delay.called
+
+    @patch('stretch.models.chord')
+    def test_scale_up_warm_hosts(self, chord):
+        self.claim_warm.return_value = [Mock(pk=7)]
+
+        self.group.scale_up(3)
+
+        self.claim_warm.assert_called_with(self.group, 3)
+        subtasks = chord.call_args[0][0]
+        eq_([s.task for s in subtasks], ['stretch.tasks.add_warm_host',
+            'stretch.tasks.create_host', 'stretch.tasks.create_host'])
+        eq_(tuple(subtasks[0].args), (1, 7, None))
+        self.environment.fill_warm_pool.delay.assert_called_with()
+
+    @patch('stretch.models.chord')
+    @patch('stretch.models.Group.get_least_loaded_hosts')
+    def test_scale_down(self, get_least_loaded_hosts, chord):
+        hosts = [Mock(pk=1), Mock(pk=2)]
+        get_least_loaded_hosts.return_value = hosts
+        self.hosts.count.return_value = 4
+
+        eq_(self.group.scale_down(2), self.operation)
+        get_least_loaded_hosts.assert_called_with(2)
+        self.operations.create.assert_called_with(group=self.group,
+                                                  action='down', amount=2)
+        subtasks = chord.call_args[0][0]
+        eq_([s.task for s in subtasks], ['stretch.tasks.delete_host'] * 2)
+        eq_([s.args[:2] for s in subtasks], [(1, 1), (1, 2)])
+
+    def test_scale_up_runs_chord(self):
+        # Runs the chord eagerly, through the tasks that look up the group
+        self._create_host.return_value = {'host': 'a', 'error': None}
+
+        with patch('stretch.models.Group.objects') as objects:
+            objects.get.return_value = self.group
+            self.group.scale_up(2, timeout=60)
+
+        objects.get.assert_called_with(pk=1)
+        eq_(self._create_host.call_count, 2)
+        self._create_host.assert_called_with(ANY)
+        self._finish_scaling.assert_called_with(
+            [{'host': 'a', 'error': None}] * 2, 5)
+        assert self.operation.task_id
+
+    def filter_hosts(self, hosts):
+        self.hosts.filter.side_effect = lambda **kwargs: [
+            host for host in hosts
+            if all(getattr(host, k) == v for k, v in kwargs.items())]
+
+    @patch('stretch.models.Group.load_balancer')
+    def test_get_least_loaded_hosts(self, load_balancer):
+        hosts = [Mock(pk=i, address='10.0.0.%s' % i, provisioning_stage=None,
+                      warm=False) for i in xrange(1, 5)]
+        self.filter_hosts(hosts)
+        load_balancer.get_connections.return_value = {
+            '10.0.0.1': 20, '10.0.0.2': 0, '10.0.0.3': 0, '10.0.0.4': 5}
+        hosts[1].agent.get_stats.return_value = {'cpu': 0.9}
+        hosts[2].agent.get_stats.return_value = {'cpu': 0.1}
+        hosts[3].agent.get_stats.side_effect = Exception()
+
+        eq_(self.group.get_least_loaded_hosts(3),
+            [hosts[2], hosts[1], hosts[3]])
+
+    @patch('stretch.models.Group.load_balancer')
+    def test_get_least_loaded_hosts_provisioning(self, load_balancer):
+        # A host still being provisioned has no connections yet
+        active = Mock(pk=1, address='10.0.0.1', provisioning_stage=None,
+                      warm=False)
+        provisioning = Mock(pk=2, address=None, provisioning_stage='sync',
+                            warm=False)
+        self.filter_hosts([active, provisioning])
+        load_balancer.get_connections.return_value = {'10.0.0.1': 20}
+
+        eq_(self.group.get_least_loaded_hosts(1), [active])
+        assert not provisioning.agent.get_stats.called
+
+    @patch('stretch.models.AutoscalingDecision.save')
+    @patch('stretch.models.Group.scale_to')
+    @patch('stretch.models.Group.get_host_loads')
+    def test_autoscale(self, get_host_loads, scale_to, save):
+        self.group.autoscaling = {'metric': 'cpu', 'target': 0.5}
+        self.hosts.count.return_value = 2
+        self.hosts.filter.return_value = [Mock(pk=1), Mock(pk=2)]
+        get_host_loads.return_value = (None, {1: {'cpu': 1.0},
+                                              2: {'cpu': 0.5}})
+        scale_to.return_value = ScalingOperation(action='up', amount=1)
+
+        with patch('stretch.models.Group.scaling_operations') as operations:
+            operations.filter.return_value.exists.return_value = False
+            operations.order_by.return_value.__getitem__.return_value = []
+            decision = self.group.autoscale()
+
+        eq_(decision.current, 2)
+        eq_(decision.desired, 3)
+        eq_(decision.metrics['cpu'], 0.75)
+        eq_(decision.operation, scale_to.return_value)
+        scale_to.assert_called_with(3)
+        save.assert_called_with()
+
+    def test_autoscale_disabled(self):
+        eq_(self.group.autoscale(), None)
+
+    def test_scale_invalid_amount(self):
+        with assert_raises(ValueError):
+            self.group.scale_up(9)
+        with assert_raises(ValueError):
+            self.group.scale_down(2)
+        assert not self.operations.create.called
+
+    def test_scale_to(self):
+        with patch('stretch.models.Group.scale_up') as scale_up:
+            eq_(self.group.scale_to(5), scale_up.return_value)
+            scale_up.assert_called_with(3, None)
+        eq_(self.group.scale_to(2), None)
+
+
+class TestScalingOperation(TestCase):
+    @patch('stretch.models.ScalingOperation.save')
+    def test_finish(self, save):
+        operation = ScalingOperation(action='up', amount=2)
+        results = [{'host': 'a', 'error': None},
+                   {'host': 'b', 'error': None}]
+        operation.finish(results)
+        eq_(operation.status, ScalingOperation.FINISHED)
+        eq_(operation.results, results)
+        assert operation.finished_at
+        save.assert_called_with()
+
+    @patch('stretch.models.ScalingOperation.save')
+    def test_finish_failed(self, save):
+        operation = ScalingOperation(action='up', amount=2)
+        operation.finish([{'host': 'a', 'error': None},
+                          {'host': None, 'error': 'timed out'}])
+        eq_(operation.status, ScalingOperation.FAILED)
@@ -1,6 +1,8 @@
-from mock import Mock, patch
+from mock import Mock, MagicMock, patch, call
+from nose.tools import eq_, assert_raises
 from unittest import TestCase
 
+from stretch import testutils
 from stretch.models import Host
 
 
@@ -118,3 +120,259 @@ class TestHost(TestCase):
         config = self.lb.group.environment.system.config_manager
         config.delete.assert_called_with(self.lb.config_key)
         self.lb.backend.delete_lb.assert_called_with(self.lb)"""
+
+
+class TestHostAgent(TestCase):
+    @testutils.patch_settings('STRETCH_AGENT_CLIENT',
+                              'stretch.agent.client.AgentClient')
+    @testutils.patch_settings('STRETCH_AGENT_PORT', 24225)
+    def test_agent(self):
+        host = Host(name='host', address='10.0.0.1')
+        eq_(host.agent.host, host)
+        eq_(host.agent.base_url, 'https://10.0.0.1:24225')
+
+
+class TestHostProvisioning(TestCase):
+    def setUp(self):
+        for attr in ('environment', 'group', 'save', 'delete', '_accept_key',
+                     'sync', 'create_instance'):
+            patcher = patch('stretch.models.Host.%s' % attr)
+            setattr(self, attr, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        patcher = patch('stretch.models.Host.objects')
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.objects.filter.return_value.count.return_value = 0
+
+        patcher = patch('stretch.models.Lock.hold', return_value=MagicMock())
+        self.hold = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('stretch.models.MinionEvents')
+        self.events = patcher.start().return_value.__enter__.return_value
+        self.addCleanup(patcher.stop)
+
+        self.env = Mock()
+        self.env.system.domain_name = 'example.com'
+        self.env.backend.create_host.return_value = '10.0.0.1'
+        self.group = Mock()
+
+    @patch('stretch.models.Host.provisioning')
+    def test_create(self, provisioning):
+        provisioning.return_value = MagicMock()
+
+        host = Host.create(self.env, self.group)
+
+        eq_(host.address, '10.0.0.1')
+        eq_(host.provisioning_stage, None)
+        eq_([c[0][0] for c in provisioning.call_args_list],
+            ['create', 'accept_key', 'sync', 'instance'])
+        self._accept_key.assert_called_with(self.events)
+        self.sync.assert_called_with(self.events)
+        self.create_instance.assert_called_with(self.group.node)
+        assert not self.delete.called
+
+    @patch('stretch.models.Host.prefetch_nodes')
+    @patch('stretch.models.Host.provisioning')
+    def test_create_warm(self, provisioning, prefetch_nodes):
+        provisioning.return_value = MagicMock()
+
+        host = Host.create(self.env, warm=True)
+
+        eq_(host.warm, True)
+        eq_(provisioning.call_args_list[-1][0][0], 'prefetch')
+        prefetch_nodes.assert_called_with()
+        assert not self.create_instance.called
+
+    def test_claim_warm(self):
+        hosts = [Host(fqdn='a', warm=True), Host(fqdn='b', warm=True)]
+        self.group.environment.hosts.filter.return_value = hosts
+
+        eq_(Host.claim_warm(self.group, 3), hosts)
+
+        self.hold.assert_called_with('warm-pool')
+        self.group.environment.hosts.filter.assert_called_with(
+            warm=True, provisioning_stage=None)
+        self.objects.filter.return_value.update.assert_called_with(
+            warm=False, group=self.group, provisioning_stage='claimed')
+        for host in hosts:
+            eq_(host.warm, False)
+            eq_(host.provisioning_stage, 'claimed')
+
+    @patch('stretch.models.Host.provisioning')
+    def test_finish_claim(self, provisioning):
+        provisioning.return_value = MagicMock()
+        host = Host(fqdn='a', group=self.group, provisioning_stage='claimed')
+
+        host.finish_claim()
+
+        provisioning.assert_called_with('instance')
+        self.create_instance.assert_called_with(self.group.node)
+        eq_(host.provisioning_stage, None)
+
+    def test_prefetch_nodes(self):
+        node = Mock()
+        self.env.groups.all.return_value = [Mock(node=node), Mock(node=node)]
+        host = Host(fqdn='a', environment=self.env)
+
+        with patch('stretch.models.Host.agent') as agent:
+            host.prefetch_nodes()
+            agent.apply_batch.assert_called_once_with(nodes=[node])
+            agent.prefetch_node.assert_called_once_with(
+                node, self.env.get_node_release.return_value)
+
+    def test_prefetch_nodes_not_deployed(self):
+        self.env.groups.all.return_value = [Mock()]
+        self.env.get_node_release.return_value = None
+        host = Host(fqdn='a', environment=self.env)
+
+        with patch('stretch.models.Host.agent') as agent:
+            host.prefetch_nodes()
+            assert not agent.apply_batch.called
+            assert not agent.prefetch_node.called
+
+    def test_create_failure(self):
+        self.sync.side_effect = Exception()
+
+        with assert_raises(Exception):
+            Host.create(self.env, self.group)
+
+        self.delete.assert_called_with()
+        assert not self.create_instance.called
+
+    @testutils.patch_settings('STRETCH_PROVISIONING_LIMITS', {'sync': 2})
+    @testutils.patch_settings('STRETCH_PROVISIONING_POLL_INTERVAL', 0)
+    def test_provisioning(self):
+        counts = self.objects.filter.return_value.count
+        counts.side_effect = [2, 2, 1]
+        host = Host(fqdn='host')
+
+        with host.provisioning('sync'):
+            eq_(host.provisioning_stage, 'sync')
+            assert host.provisioning_expires_at
+
+        eq_(counts.call_count, 3)
+        self.hold.assert_called_with('provisioning')
+        # Expired claims leave room in the stage
+        kwargs = self.objects.filter.call_args_list[0][1]
+        eq_(kwargs['provisioning_stage'], 'sync')
+        now = kwargs['provisioning_expires_at__gt']
+        assert now < host.provisioning_expires_at
+        self.objects.filter.return_value.update.assert_called_with(
+            provisioning_stage='sync',
+            provisioning_expires_at=host.provisioning_expires_at)
+
+    @testutils.patch_settings('STRETCH_PROVISIONING_LIMITS', {})
+    @testutils.patch_settings('STRETCH_PROVISIONING_LEASE', 60)
+    @patch('stretch.models.utils.heartbeat')
+    def test_provisioning_renews_claim(self, heartbeat):
+        heartbeat.return_value = MagicMock()
+        host = Host(fqdn='host')
+        host.pk = 1
+
+        with host.provisioning('create'):
+            renew, interval = heartbeat.call_args[0]
+            eq_(interval, 20)
+            renew()
+
+        self.objects.filter.assert_called_with(pk=1)
+        kwargs = self.objects.filter.return_value.update.call_args[1]
+        assert kwargs['provisioning_expires_at']
+
+    @testutils.patch_settings('STRETCH_PROVISIONING_LIMITS', {})
+    def test_provisioning_unlimited(self):
+        host = Host(fqdn='host')
+        with host.provisioning('create'):
+            eq_(host.provisioning_stage, 'create')
+        assert not self.objects.filter.return_value.count.called
+
+
+class TestHostSalt(TestCase):
+    def setUp(self):
+        patcher = patch('stretch.models.wheel_client')
+        self.wheel_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.accept = self.wheel_client.return_value.call_func
+
+        patcher = patch('stretch.models.gevent.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.host = Host(fqdn='host.example.com')
+        self.events = Mock()
+
+    def test_accept_key(self):
+        self.accept.return_value = {'minions': ['host.example.com']}
+        self.host._accept_key(self.events)
+        self.accept.assert_called_once_with('key.accept',
+                                            match='host.example.com')
+        assert not self.events.wait.called
+
+    def test_accept_key_on_event(self):
+        self.accept.side_effect = [{}, {'minions': ['host.example.com']}]
+        self.events.wait.return_value = True
+        self.host._accept_key(self.events)
+        eq_(self.events.wait.call_args[0][0], 'pending')
+        assert not self.sleep.called
+
+    def test_accept_key_polls(self):
+        self.accept.side_effect = [{}, {}, {},
+                                   {'minions': ['host.example.com']}]
+        self.events.wait.return_value = False
+        self.host._accept_key(self.events)
+        eq_(self.sleep.call_count, 3)
+
+    def test_accept_key_fails(self):
+        self.accept.return_value = {}
+        with assert_raises(Exception):
+            self.host._accept_key()
+        eq_(self.accept.call_count, 31)
+
+    @patch('stretch.models.Host.sync_many')
+    def test_sync(self, sync_many):
+        self.host.sync(self.events)
+        self.events.wait.assert_called_with('start')
+        sync_many.assert_called_with([self.host])
+
+    @testutils.patch_settings('STRETCH_SALT_BATCH_SIZE', 2)
+    @patch('stretch.models.salt_client')
+    def test_call_many(self, salt_client):
+        cmd = salt_client.return_value.cmd
+        cmd.side_effect = [{'a': 1, 'b': 2}, {}]
+        hosts = [Host(fqdn=fqdn) for fqdn in ('a', 'b', 'c')]
+
+        results = Host.call_many(hosts, 'test.ping')
+
+        eq_([(host.fqdn, result) for host, result in results],
+            [('a', 1), ('b', 2), ('c', None)])
+        eq_(cmd.call_args_list, [
+            call(['a', 'b'], 'test.ping', [], expr_form='list', timeout=300),
+            call(['c'], 'test.ping', [], expr_form='list', timeout=300)
+        ])
+
+    @patch('stretch.models.Host.call_many')
+    def test_retry_call_many(self, call_many):
+        a, b = Host(fqdn='a'), Host(fqdn='b')
+        call_many.side_effect = [[(a, {}), (b, None)], [(b, {})]]
+
+        eq_(Host.retry_call_many([a, b], 'state.highstate'), [])
+
+        call_many.assert_called_with([b], 'state.highstate', ())
+        eq_(self.sleep.call_count, 1)
+
+    @patch('stretch.models.Host.call_many')
+    def test_retry_call_many_fails(self, call_many):
+        a = Host(fqdn='a')
+        call_many.return_value = [(a, None)]
+        eq_(Host.retry_call_many([a], 'state.highstate'), [a])
+        eq_(call_many.call_count, 10)
+
+    @patch('stretch.models.Host.retry_call_many')
+    def test_sync_many(self, retry_call_many):
+        hosts = [Host(fqdn='a'), Host(fqdn='b')]
+        Host.sync_many(hosts)
+        eq_(retry_call_many.call_args_list, [
+            call(hosts, 'state.highstate'),
+            call(hosts, 'saltutil.sync_modules')
+        ])
@@ -1,4 +1,5 @@
 from mock import Mock, patch
+from nose.tools import eq_
 from unittest import TestCase
 
 from stretch.testutils import patch_settings, mock_attr
@@ -34,28 +35,61 @@ class TestInstance(TestCase):
             self.assertEquals(instance.host, self.host)
             self.assertEquals(instance.node, self.node)
 
+    @patch_settings('STRETCH_BATCH_SIZE', 2)
+    @patch('stretch.models.Instance.objects')
+    def test_bulk_create(self, objects):
+        env = Mock(using_source=False)
+        release = env.get_node_release.return_value
+        node1, node2 = Mock(pk=1), Mock(pk=2)
+        host1, host2 = Mock(pk=10), Mock(pk=20)
+        existing = objects.filter.return_value.values_list.return_value
+        existing.distinct.return_value = [(10, 1)]
+
+        instances = Instance.bulk_create(env, [(host1, node1), (host1, node2),
+                                               (host2, node1), (host2, node1)])
+
+        eq_(len(instances), 4)
+        objects.bulk_create.assert_called_once_with(instances)
+        host1.agent.apply_batch.assert_called_once_with(
+            [node2], [(node2, env, release)], instances[:2])
+        host2.agent.apply_batch.assert_called_once_with(
+            [node1], [(node1, env, release)], instances[2:])
+        eq_(env.get_node_release.call_count, 2)
+
     def test_sync_node_current_release(self):
         node = Mock()
         self.host.nodes = []
         release = Mock()
-        self.env.current_release = release
+        self.env.get_node_release.return_value = release
         self.env.using_source = False
 
         self.instance.sync_node(node)
 
         self.host.agent.add_node.assert_called_with(node)
-        self.host.agent.pull.assert_called_with(node, release=release)
+        self.host.agent.pull_node.assert_called_with(node, self.env, release)
+        self.env.get_node_release.assert_called_with(node)
 
     def test_sync_node_using_source(self):
         node = Mock()
         self.host.nodes = []
-        self.env.current_release = None
+        self.env.get_node_release.return_value = None
         self.env.using_source = True
 
         self.instance.sync_node(node)
 
         self.host.agent.add_node.assert_called_with(node)
-        self.host.agent.pull.assert_called_with(node)
+        self.host.agent.pull_node.assert_called_with(node, self.env, None)
+
+    def test_sync_node_before_first_deploy(self):
+        node = Mock()
+        self.host.nodes = []
+        self.env.get_node_release.return_value = None
+        self.env.using_source = False
+
+        self.instance.sync_node(node)
+
+        self.host.agent.add_node.assert_called_with(node)
+        assert not self.host.agent.pull_node.called
 
     def test_sync_node_should_not_sync_if_already_deployed(self):
         node = Mock()
@@ -1,7 +1,8 @@
 from mock import Mock, patch
-from nose.tools import assert_raises
+from nose.tools import eq_, assert_raises
 from unittest import TestCase
 
+from stretch import testutils
 from stretch.models import LoadBalancer
 
 
@@ -34,6 +35,30 @@ class TestLoadBalancer(TestCase):
             backend.create_lb.return_value = ('2.2.2.2', 443)
             return LoadBalancer.create(self.group, 'p', 'http', {'k': 'v'})
 
+    @testutils.patch_settings('STRETCH_DRAIN_POLL_INTERVAL', 5)
+    @patch('stretch.models.gevent.sleep')
+    def test_drain_host(self, sleep):
+        backend = self.patch_lb('backend', mock=True)
+        backend.lb_get_connections.side_effect = [{'1.1.1.1': 3},
+                                                  {'1.1.1.1': 0}]
+        host = Mock(address='1.1.1.1')
+
+        self.lb.drain_host(host, timeout=60)
+
+        backend.lb_drain_host.assert_called_with(self.lb, '1.1.1.1')
+        eq_(backend.lb_get_connections.call_count, 2)
+        sleep.assert_called_once_with(5)
+
+    @patch('stretch.models.gevent.sleep')
+    def test_drain_host_unsupported(self, sleep):
+        backend = self.patch_lb('backend', mock=True)
+        backend.lb_drain_host.return_value = False
+
+        self.lb.drain_host(Mock(address='1.1.1.1'))
+
+        assert not backend.lb_get_connections.called
+        assert not sleep.called
+
     def test_create(self):
         lb = self.create_lb()
 
@@ -0,0 +1,19 @@
+from nose.tools import eq_, assert_raises
+from unittest import TestCase
+
+from stretch.models import Lock
+
+
+class TestLock(TestCase):
+    def test_hold(self):
+        with Lock.hold('test'):
+            eq_(Lock.objects.filter(name='test').count(), 1)
+        with Lock.hold('test'):
+            eq_(Lock.objects.filter(name='test').count(), 1)
+
+    def test_hold_releases_on_error(self):
+        with assert_raises(ValueError):
+            with Lock.hold('test'):
+                raise ValueError()
+        with Lock.hold('test'):
+            pass
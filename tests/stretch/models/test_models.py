@@ -28,3 +28,12 @@ class TestSingalReceivers(object):
         signals.release_created.send(sender=release)
         env1.deploy.delay.assert_called_with(release)
         assert not env2.deploy.delay.called
+        assert not release.prepare.called
+
+    def test_release_created_receiver_prepares(self):
+        release = Mock()
+        envs = [Mock(auto_deploy=False), Mock(auto_deploy=True),
+                Mock(auto_deploy=True)]
+        release.system.environments.all.return_value = envs
+        signals.release_created.send(sender=release)
+        release.prepare.assert_called_with(envs[1])
@@ -26,3 +26,63 @@ class TestRelease(TestCase):
         self.assertEquals(self.release.get_snapshot(), snapshot)
         tarfile.open.assert_called_with('/data/snapshot.tar.gz')
         Snapshot.assert_called_with('/temp_dir')
+
+    @patch('stretch.models.parser.Snapshot')
+    @patch('stretch.models.os.path.exists', return_value=True)
+    @patch('stretch.models.utils')
+    @patch_settings('STRETCH_CACHE_DIR', '/cache')
+    def test_get_prepared_snapshot(self, utils, exists, Snapshot):
+        utils.temp_dir.return_value = '/temp_dir'
+        Snapshot.return_value = snapshot = Mock()
+        self.assertEquals(self.release.get_snapshot(), snapshot)
+        utils.temp_dir.assert_called_with('/cache/releases/sha/snapshot')
+        Snapshot.assert_called_with('/temp_dir')
+        self.assertEquals(snapshot.prepared, True)
+
+    @patch('stretch.models.Release.system', Mock())
+    @patch('stretch.models.Release._extract')
+    @patch('stretch.models.Deploy')
+    @patch('stretch.models.parser.Snapshot')
+    @patch('stretch.models.os.path.exists', return_value=False)
+    @patch('stretch.models.open', create=True)
+    @patch('stretch.models.utils')
+    @patch_settings('STRETCH_CACHE_DIR', '/cache')
+    @patch_settings('STRETCH_PREPARED_RELEASES', 1)
+    def test_prepare(self, utils, mock_open, exists, Snapshot, Deploy,
+                     _extract):
+        stale_release = Mock()
+        releases = self.release.system.releases
+        releases.exclude.return_value.order_by.return_value = [stale_release]
+
+        env = Mock()
+        self.release.prepare(env)
+
+        _extract.assert_called_with('/cache/releases/sha/snapshot')
+        Snapshot.return_value.run_build_plugins.assert_called_with(
+            Deploy.create.return_value)
+        Deploy.create.assert_called_with(release=self.release, environment=env)
+        mock_open.assert_called_with('/cache/releases/sha/prepared', 'w')
+        stale_release.clean_prepared.assert_called_with()
+
+    def test_rollback_migrations(self):
+        self.release.manifest = {'migrations': {'db': '2-b.js'}}
+        target = Release(name='target', sha='target_sha')
+        target.manifest = {'migrations': {'db': '1-a.js'}}
+        deploy = Mock()
+        plugin = Mock()
+        plugin.name = 'migrations'
+        plugin.relative_path = 'db'
+        snapshot = Mock()
+        snapshot.plugins = [plugin]
+
+        with patch.object(Release, 'get_snapshot', return_value=snapshot):
+            self.release.rollback_migrations(deploy, target)
+
+        plugin.rollback.assert_called_with(deploy, '1-a.js')
+        snapshot.clean_up.assert_called_with()
+
+    @patch('stretch.models.Release.get_snapshot')
+    def test_rollback_without_migrations(self, get_snapshot):
+        self.release.manifest = {'migrations': {}}
+        self.release.rollback_migrations(Mock(), Mock())
+        assert not get_snapshot.called
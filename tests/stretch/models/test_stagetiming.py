@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from mock import Mock, patch
+from nose.tools import eq_, assert_raises
+from unittest import TestCase
+
+from stretch.models import StageTiming, Deploy
+
+
+class TestStageTiming(TestCase):
+    def setUp(self):
+        self.deploy = Deploy()
+
+    @patch('stretch.models.StageTiming.save')
+    def test_record(self, save):
+        with StageTiming.record('pull', deploy=self.deploy,
+                                host='host') as timing:
+            pass
+        eq_(timing.stage, 'pull')
+        eq_(timing.host, 'host')
+        eq_(timing.failed, False)
+        assert timing.finished_at >= timing.started_at
+        save.assert_called_with()
+
+    @patch('stretch.models.StageTiming.save')
+    def test_record_failure(self, save):
+        with assert_raises(ValueError):
+            with StageTiming.record('pull', deploy=self.deploy) as timing:
+                raise ValueError()
+        eq_(timing.failed, True)
+        save.assert_called_with()
+
+    @patch('stretch.models.StageTiming.save')
+    def test_record_without_owner(self, save):
+        with StageTiming.record('restart', deploy=None):
+            pass
+        assert not save.called
+
+    def test_duration(self):
+        now = datetime.now()
+        timing = StageTiming(started_at=now,
+                             finished_at=now + timedelta(seconds=3))
+        eq_(timing.duration, 3.0)
+
+    @patch('stretch.models.Deploy.objects')
+    @patch('stretch.models.StageTiming.objects')
+    def test_percentiles(self, objects, deploy_objects):
+        deploys = deploy_objects.order_by.return_value.filter.return_value
+        deploys.values_list.return_value = [1, 2]
+        timings = [Mock(stage='restart', duration=float(i))
+                   for i in range(1, 11)]
+        timings.append(Mock(stage='pull', duration=4.0))
+        objects.filter.return_value.exclude.return_value = timings
+
+        env = Mock()
+        percentiles = StageTiming.percentiles(environment=env, deploys=2)
+
+        deploy_objects.order_by.return_value.filter.assert_called_with(
+            environment=env)
+        objects.filter.assert_called_with(deploy__in=[1, 2], failed=False)
+        eq_(percentiles, {
+            'restart': {'count': 10, 'p50': 5.0, 'p95': 10.0},
+            'pull': {'count': 1, 'p50': 4.0, 'p95': 4.0}
+        })
@@ -0,0 +1,111 @@
+import time
+from mock import Mock, MagicMock, ANY, patch
+from nose.tools import eq_, assert_raises
+from unittest import TestCase
+
+from stretch.testutils import mock_attr, patch_settings
+from stretch.models import TaskSlot
+
+
+class TestTaskSlot(TestCase):
+    def setUp(self):
+        patcher = patch('stretch.models.TaskSlot.objects')
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('stretch.models.Lock.hold', MagicMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.slot = Mock(active=False)
+        self.objects.get_or_create.return_value = (self.slot, True)
+        self.system = mock_attr(name='small')
+
+    def set_slots(self, held, waiting):
+        def filter(**kwargs):
+            result = Mock()
+            if kwargs.get('active'):
+                result.values_list.return_value = held
+            else:
+                result.values_list.return_value = waiting
+            return result
+        self.objects.filter.side_effect = filter
+
+    @patch_settings('STRETCH_WORKER_SLOTS', 4)
+    @patch_settings('STRETCH_SYSTEM_CONCURRENCY', {})
+    @patch_settings('STRETCH_SYSTEM_WEIGHTS', {})
+    def test_request(self):
+        self.set_slots(['big', 'big'], ['small'])
+        eq_(TaskSlot.request(self.system, 'deploy', 'task'), True)
+        eq_(self.slot.active, True)
+        self.slot.save.assert_called_with()
+
+    @patch_settings('STRETCH_WORKER_SLOTS', 2)
+    @patch_settings('STRETCH_SYSTEM_CONCURRENCY', {})
+    @patch_settings('STRETCH_SYSTEM_WEIGHTS', {})
+    def test_request_at_capacity(self):
+        self.set_slots(['big', 'big'], ['small'])
+        eq_(TaskSlot.request(self.system, 'deploy', 'task'), False)
+        eq_(self.slot.active, False)
+        self.slot.save.assert_called_with()
+
+    @patch_settings('STRETCH_WORKER_SLOTS', 4)
+    @patch_settings('STRETCH_SYSTEM_CONCURRENCY', {'small': 1})
+    @patch_settings('STRETCH_SYSTEM_WEIGHTS', {})
+    def test_request_over_system_cap(self):
+        self.set_slots(['small'], ['small'])
+        eq_(TaskSlot.request(self.system, 'build', 'task'), False)
+
+    @patch_settings('STRETCH_WORKER_SLOTS', 4)
+    @patch_settings('STRETCH_SYSTEM_CONCURRENCY', {})
+    @patch_settings('STRETCH_SYSTEM_WEIGHTS', {'other': 2})
+    def test_request_yields_to_system_with_lower_share(self):
+        self.set_slots(['small', 'other'], ['small', 'other'])
+        eq_(TaskSlot.request(self.system, 'deploy', 'task'), False)
+
+    @patch_settings('STRETCH_WORKER_SLOTS', 4)
+    @patch_settings('STRETCH_SYSTEM_CONCURRENCY', {'other': 1})
+    @patch_settings('STRETCH_SYSTEM_WEIGHTS', {'other': 2})
+    def test_request_ignores_capped_waiting_systems(self):
+        self.set_slots(['small', 'other'], ['small', 'other'])
+        eq_(TaskSlot.request(self.system, 'deploy', 'task'), True)
+
+    @patch('stretch.models.TaskSlot.request')
+    @patch('stretch.models.current_task', None)
+    def test_hold_outside_task(self, request):
+        with TaskSlot.hold(self.system, 'deploy'):
+            pass
+        assert not request.called
+
+    @patch('stretch.models.TaskSlot.request', return_value=True)
+    @patch('stretch.models.current_task')
+    def test_hold(self, current_task, request):
+        current_task.request.id = 'task'
+        self.objects.filter.return_value.exists.return_value = False
+        with TaskSlot.hold(self.system, 'deploy'):
+            request.assert_called_with(self.system, 'deploy', 'task')
+        self.objects.filter.assert_called_with(task_id='task')
+        self.objects.filter.return_value.delete.assert_called_with()
+
+    @patch_settings('STRETCH_SCHEDULER_LEASE', 0.03)
+    @patch('stretch.models.TaskSlot.request', return_value=True)
+    @patch('stretch.models.current_task')
+    def test_hold_renews_lease(self, current_task, request):
+        current_task.request.id = 'task'
+        self.objects.filter.return_value.exists.return_value = False
+        with TaskSlot.hold(self.system, 'deploy'):
+            time.sleep(0.1)
+        self.objects.filter.return_value.update.assert_called_with(
+            expires_at=ANY)
+
+    @patch_settings('STRETCH_SCHEDULER_RETRY_DELAY', 5)
+    @patch('stretch.models.TaskSlot.request', return_value=False)
+    @patch('stretch.models.current_task')
+    def test_hold_retries(self, current_task, request):
+        current_task.request.id = 'task'
+        current_task.retry.return_value = Exception()
+        self.objects.filter.return_value.exists.return_value = False
+        with assert_raises(Exception):
+            with TaskSlot.hold(self.system, 'deploy'):
+                pass
+        current_task.retry.assert_called_with(countdown=5, max_retries=None)
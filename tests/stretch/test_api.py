@@ -0,0 +1,109 @@
+import json
+from django.core.exceptions import ObjectDoesNotExist
+from django.test.client import Client
+from mock import patch
+from nose.tools import eq_
+from unittest import TestCase
+
+
+class TestApi(TestCase):
+    def setUp(self):
+        self.client = Client()
+        patcher = patch('stretch.api.System')
+        self.System = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.system = self.System.objects.get.return_value
+        self.env = self.system.environments.get.return_value
+        self.release = self.system.releases.get.return_value
+
+    def test_deploy(self):
+        self.env.deploy.delay.return_value.id = 'task'
+        r = self.client.post('/api/systems/sys/deploy/',
+                             {'env': 'env', 'release': 'sha'})
+        eq_(r.status_code, 200)
+        eq_(json.loads(r.content), {'task_id': 'task'})
+        self.System.objects.get.assert_called_with(name='sys')
+        self.system.releases.get.assert_called_with(sha='sha')
+        self.env.deploy.delay.assert_called_with(self.release, None)
+
+    def test_post_without_csrf_token(self):
+        # API clients are not browsers and have no CSRF token
+        client = Client(enforce_csrf_checks=True)
+        self.env.deploy.delay.return_value.id = 'task'
+        self.env.rollback.delay.return_value.id = 'task'
+        self.env.sync_hosts.delay.return_value.id = 'task'
+        self.env.groups.get.return_value.scale_to.return_value.pk = 1
+        for view in ('deploy', 'rollback', 'sync', 'scale'):
+            r = client.post('/api/systems/sys/%s/' % view,
+                            {'env': 'env', 'release': 'sha', 'amount': '1'})
+            eq_(r.status_code, 200)
+
+    def test_plan(self):
+        self.system.nodes.filter.return_value.count.return_value = 1
+        self.env.plan.return_value.as_dict.return_value = {'duration': 1.0}
+        r = self.client.get('/api/systems/sys/plan/',
+                            {'env': 'env', 'release': 'sha', 'nodes': 'web'})
+        eq_(r.status_code, 200)
+        eq_(json.loads(r.content), {'duration': 1.0})
+        self.system.nodes.filter.assert_called_with(name__in=['web'])
+        self.env.plan.assert_called_with(self.release, ['web'])
+
+    def test_plan_unknown_node(self):
+        self.system.nodes.filter.return_value.count.return_value = 0
+        r = self.client.get('/api/systems/sys/plan/',
+                            {'env': 'env', 'release': 'sha', 'nodes': 'web'})
+        eq_(r.status_code, 400)
+
+    def test_rollback(self):
+        self.env.rollback.delay.return_value.id = 'task'
+        r = self.client.post('/api/systems/sys/rollback/',
+                             {'env': 'env', 'release': 'sha'})
+        eq_(r.status_code, 200)
+        eq_(json.loads(r.content), {'task_id': 'task'})
+        self.system.environments.get.assert_called_with(name='env')
+        self.env.rollback.delay.assert_called_with(self.release)
+
+    def test_rollback_not_found(self):
+        self.system.releases.get.side_effect = ObjectDoesNotExist()
+        r = self.client.post('/api/systems/sys/rollback/',
+                             {'env': 'env', 'release': 'sha'})
+        eq_(r.status_code, 404)
+
+    def test_sync_hosts(self):
+        self.env.sync_hosts.delay.return_value.id = 'task'
+        r = self.client.post('/api/systems/sys/sync/',
+                             {'env': 'env', 'nodes': ['web', 'db']})
+        eq_(r.status_code, 200)
+        eq_(json.loads(r.content), {'task_id': 'task'})
+        self.system.environments.get.assert_called_with(name='env')
+        self.env.sync_hosts.delay.assert_called_with(['web', 'db'])
+
+    def test_sync_hosts_not_found(self):
+        self.system.environments.get.side_effect = ObjectDoesNotExist()
+        r = self.client.post('/api/systems/sys/sync/', {'env': 'env'})
+        eq_(r.status_code, 404)
+
+    def test_scale(self):
+        group = self.env.groups.get.return_value
+        group.scale_to.return_value.pk = 3
+        r = self.client.post('/api/systems/sys/scale/',
+                             {'env': 'env', 'group': 'web', 'amount': '4'})
+        eq_(r.status_code, 200)
+        eq_(json.loads(r.content), {'id': 3})
+        self.env.groups.get.assert_called_with(name='web')
+        group.scale_to.assert_called_with(4)
+
+    def test_scale_invalid_amount(self):
+        r = self.client.post('/api/systems/sys/scale/',
+                             {'env': 'env', 'group': 'web', 'amount': 'x'})
+        eq_(r.status_code, 400)
+
+    @patch('stretch.api.ScalingOperation')
+    def test_get_scaling_operation(self, ScalingOperation):
+        operation = ScalingOperation.objects.get.return_value
+        operation.as_dict.return_value = {'status': 'finished'}
+        r = self.client.get('/api/systems/sys/scaling/5/')
+        eq_(r.status_code, 200)
+        eq_(json.loads(r.content), {'status': 'finished'})
+        ScalingOperation.objects.get.assert_called_with(pk='5',
+            group__environment__system__name='sys')
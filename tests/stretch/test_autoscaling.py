@@ -0,0 +1,79 @@
+from mock import Mock
+from nose.tools import eq_, assert_raises
+from unittest import TestCase
+
+from stretch import autoscaling
+
+
+class TestPolicy(TestCase):
+    def setUp(self):
+        self.policy = autoscaling.Policy({
+            'metric': 'cpu',
+            'target': 0.5,
+            'tolerance': 0.1,
+            'scale_up_cooldown': 60,
+            'scale_down_cooldown': 300,
+            'max_step_up': 3,
+            'max_step_down': 1
+        })
+
+    def decide(self, current, cpu, since_scaling=None, maximum=10):
+        return self.policy.decide(current, {'cpu': cpu}, 1, maximum,
+                                  since_scaling)[0]
+
+    def test_invalid_options(self):
+        with assert_raises(ValueError):
+            autoscaling.Policy({'metric': 'disk'})
+        with assert_raises(ValueError):
+            autoscaling.Policy({'target': 0})
+
+    def test_decide(self):
+        eq_(self.decide(4, 0.75), 6)
+        eq_(self.decide(4, 0.25), 3)
+
+    def test_decide_tolerance(self):
+        eq_(self.decide(4, 0.54), 4)
+        eq_(self.decide(4, 0.46), 4)
+
+    def test_decide_step_limits(self):
+        eq_(self.decide(2, 1.0 * 4), 5)
+        eq_(self.decide(8, 0.1), 7)
+
+    def test_decide_bounds(self):
+        eq_(self.decide(9, 1.0), 10)
+        eq_(self.decide(1, 0.1), 1)
+        eq_(self.decide(12, 0.5), 10)
+
+    def test_decide_cooldown(self):
+        eq_(self.decide(4, 0.75, since_scaling=30), 4)
+        eq_(self.decide(4, 0.75, since_scaling=90), 6)
+        eq_(self.decide(4, 0.25, since_scaling=90), 4)
+        eq_(self.decide(4, 0.25, since_scaling=400), 3)
+
+    def test_decide_missing_metric(self):
+        eq_(self.policy.decide(4, {'cpu': None}, 1), (4, 'no cpu metric'))
+
+
+def test_collect_metrics():
+    hosts = [Mock(pk=1, address='a'), Mock(pk=2, address='b')]
+    metrics = autoscaling.collect_metrics(hosts, {'a': 10, 'b': 20},
+        {1: {'cpu': 0.2, 'memory': 0.4}, 2: {'cpu': 0.4}})
+    eq_(round(metrics.pop('cpu'), 6), 0.3)
+    eq_(metrics, {'hosts': 2, 'connections': 15.0, 'memory': 0.4})
+    eq_(autoscaling.collect_metrics(hosts, None, {}),
+        {'hosts': 2, 'connections': None, 'cpu': None, 'memory': None})
+
+
+def test_replay():
+    policy = autoscaling.Policy({'metric': 'cpu', 'target': 0.5,
+                                 'scale_up_cooldown': 0,
+                                 'scale_down_cooldown': 0})
+    samples = [(0, {'hosts': 2, 'cpu': 1.0}),
+               (60, {'hosts': 2, 'cpu': 1.0}),
+               (120, {'hosts': 2, 'cpu': 0.5})]
+
+    decisions = autoscaling.replay(policy, samples, 1)
+
+    eq_([(d['current'], d['desired']) for d in decisions],
+        [(2, 4), (4, 4), (4, 3)])
+    eq_(decisions[1]['metrics']['cpu'], 0.5)
@@ -1,13 +1,18 @@
-from mock import Mock, patch, DEFAULT, call
+import gevent
+from datetime import timedelta
+from django.utils import timezone
+from mock import Mock, patch, DEFAULT, call, ANY
 from nose.tools import eq_, assert_raises
 from testtools import TestCase
 
-from stretch import backends
+from stretch import backend
+from stretch.backends import rackspace_salt, simulated
+from stretch import testutils, utils, exceptions
 from stretch.testutils import mock_attr
 
 
 class TestBackendMap(object):
-    @patch('stretch.backends.get_backend_map')
+    @patch('stretch.backend.get_backend_map')
     def test_get_backend(self, get_backend_map):
         get_backend_map.return_value = {
             'system': {
@@ -19,11 +24,11 @@ class TestBackendMap(object):
         env.name = 'env'
         env.system = Mock()
         env.system.name = 'system'
-        eq_(backends.get_backend(env), 'foo')
+        eq_(backend.get_backend(env), 'foo')
         env.name = 'foo'
-        eq_(backends.get_backend(env), None)
+        eq_(backend.get_backend(env), None)
         env.system.name = 'foo'
-        eq_(backends.get_backend(env), None)
+        eq_(backend.get_backend(env), None)
 
     @patch('stretch.utils.get_class')
     def test_get_backend_map(self, get_class):
@@ -44,17 +49,17 @@ class TestBackendMap(object):
             }
         }
 
-        backend_map = backends.get_backend_map(backend_dict)
-        backend = backend_map['system']['env']
-        assert isinstance(backend, TestBackend)
-        eq_(backend.options, {'foo': 'bar'})
+        backend_map = backend.get_backend_map(backend_dict)
+        env_backend = backend_map['system']['env']
+        assert isinstance(env_backend, TestBackend)
+        eq_(env_backend.options, {'foo': 'bar'})
 
 
 class TestRackspaceBackend(TestCase):
     def setUp(self):
         super(TestRackspaceBackend, self).setUp()
 
-        patcher = patch('stretch.backends.pyrax')
+        patcher = patch('stretch.backends.rackspace_salt.pyrax')
         self.addCleanup(patcher.stop)
         self.pyrax = patcher.start()
 
@@ -63,7 +68,7 @@ class TestRackspaceBackend(TestCase):
         self.cs.flavors.list.return_value = [mock_attr(ram=512)]
         self.pyrax.connect_to_cloudservers.return_value = self.cs
 
-        self.backend = backends.RackspaceBackend({
+        self.backend = rackspace_salt.RackspaceBackend({
             'username': 'barfoo',
             'api_key': '------',
             'region': 'dfw',
@@ -84,94 +89,489 @@ class TestRackspaceBackend(TestCase):
             'ram': 1
         }
 
-        with assert_raises(backends.RackspaceBackend.ImageNotFound):
-            backends.RackspaceBackend(options)
+        with assert_raises(rackspace_salt.RackspaceBackend.ImageNotFound):
+            rackspace_salt.RackspaceBackend(options)
 
         options['image'] = 'mage2'
-        with assert_raises(backends.RackspaceBackend.FlavorNotFound):
-            backends.RackspaceBackend(options)
+        with assert_raises(rackspace_salt.RackspaceBackend.FlavorNotFound):
+            rackspace_salt.RackspaceBackend(options)
 
         options['ram'] = 512
-        backends.RackspaceBackend(options)
+        rackspace_salt.RackspaceBackend(options)
 
         pyrax = self.pyrax
         pyrax.connect_to_cloudservers.assert_called_with(region='DFW')
         pyrax.connect_to_cloud_loadbalancers.assert_called_with(region='DFW')
         pyrax.set_credentials.assert_called_with('barfoo', '------')
 
-    def test_should_create_image(self):
+    def test_get_latest_image(self):
         backend = self.backend
+        old = mock_attr(name='p-0.1', status='ACTIVE', created='2013-01-01')
+        new = mock_attr(name='p-0.2', status='ACTIVE', created='2013-02-01')
+        baking = mock_attr(name='p-0.3', status='SAVING', created='2013-03-01')
+        other = mock_attr(name='image', status='ACTIVE', created='2013-04-01')
+        self.cs.images.list.return_value = [old, new, baking, other]
+        backend.images.invalidate()
+
+        eq_(backend.get_latest_image('p-0.1', 'p'), old)
+        eq_(backend.get_latest_image('p-0.3', 'p'), new)
+        self.cs.images.list.return_value = [baking, other]
+        backend.images.invalidate()
+        eq_(backend.get_latest_image('p-0.3', 'p'), None)
 
         backend.store_images = False
-        eq_(backend.should_create_image('prefix-name', 'prefix'),
-            (False, None))
-
-        backend.store_images = True
-        eq_(backend.should_create_image('prefix-name', 'prefix'), (True, None))
-
-        image = mock_attr(name='prefix-name', id='id')
-        self.cs.images.list.return_value = [image]
-        eq_(backend.should_create_image('prefix-name', 'prefix'),
-            (False, 'id'))
-
-        im1 = mock_attr(name='prefix-foo')
-        im2 = mock_attr(name='otherprefix-foo')
-        self.cs.images.list.return_value = [im1, im2]
-        backend.store_images = False
-        backend.should_create_image('prefix-name', 'prefix')
-
-        assert not im1.delete.called
-        assert not im2.delete.called
-
-        backend.store_images = True
-        backend.should_create_image('prefix-name', 'prefix')
-
-        im1.delete.assert_called_with()
-        assert not im2.delete.called
-
-    @patch('stretch.backends.get_image_name', return_value=('p-name', 'p'))
-    @patch('stretch.backends.RackspaceBackend.should_create_image')
-    @patch('stretch.backends.RackspaceBackend.provision_host')
-    def test_create_host(self, provision_host, should_create_image, get_name):
+        self.cs.images.list.return_value = [old, new]
+        backend.images.invalidate()
+        eq_(backend.get_latest_image('p-0.1', 'p'), None)
+
+    @patch('stretch.backends.rackspace_salt.get_image_name',
+           return_value=('p-name', 'p'))
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.get_latest_image')
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.provision_host')
+    def test_create_host(self, provision_host, get_latest_image, get_name):
         server = mock_attr(status='ACTIVE', accessIPv4='publicip',
                            networks={'private': ['privateip']})
         self.cs.servers.create.return_value = server
+        self.backend.server_poller = Mock()
+        self.backend.server_poller.wait.return_value = server
         host = Mock()
 
-        should_create_image.return_value = (True, 'id')
+        get_latest_image.return_value = mock_attr(name='p-name', id='id')
         self.backend.use_public_network = True
         self.backend.create_host(host)
-        provision_host.assert_called_with(server, 'publicip', host, True,
-                                          'p-name', 'p')
+        self.cs.servers.create.assert_called_with(host.fqdn, 'id', ANY)
+        provision_host.assert_called_with(server, 'publicip', host,
+                                          bootstrap_image=False)
 
-        should_create_image.return_value = (False, None)
+        get_latest_image.return_value = None
         self.backend.use_public_network = False
         self.backend.create_host(host)
-        provision_host.assert_called_with(server, 'privateip', host, False,
-                                          'p-name', 'p')
-
-    @patch.multiple('stretch.backends', put=DEFAULT, run=DEFAULT,
-                    upload_template=DEFAULT, env=DEFAULT)
+        self.cs.servers.create.assert_called_with(host.fqdn,
+                                                  self.backend.image.id, ANY)
+        provision_host.assert_called_with(server, 'privateip', host,
+                                          bootstrap_image=True)
+        assert not server.create_image.called
+
+    @patch('stretch.backends.rackspace_salt.get_image_name',
+           return_value=('p-name', 'p'))
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.connect')
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.bootstrap_image')
+    def test_bake_image(self, bootstrap_image, connect, get_name):
+        old = mock_attr(name='p-old', status='ACTIVE')
+        other = mock_attr(name='other', status='ACTIVE')
+        self.cs.images.list.return_value = [old, other]
+        self.cs.servers.list.return_value = []
+        server = mock_attr(status='ACTIVE', networks={'private': ['ip']})
+        self.cs.servers.create.return_value = server
+        image = mock_attr(name='p-name', status='ACTIVE')
+        self.cs.images.get.return_value = image
+        self.backend.server_poller = Mock()
+        self.backend.server_poller.wait.return_value = server
+        self.backend.image_poller = Mock()
+        self.backend.image_poller.wait.return_value = image
+
+        eq_(self.backend.bake_image(), image)
+        self.backend.server_poller.wait.assert_called_with(server)
+        self.backend.image_poller.wait.assert_called_with(image)
+
+        self.cs.servers.create.assert_called_with('p-name-bake',
+            self.backend.image.id, ANY)
+        connect.assert_called_with(server, 'ip')
+        bootstrap_image.assert_called_with()
+        server.create_image.assert_called_with('p-name')
+        server.delete.assert_called_with()
+        old.delete.assert_called_with()
+        assert not other.delete.called
+
+    @patch('stretch.backends.rackspace_salt.get_image_name',
+           return_value=('p-name', 'p'))
+    def test_bake_image_exists(self, get_name):
+        image = mock_attr(name='p-name', status='SAVING')
+        self.cs.images.list.return_value = [image]
+        eq_(self.backend.bake_image(), image)
+
+        self.cs.images.list.return_value = []
+        self.backend.images.invalidate()
+        self.cs.servers.list.return_value = [mock_attr(name='p-name-bake')]
+        eq_(self.backend.bake_image(), None)
+        assert not self.cs.servers.create.called
+
+        self.backend.store_images = False
+        eq_(self.backend.bake_image(), None)
+
+    def test_poll_resources(self):
+        eq_(self.backend.server_poller.name,
+            'backend:rackspace:DFW:barfoo:servers')
+        for attr in ('server_poller', 'image_poller', 'lb_poller'):
+            setattr(self.backend, attr, Mock())
+        self.backend.poll_resources()
+        self.backend.server_poller.poll.assert_called_with()
+        self.backend.image_poller.poll.assert_called_with()
+        self.backend.lb_poller.poll.assert_called_with()
+
+    def test_delete_host(self):
+        server = mock_attr(id=1, name='host.example.com')
+        self.cs.servers.list.return_value = [server]
+
+        self.backend.delete_host(mock_attr(fqdn='host.example.com'))
+        server.delete.assert_called_with()
+        eq_(self.backend.servers.get(1), None)
+
+        self.backend.delete_host(mock_attr(fqdn='other.example.com'))
+        eq_(self.cs.servers.list.call_count, 2)
+
+    def test_get_lb(self):
+        lb_obj = mock_attr(id=10, name='5')
+        self.clb = self.pyrax.connect_to_cloud_loadbalancers.return_value
+        self.clb.list.return_value = [lb_obj]
+
+        eq_(self.backend.get_lb(mock_attr(pk=5)), lb_obj)
+        eq_(self.backend.get_lb(mock_attr(pk=5)), lb_obj)
+        eq_(self.clb.list.call_count, 1)
+        assert not self.clb.get.called
+
+        with assert_raises(Exception):
+            self.backend.get_lb(mock_attr(pk=6))
+
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.get_lb')
+    def test_lb_add_endpoints(self, get_lb):
+        self.backend.lb_poller = Mock()
+        lb = Mock()
+
+        self.backend.lb_add_endpoints(lb, [('1.1.1.1', 80), ('2.2.2.2', 80)])
+
+        get_lb.assert_called_with(lb)
+        eq_(len(get_lb.return_value.add_nodes.call_args[0][0]), 2)
+        self.backend.lb_poller.wait.assert_called_once_with(
+            get_lb.return_value)
+
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.get_lb')
+    def test_lb_remove_endpoints(self, get_lb):
+        self.backend.lb_poller = Mock()
+        self.backend.clb = Mock()
+        nodes = [mock_attr(id=i, address='%s.0.0.0' % i, port=80)
+                 for i in range(12)]
+        lb_obj = get_lb.return_value
+        lb_obj.id = 'lb'
+        lb_obj.nodes = nodes
+
+        self.backend.lb_remove_endpoints(Mock(), [('0.0.0.0', 80)])
+        nodes[0].delete.assert_called_with()
+        assert not self.backend.clb.method_delete.called
+
+        self.backend.lb_remove_endpoints(Mock(), [(n.address, 80)
+                                                  for n in nodes[1:]])
+        self.backend.clb.method_delete.assert_has_calls([
+            call('/loadbalancers/lb/nodes?%s' %
+                 '&'.join('id=%s' % i for i in range(1, 11))),
+            call('/loadbalancers/lb/nodes?id=11')
+        ])
+        eq_(self.backend.lb_poller.wait.call_count, 2)
+
+        # Missing endpoints count as removed
+        self.backend.lb_remove_endpoints(Mock(), [('9.9.9.9', 80)])
+        eq_(self.backend.lb_poller.wait.call_count, 2)
+
+    @patch('stretch.backends.rackspace_salt.RackspaceBackend.get_lb')
+    def test_lb_remove_endpoints_partly_missing(self, get_lb):
+        self.backend.lb_poller = Mock()
+        node = mock_attr(id=1, address='1.1.1.1', port=80)
+        get_lb.return_value.nodes = [node]
+
+        self.backend.lb_remove_endpoints(Mock(), [('1.1.1.1', 80),
+                                                  ('9.9.9.9', 80)])
+        node.delete.assert_called_with()
+        self.backend.lb_poller.wait.assert_called_with(get_lb.return_value)
+
+    @patch.multiple('stretch.backends.rackspace_salt', put=DEFAULT,
+                    run=DEFAULT, upload_template=DEFAULT, env=DEFAULT)
     def test_provision_host(self, put, run, upload_template, env):
         s = Mock()
         s.adminPass = 'password'
-        s.create_image.return_value = 'imageid'
         host = Mock()
-        self.cs.images.get.return_value = mock_attr(status='ACTIVE')
 
-        self.backend.provision_host(s, '0.0.0.0', host, True, 'p-name', 'p')
+        self.backend.provision_host(s, '0.0.0.0', host)
         eq_(env.host_string, 'root@0.0.0.0')
         eq_(env.password, 'password')
-        run.assert_has_calls([call('/bin/bash image-bootstrap.sh'),
-                              call('/bin/bash /root/host-bootstrap.sh')])
-        run.reset()
+        run.assert_has_calls([
+            call('/bin/bash image-bootstrap.sh', timeout=None),
+            call('/bin/bash /root/host-bootstrap.sh', timeout=None)
+        ])
+        run.reset_mock()
 
-        self.backend.provision_host(s, '0.0.0.0', host, False, 'p-name', 'p')
-        run.assert_called_with('/bin/bash /root/host-bootstrap.sh')
+        self.backend.provision_host(s, '0.0.0.0', host, bootstrap_image=False)
+        run.assert_called_once_with('/bin/bash /root/host-bootstrap.sh',
+                                    timeout=None)
 
 
 class TestBackend(object):
     @patch('stretch.__version__', '0.2')
+    @patch('stretch.backend.get_scripts_hash', Mock(return_value='abcd'))
     @patch('django.conf.settings.STRETCH_BACKEND_IMAGE_PREFIX', 'prefix')
     def test_get_image_name(self):
-        eq_(backends.get_image_name(), ('prefix-0.2', 'prefix'))
+        eq_(backend.get_image_name(), ('prefix-0.2-abcd', 'prefix'))
+
+
+class TestCatalog(TestCase):
+    def setUp(self):
+        super(TestCatalog, self).setUp()
+        self.objs = [mock_attr(id=1, name='a'), mock_attr(id=2, name='b')]
+        self.list_func = Mock(return_value=self.objs)
+        self.catalog = backend.Catalog(self.list_func, ttl=60)
+
+    def test_lookups(self):
+        eq_(self.catalog.get(1), self.objs[0])
+        eq_(self.catalog.find('b'), self.objs[1])
+        assert testutils.check_items_equal(self.catalog.all(), self.objs)
+        eq_(self.list_func.call_count, 1)
+
+    def test_find_miss(self):
+        eq_(self.catalog.find('c'), None)
+        eq_(self.list_func.call_count, 2)
+
+    @patch('stretch.backend.time')
+    def test_ttl(self, time):
+        time.time.return_value = 100
+        self.catalog.all()
+        time.time.return_value = 159
+        self.catalog.all()
+        eq_(self.list_func.call_count, 1)
+        time.time.return_value = 161
+        self.catalog.all()
+        eq_(self.list_func.call_count, 2)
+
+    def test_add_remove(self):
+        obj = mock_attr(id=3, name='c')
+        self.catalog.all()
+        self.catalog.add(obj)
+        eq_(self.catalog.find('c'), obj)
+        self.catalog.remove(self.objs[0])
+        eq_(self.catalog.get(1), None)
+        eq_(self.list_func.call_count, 1)
+
+
+class TestStatusPoller(TestCase):
+    def setUp(self):
+        super(TestStatusPoller, self).setUp()
+        self.list_func = Mock()
+        self.refresh_func = Mock()
+        self.catalog = Mock()
+        self.poller = backend.StatusPoller('servers', self.list_func,
+            self.refresh_func, catalog=self.catalog)
+
+        patcher = patch('stretch.models.PendingResource.objects')
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pending = self.objects.filter.return_value
+
+    @patch('django.conf.settings.STRETCH_BACKEND_POLL_INTERVAL', 0)
+    def test_wait(self):
+        pending = self.objects.create.return_value
+        now = timezone.now() + timedelta(seconds=1)
+        self.objects.get.side_effect = [
+            mock_attr(status=None, polled_at=None, created_at=now),
+            mock_attr(status='BUILD', polled_at=now),
+            mock_attr(status='ACTIVE', polled_at=now)
+        ]
+        obj = mock_attr(id=1)
+
+        eq_(self.poller.wait(obj), obj)
+
+        self.objects.create.assert_called_with(poller='servers',
+                                               resource_id='1')
+        eq_(self.objects.get.call_count, 3)
+        pending.delete.assert_called_with()
+        self.refresh_func.assert_called_with(obj)
+        self.catalog.add.assert_called_with(obj)
+        assert not self.list_func.called
+
+    def test_wait_deadline(self):
+        pending = self.objects.create.return_value
+        self.objects.get.return_value = mock_attr(status=None,
+                                                  polled_at=timezone.now())
+        with utils.deadline(-1):
+            with assert_raises(exceptions.DeadlineExceeded):
+                self.poller.wait(mock_attr(id=1))
+        pending.delete.assert_called_with()
+
+    @patch('django.conf.settings.STRETCH_BACKEND_WAIT_TIMEOUT', -1)
+    def test_wait_timeout(self):
+        self.objects.get.return_value = mock_attr(status=None,
+                                                  polled_at=timezone.now())
+        with assert_raises(exceptions.DeadlineExceeded):
+            self.poller.wait(mock_attr(id=1))
+
+    @patch('django.conf.settings.STRETCH_BACKEND_POLL_INTERVAL', 0)
+    @patch('stretch.backend.StatusPoller.poll')
+    def test_wait_stale(self, poll):
+        # Without beat, nothing polls the resource but the waiter
+        polled_at = timezone.now() - timedelta(seconds=1)
+        self.objects.get.side_effect = [
+            mock_attr(status=None, polled_at=polled_at),
+            mock_attr(status='ACTIVE', polled_at=polled_at)
+        ]
+        poll.side_effect = Exception()
+
+        self.poller.wait(mock_attr(id=1))
+
+        poll.assert_called_once_with()
+
+    def test_poll(self):
+        self.pending.values_list.return_value = ['1', '2']
+        objs = [mock_attr(id=1, status='ACTIVE'),
+                mock_attr(id=2, status='BUILD'),
+                mock_attr(id=3, status='ACTIVE')]
+        self.list_func.return_value = objs
+
+        self.poller.poll()
+
+        self.objects.filter.assert_called_with(poller='servers')
+        eq_(self.list_func.call_count, 1)
+        self.catalog.load.assert_called_with(objs)
+        eq_([c[1] for c in self.pending.filter.call_args_list],
+            [{'resource_id': '1'}, {'resource_id': '2'}])
+        updates = self.pending.filter.return_value.update.call_args_list
+        eq_([c[1]['status'] for c in updates], ['ACTIVE', 'BUILD'])
+
+    def test_poll_nothing_pending(self):
+        self.pending.values_list.return_value = []
+        self.poller.poll()
+        assert not self.list_func.called
+
+    def test_poll_rate_limited(self):
+        self.pending.values_list.return_value = ['1']
+        error = Exception()
+        error.code = 413
+        self.list_func.side_effect = error
+
+        self.poller.poll()
+        assert not self.pending.filter.called
+
+    def test_poll_error(self):
+        self.pending.values_list.return_value = ['1']
+        self.list_func.side_effect = ValueError()
+        with assert_raises(ValueError):
+            self.poller.poll()
+
+
+class TestEndpointBatcher(TestCase):
+    def setUp(self):
+        super(TestEndpointBatcher, self).setUp()
+        self.backend = Mock()
+        self.batcher = backend.EndpointBatcher(self.backend)
+        self.lb = mock_attr(pk='lb')
+
+    @patch('django.conf.settings.STRETCH_LB_BATCH_WINDOW', 0.01)
+    def test_apply(self):
+        greenlets = [
+            gevent.spawn(self.batcher.apply, 'add', self.lb, '1.1.1.1', 80),
+            gevent.spawn(self.batcher.apply, 'add', self.lb, '2.2.2.2', 80),
+            gevent.spawn(self.batcher.apply, 'remove', self.lb, '3.3.3.3', 80)
+        ]
+        gevent.joinall(greenlets, raise_error=True)
+
+        self.backend.lb_add_endpoints.assert_called_once_with(self.lb,
+            [('1.1.1.1', 80), ('2.2.2.2', 80)])
+        self.backend.lb_remove_endpoints.assert_called_once_with(self.lb,
+            [('3.3.3.3', 80)])
+        eq_(self.batcher.batches, {})
+
+    @patch('django.conf.settings.STRETCH_LB_BATCH_WINDOW', 0.01)
+    def test_apply_error(self):
+        self.backend.lb_add_endpoints.side_effect = ValueError()
+        with assert_raises(ValueError):
+            self.batcher.apply('add', self.lb, '1.1.1.1', 80)
+
+    @patch('django.conf.settings.STRETCH_LB_BATCH_WINDOW', 0.01)
+    def test_apply_mixed_batch(self):
+        def add_endpoints(lb, endpoints):
+            if ('2.2.2.2', 80) in endpoints:
+                raise ValueError()
+        self.backend.lb_add_endpoints.side_effect = add_endpoints
+
+        greenlets = [
+            gevent.spawn(self.batcher.apply, 'add', self.lb, '1.1.1.1', 80),
+            gevent.spawn(self.batcher.apply, 'add', self.lb, '2.2.2.2', 80)
+        ]
+        gevent.joinall(greenlets)
+
+        assert greenlets[0].successful()
+        assert isinstance(greenlets[1].exception, ValueError)
+        eq_(self.backend.lb_add_endpoints.call_args_list, [
+            call(self.lb, [('1.1.1.1', 80), ('2.2.2.2', 80)]),
+            call(self.lb, [('1.1.1.1', 80)]),
+            call(self.lb, [('2.2.2.2', 80)])
+        ])
+
+    @patch('django.conf.settings.STRETCH_LB_BATCH_WINDOW', 0)
+    def test_apply_without_window(self):
+        self.batcher.apply('remove', self.lb, '1.1.1.1', 80)
+        self.backend.lb_remove_endpoints.assert_called_with(self.lb,
+            [('1.1.1.1', 80)])
+
+
+class TestSimulator(TestCase):
+    @patch('stretch.backends.simulated.gevent')
+    def test_call(self, gevent):
+        simulator = simulated.Simulator(latency={'call': (10.0, 0.0)},
+                                        time_scale=0.5, seed=1)
+        simulator.call('call')
+        gevent.sleep.assert_called_with(5.0)
+        simulator.call('unknown')
+        gevent.sleep.assert_called_with(0.0)
+        eq_(simulator.stats['call']['calls'], 1)
+
+    @patch('stretch.backends.simulated.gevent', Mock())
+    def test_call_failure(self):
+        simulator = simulated.Simulator(failure_rate={'call': 1.0})
+        with assert_raises(simulated.SimulatedFailure):
+            simulator.call('call')
+        eq_(simulator.stats['call']['failures'], 1)
+
+    @patch('stretch.backends.simulated.time')
+    @patch('stretch.backends.simulated.gevent')
+    def test_rate_limit(self, gevent, time):
+        time.time.return_value = 100.0
+        simulator = simulated.Simulator(latency={'call': (0.0, 0.0)},
+                                        rate_limit=2)
+        for _ in range(3):
+            simulator.call('call')
+        gevent.sleep.assert_has_calls([call(0.5), call(1.0)], any_order=True)
+        eq_(simulator.stats['call']['throttled'], 2)
+
+
+class TestSimulatedBackend(TestCase):
+    def setUp(self):
+        super(TestSimulatedBackend, self).setUp()
+        patcher = patch('stretch.backends.simulated.gevent')
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.backend = simulated.SimulatedBackend({'seed': 1})
+
+    def test_hosts(self):
+        hosts = [mock_attr(fqdn='a'), mock_attr(fqdn='b')]
+        addresses = [self.backend.create_host(host) for host in hosts]
+        eq_(addresses, ['10.0.0.1', '10.0.0.2'])
+        self.backend.delete_host(hosts[0])
+        eq_(self.backend.hosts, {'b': '10.0.0.2'})
+        eq_(self.backend.uses_salt, False)
+
+    def test_lb_endpoints(self):
+        lb = mock_attr(pk='lb')
+        self.backend.create_lb(lb)
+        self.backend.lb_add_endpoints(lb, [('a', 80), ('b', 80)])
+        self.backend.lb_remove_endpoints(lb, [('a', 80)])
+        eq_(self.backend.lbs['lb'], set([('b', 80)]))
+        self.backend.delete_lb(lb)
+        eq_(self.backend.lbs, {})
+
+    def test_lb_drain_host(self):
+        lb = mock_attr(pk='lb')
+        self.backend.create_lb(lb)
+        self.backend.lb_add_endpoints(lb, [('a', 80), ('b', 80)])
+        self.backend.connections.update({'a': 8, 'b': 8})
+
+        eq_(self.backend.lb_drain_host(lb, 'a'), True)
+
+        eq_(self.backend.lb_get_connections(lb), {'a': 4, 'b': 8})
+        eq_(self.backend.lb_get_connections(lb), {'a': 2, 'b': 8})
@@ -1,4 +1,4 @@
-from mock import patch
+from mock import patch, call
 
 from stretch import commands
 
@@ -24,3 +24,27 @@ def test_run():
         commands.run(['celery'])
         run_from_argv.assert_called_with(['manage.py', 'celery', 'worker'])
 '''
+
+
+@patch('stretch.commands.socket.gethostname', return_value='host')
+@patch('stretch.commands.celery.Command')
+def test_run_celery_worker(Command, gethostname):
+    with patch('django.conf.settings.STRETCH_CELERY_WORKERS', {
+        'builds': {'pool': 'processes', 'concurrency': 2,
+                   'prefetch_multiplier': 1}
+    }):
+        commands.run(['celery', 'builds'])
+    Command.return_value.run_from_argv.assert_called_with([
+        'manage.py', 'celery', 'worker', '-Q', 'builds', '-n', 'builds.host',
+        '-P', 'processes', '-c', '2', '--', 'celeryd.prefetch_multiplier=1'
+    ])
+
+
+@patch('stretch.commands.multiprocessing.Process')
+def test_run_celery_workers(Process):
+    commands.run_celery_workers(['builds', 'deploys'])
+    Process.assert_has_calls([
+        call(target=commands.run_celery_worker, args=('builds',)),
+        call(target=commands.run_celery_worker, args=('deploys',))
+    ], any_order=True)
+    Process.return_value.join.assert_called_with()
@@ -136,3 +136,29 @@ class TestEtcdConfigManager(TestCase):
 
         with assert_raises(ValueError):
             cm = config_managers.EtcdConfigManager('')
+
+
+class TestLocalConfigManager(TestCase):
+    def setUp(self):
+        super(TestLocalConfigManager, self).setUp()
+        self.cm = config_managers.LocalConfigManager()
+
+    def test_set_get(self):
+        self.cm.set('/key', 'value')
+        eq_(self.cm.get('/key'), 'value')
+        with assert_raises(KeyError):
+            self.cm.get('/other')
+
+    def test_delete(self):
+        self.cm.set_dict('/key', {'a': 1, 'b': {'c': 2}})
+        self.cm.set('/keys', 3)
+        self.cm.delete('/key')
+        eq_(self.cm.values, {'/keys': 3})
+
+
+class TestGetConfigManager(TestCase):
+    @patch('django.conf.settings.STRETCH_CONFIG_MANAGER',
+           'stretch.config_managers.LocalConfigManager')
+    def test_get_config_manager(self):
+        manager = config_managers.get_config_manager.func()
+        assert isinstance(manager, config_managers.LocalConfigManager)
@@ -0,0 +1,99 @@
+from mock import Mock, patch
+from nose.tools import eq_
+from unittest import TestCase
+
+from stretch import planner
+from stretch.testutils import mock_attr, patch_settings
+
+
+class TestDeployPlan(TestCase):
+    def setUp(self):
+        self.node = mock_attr(name='web')
+        self.node.get_image.return_value = 'reg/sys1/web'
+
+        self.group = mock_attr(name='web', batch_size=2)
+        self.host1 = mock_attr(pk=1, name='host1', group=self.group,
+                               nodes=[self.node])
+        self.host1.agent.get_images.return_value = [
+            {'image': 'reg/sys1/web:old', 'size': 100}
+        ]
+        self.host1.instances.all.return_value.count.return_value = 3
+        self.host2 = mock_attr(pk=2, name='host2', group=self.group,
+                               nodes=[self.node])
+        self.host2.agent.get_images.return_value = [
+            {'image': 'reg/sys1/web:sha', 'size': 120}
+        ]
+        self.host2.instances.all.return_value.count.return_value = 1
+
+        self.env = mock_attr(name='env')
+        self.env.get_hosts.return_value = [self.host1, self.host2]
+        self.env.groups.all.return_value = [self.group]
+        self.env.current_release.sha = 'old'
+        self.env.current_release.manifest = {
+            'nodes': ['web', 'worker'],
+            'migrations': {'db': '1-a.js'}
+        }
+        self.release = mock_attr(sha='sha', prepared_marker='/prepared')
+        self.release.manifest = {
+            'nodes': ['web'],
+            'migrations': {'db': '2-b.js'}
+        }
+
+    @patch_settings('STRETCH_BATCH_SIZE', 5)
+    @patch_settings('STRETCH_PLAN_PULL_RATE', 10)
+    @patch_settings('STRETCH_PLAN_STAGE_SECONDS', {
+        'build_plugins': 30.0, 'pre_deploy': 10.0, 'mount_templates': 1.0,
+        'pull': 5.0, 'restart': 10.0, 'post_deploy': 10.0
+    })
+    @patch('stretch.planner.os.path.exists', return_value=False)
+    def test_plan(self, exists):
+        plan = planner.DeployPlan(self.env, self.release).as_dict()
+
+        eq_(plan['diff'], {
+            'existing_release': 'old',
+            'added_nodes': [],
+            'removed_nodes': ['worker'],
+            'migrations': ['db'],
+            'prepared': False
+        })
+        host1, host2 = plan['hosts']
+        eq_(host1['pulls'], [{'node': 'web', 'image': 'reg/sys1/web:sha',
+                              'present': False, 'bytes': 120}])
+        eq_(host1['seconds'], 17.0)
+        eq_(host2['bytes'], 0)
+        eq_(plan['bytes'], 120)
+        eq_(plan['groups'], [{'name': 'web', 'restarts': 4, 'batch_size': 2,
+                              'batches': 2}])
+        eq_([(s['stage'], s['target'], s['seconds'])
+             for s in plan['critical_path']], [
+            ('build_plugins', None, 30.0),
+            ('pre_deploy', None, 10.0),
+            ('mount_templates', None, 1.0),
+            ('pull', 'host1', 17.0),
+            ('restart', 'web', 20.0),
+            ('post_deploy', None, 10.0)
+        ])
+        eq_(plan['duration'], 88.0)
+
+    @patch_settings('STRETCH_BATCH_SIZE', 5)
+    @patch('stretch.planner.os.path.exists', return_value=True)
+    def test_plan_without_inventory(self, exists):
+        self.host1.agent.get_images.side_effect = Exception()
+        self.host2.agent.get_images.side_effect = Exception()
+        for host in (self.host1, self.host2):
+            instances = host.instances.all.return_value
+            instances.filter.return_value.count.return_value = 1
+        plan = planner.DeployPlan(self.env, self.release, ['web'])
+
+        eq_(plan.hosts[0]['inventory'], False)
+        eq_(plan.hosts[0]['pulls'][0]['bytes'], None)
+        eq_(plan.diff['prepared'], True)
+        assert 'build_plugins' not in [s['stage'] for s in plan.critical_path]
+        self.env.get_hosts.assert_called_with(['web'])
+
+    def test_get_estimate(self):
+        plan = Mock(timings={'restart': {'count': 4, 'p50': 3.0, 'p95': 8.0},
+                             'pull': {'count': 0, 'p50': None, 'p95': None}})
+        with patch_settings('STRETCH_PLAN_STAGE_SECONDS', {'pull': 5.0}):
+            eq_(planner.DeployPlan.get_estimate.im_func(plan, 'restart'), 3.0)
+            eq_(planner.DeployPlan.get_estimate.im_func(plan, 'pull'), 5.0)
@@ -0,0 +1,88 @@
+from mock import Mock, patch
+from nose.tools import eq_, assert_raises
+from testtools import TestCase
+
+from stretch import resilience, testutils
+from stretch.exceptions import CircuitOpen, DeadlineExceeded
+
+
+class TestResilience(TestCase):
+    def setUp(self):
+        super(TestResilience, self).setUp()
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+
+        patcher = patch('stretch.resilience.gevent.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for name, value in (
+                ('STRETCH_RETRY_POLICIES', {'agent': {'attempts': 3}}),
+                ('STRETCH_BREAKER_THRESHOLD', 3),
+                ('STRETCH_BREAKER_RESET_TIMEOUT', 30)):
+            patcher = testutils.patch_settings(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_call(self):
+        func = Mock(return_value='result')
+        eq_(resilience.call('agent:a', func, (1,), {'k': 'v'}), 'result')
+        func.assert_called_once_with(1, k='v')
+        assert not self.sleep.called
+
+    def test_call_retries(self):
+        func = Mock(side_effect=[IOError(), IOError(), 'result'])
+        eq_(resilience.call('agent:a', func), 'result')
+        eq_(func.call_count, 3)
+        eq_(self.sleep.call_count, 2)
+        eq_(resilience.get_stats()['counters']['agent']['retries'], 2)
+
+    def test_call_gives_up(self):
+        func = Mock(side_effect=IOError())
+        with assert_raises(IOError):
+            resilience.call('agent:a', func, attempts=2)
+        eq_(func.call_count, 2)
+
+    def test_call_not_retryable(self):
+        error = IOError()
+        error.response = Mock(status_code=404)
+        func = Mock(side_effect=error)
+        with assert_raises(IOError):
+            resilience.call('agent:a', func)
+        eq_(func.call_count, 1)
+        eq_(resilience.get_breaker('agent:a').failures, 0)
+
+    def test_call_deadline_exceeded(self):
+        func = Mock(side_effect=DeadlineExceeded())
+        with assert_raises(DeadlineExceeded):
+            resilience.call('agent:a', func)
+        eq_(func.call_count, 1)
+
+    @patch('stretch.resilience.time.time')
+    def test_circuit_breaker(self, time):
+        time.return_value = 100.0
+        func = Mock(side_effect=IOError())
+        with assert_raises(IOError):
+            resilience.call('agent:a', func)
+        eq_(func.call_count, 3)
+        eq_(resilience.get_stats()['open'], ['agent:a'])
+
+        # Calls fail fast while the breaker is open
+        with assert_raises(CircuitOpen):
+            resilience.call('agent:a', func)
+        eq_(func.call_count, 3)
+        resilience.call('agent:b', Mock())
+
+        # One trial call closes the breaker again
+        time.return_value = 131.0
+        func.side_effect = None
+        resilience.call('agent:a', func)
+        eq_(resilience.get_stats()['open'], [])
+
+    def test_is_transient(self):
+        eq_(resilience.is_transient(IOError()), True)
+        eq_(resilience.is_transient(Mock(code=503, response=None)), True)
+        eq_(resilience.is_transient(Mock(code=429, response=None)), True)
+        eq_(resilience.is_transient(Mock(code=404, response=None)), False)
+        eq_(resilience.is_transient(Mock(response=Mock(status_code=400))),
+            False)
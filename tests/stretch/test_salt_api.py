@@ -0,0 +1,54 @@
+from mock import patch
+from nose.tools import eq_
+from testtools import TestCase
+
+from stretch import salt_api
+
+
+class TestMinionEvents(TestCase):
+    def setUp(self):
+        super(TestMinionEvents, self).setUp()
+        patcher = patch('stretch.salt_api.master_opts',
+                        return_value={'sock_dir': '/tmp/salt'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('stretch.salt_api.salt.utils.event.MasterEvent')
+        self.master_event = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.event = self.master_event.return_value
+
+    def test_matches(self):
+        events = salt_api.MinionEvents('a.example.com')
+        assert events.matches('pending', 'salt/auth',
+                              {'id': 'a.example.com', 'act': 'pend'})
+        assert not events.matches('pending', 'salt/auth',
+                                  {'id': 'a.example.com', 'act': 'accept'})
+        assert not events.matches('pending', 'salt/auth',
+                                  {'id': 'b.example.com', 'act': 'pend'})
+        assert events.matches('start', 'minion_start', {'id': 'a.example.com'})
+        assert events.matches('start', 'salt/minion/a.example.com/start',
+                              {'id': 'a.example.com'})
+        assert not events.matches('start', 'salt/auth',
+                                  {'id': 'a.example.com'})
+
+    def test_wait(self):
+        self.event.get_event.side_effect = [
+            None,
+            {'tag': 'minion_start', 'data': {'id': 'b.example.com'}},
+            {'tag': 'minion_start', 'data': {'id': 'a.example.com'}}
+        ]
+        with salt_api.MinionEvents('a.example.com') as events:
+            eq_(events.wait('start', 10), True)
+        eq_(self.event.get_event.call_count, 3)
+        self.event.destroy.assert_called_with()
+
+    def test_wait_timeout(self):
+        self.event.get_event.return_value = None
+        with salt_api.MinionEvents('a.example.com') as events:
+            eq_(events.wait('start', 0), False)
+
+    def test_unavailable(self):
+        self.master_event.side_effect = IOError()
+        with salt_api.MinionEvents('a.example.com') as events:
+            eq_(events.wait('start', 10), False)
@@ -1,8 +1,10 @@
 from mock import Mock, patch, call
 from nose.tools import eq_, assert_raises
+import time
 import errno
+import gevent
 
-from stretch import utils, testutils
+from stretch import utils, testutils, exceptions
 
 
 def test_update():
@@ -80,25 +82,134 @@ def test_generate_random_hex(choice):
     eq_(utils.generate_random_hex(4), 'aaaa')
 
 
-@patch('stretch.utils.time')
-def test_map_groups(mock_time):
-    # TODO: refactor to test batch_size
-
+def test_map_groups():
     on_finish = Mock()
 
     def callback(item):
-        def is_finished():
-            return 'result'
-        return is_finished
+        return item * 2
 
     groups = {'g1': [1, 2, 3], 'g2': [4, 5, 6, 7, 8, 9, 10]}
-    result = utils.map_groups(callback, groups, 3, on_finish, 1.0)
-
-    expected_result = [call(_, 'result') for _ in xrange(10)]
-    assert testutils.check_items_equal(result, expected_result)
-    assert testutils.check_items_equal(on_finish.mock_calls, expected_result)
-
-    mock_time.sleep.assert_called_with(1.0)
+    result = utils.map_groups(callback, groups, 3, on_finish)
+
+    eq_(result, dict((i, i * 2) for i in xrange(1, 11)))
+    on_finish.assert_has_calls([call(i, i * 2) for i in xrange(1, 11)],
+                               any_order=True)
+
+
+def test_scheduler_limits_groups():
+    state = {'running': 0, 'max': 0}
+
+    def job():
+        state['running'] += 1
+        state['max'] = max(state['max'], state['running'])
+        gevent.sleep(0)
+        state['running'] -= 1
+
+    def spawn(limit, group):
+        state['max'] = 0
+        scheduler = utils.Scheduler(limit)
+        for i in xrange(6):
+            scheduler.spawn(group, i, job)
+        scheduler.join()
+        return state['max']
+
+    limits = {'a': 2, 'b': 1, 'c': None}
+    eq_(spawn(limits.get, 'b'), 1)
+    eq_(spawn(limits.get, 'a'), 2)
+    eq_(spawn(limits.get, 'c'), 6)
+
+
+def test_scheduler_groups_run_concurrently():
+    running = set()
+    seen = []
+
+    def job(group):
+        running.add(group)
+        seen.append(set(running))
+        gevent.sleep(0)
+        running.discard(group)
+
+    scheduler = utils.Scheduler(1)
+    scheduler.spawn('a', 1, job, 'a')
+    scheduler.spawn('b', 2, job, 'b')
+    scheduler.spawn('a', 3, job, 'a')
+    eq_(scheduler.join(), {1: None, 2: None, 3: None})
+    # A full group 'a' does not hold back group 'b'
+    assert set(['a', 'b']) in seen
+
+
+@patch('stretch.utils.time.time')
+def test_scheduler_deadline(time):
+    time.return_value = 100.0
+    scheduler = utils.Scheduler(1)
+    scheduler.spawn('a', 1, gevent.sleep, 1)
+    with utils.deadline(expires_at=100.01):
+        with assert_raises(exceptions.DeadlineExceeded):
+            scheduler.join()
+
+
+def test_heartbeat():
+    beats = []
+
+    def beat():
+        beats.append(None)
+        raise ValueError()
+
+    with utils.heartbeat(beat, 0.01):
+        time.sleep(0.1)
+    count = len(beats)
+    assert count > 1
+    time.sleep(0.05)
+    eq_(len(beats), count)
+
+
+def test_wait():
+    jobs = [gevent.spawn(lambda: 'a'), gevent.spawn(lambda: 'b')]
+    eq_(utils.wait(jobs), ['a', 'b'])
+
+    def fail():
+        raise ValueError()
+
+    with assert_raises(ValueError):
+        utils.wait([gevent.spawn(fail)])
+
+
+@patch('stretch.utils.time.time', return_value=100.0)
+def test_deadline(time):
+    eq_(utils.get_timeout(5), 5)
+    with utils.deadline(10) as deadline:
+        eq_(deadline.expires_at, 110.0)
+        eq_(utils.get_timeout(), 10.0)
+        eq_(utils.get_timeout(5), 5)
+        with utils.deadline(60):
+            # Nested deadlines cannot extend the budget
+            eq_(utils.get_deadline().expires_at, 110.0)
+        with utils.deadline(2):
+            eq_(utils.get_timeout(5), 2.0)
+        time.return_value = 111.0
+        assert_raises(exceptions.DeadlineExceeded, utils.get_timeout)
+    eq_(utils.get_deadline().expires_at, None)
+
+
+def test_run_cmd_deadline():
+    with utils.deadline(0.2):
+        assert_raises(exceptions.DeadlineExceeded, utils.run_cmd,
+                      ['sleep', '5'])
+
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3, 6, 7, 8, 9, 10]
+    eq_(utils.percentile(values, 50), 5)
+    eq_(utils.percentile(values, 95), 10)
+    eq_(utils.percentile([3], 50), 3)
+    eq_(utils.percentile([], 50), None)
+
+
+def test_jittered_backoff():
+    delays = list(utils.jittered_backoff(6, base=1.0, cap=10.0))
+    eq_(len(delays), 6)
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= min(10.0, 2 ** attempt)
 
 
 def test_group_by_attr():